@@ -0,0 +1,134 @@
+# activity_buffer.py
+import asyncio
+import os
+import time
+
+from database import stats_db
+
+
+class ActivityBuffer:
+    """Буфер отложенной записи heartbeat-активности пользователей"""
+
+    def __init__(self, db, flush_interval=2.0, max_batch=500, presence_interval=30.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.presence_interval = presence_interval
+
+        # user_id -> (username, last_seen); повторные heartbeat схлопываются
+        self._pending = {}
+        self._flush_lock = asyncio.Lock()
+        self._size_flush_task = None
+        self._tasks = []
+
+        self.stats = {
+            'heartbeats': 0,
+            'flushes': 0,
+            'rows_written': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0,
+        }
+
+    def add(self, user_id, username=None):
+        """Регистрирует heartbeat без обращения к базе"""
+        previous = self._pending.get(user_id)
+        if username is None and previous:
+            username = previous[0]
+        self._pending[user_id] = (username, int(time.time()))
+        self.db.presence.touch(user_id)
+        self.stats['heartbeats'] += 1
+
+        if len(self._pending) >= self.max_batch and not self._size_flush_task:
+            self._size_flush_task = asyncio.get_running_loop().create_task(self._size_flush())
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def _size_flush(self):
+        try:
+            await self.flush()
+        finally:
+            self._size_flush_task = None
+
+    async def flush(self):
+        """Записывает накопленную активность одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            entries = [(user_id, username, last_seen) for user_id, (username, last_seen) in batch.items()]
+
+            started = time.perf_counter()
+            try:
+                await self.db.run(self.db.register_activity_batch, entries)
+            except Exception as e:
+                print(f"Activity flush error: {e}")
+                self.stats['flush_errors'] += 1
+                # Возвращаем записи в буфер, не затирая более свежие heartbeat
+                for user_id, value in batch.items():
+                    self._pending.setdefault(user_id, value)
+                return 0
+
+            self.stats['flushes'] += 1
+            self.stats['rows_written'] += len(entries)
+            self.stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            return len(entries)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def sync_presence(self):
+        """Снимок онлайна в SQLite и подхват активности других воркеров"""
+        try:
+            await self.db.run(self.db.sync_presence)
+        except Exception as e:
+            print(f"Presence sync error: {e}")
+
+    async def _presence_loop(self):
+        while True:
+            await self.sync_presence()
+            await asyncio.sleep(self.presence_interval)
+
+    def start(self):
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._flush_loop()),
+            loop.create_task(self._presence_loop()),
+        ]
+
+    async def stop(self):
+        """Останавливает фоновые задачи и сбрасывает остаток буфера"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._size_flush_task:
+            await asyncio.gather(self._size_flush_task, return_exceptions=True)
+        # База не открылась при запуске: писать некуда
+        if not self.db.ready:
+            return
+        await self.flush()
+        await self.sync_presence()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = len(self._pending)
+        stats['online'] = self.db.presence.count()
+        return stats
+
+
+activity_buffer = ActivityBuffer(
+    stats_db,
+    flush_interval=float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 2.0)),
+    max_batch=int(os.environ.get('ACTIVITY_BATCH_SIZE', 500)),
+    presence_interval=float(os.environ.get('PRESENCE_SNAPSHOT_INTERVAL', 30.0)),
+)
@@ -0,0 +1,273 @@
+# admission.py
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from instrumentation import loop_monitor
+from metrics import FINE_BUCKETS_MS, Histogram
+
+# Классы эндпоинтов: меньше — важнее. Платежи обслуживаются раньше записей, записи раньше чтений
+PRIORITIES = {'payment': 0, 'write': 1, 'read': 2}
+
+# Токен-бакеты по классам: (токенов в секунду, запас)
+DEFAULT_LIMITS = {
+    'payment': (5.0, 30),
+    'write': (5.0, 30),
+    'read': (20.0, 100),
+}
+
+
+def parse_limits(spec):
+    """'payment=5:30,read=20:100' -> {класс: (rate, burst)}; 'off' — без ограничения частоты"""
+    if spec is None or spec.strip() == '':
+        return dict(DEFAULT_LIMITS)
+    if spec.strip().lower() == 'off':
+        return {}
+    limits = dict(DEFAULT_LIMITS)
+    for item in spec.split(','):
+        name, _, value = item.partition('=')
+        rate, _, burst = value.partition(':')
+        name = name.strip()
+        if name not in PRIORITIES:
+            raise ValueError(f'Unknown admission class: {name}')
+        limits[name] = (float(rate), float(burst or rate))
+    return limits
+
+
+class Rejected(Exception):
+    """Запрос не допущен: status 429 (лимит частоты) или 503 (перегрузка), retry_after в секундах"""
+
+    def __init__(self, status, reason, retry_after=1.0):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, rate, burst, now):
+        """Списывает токен; 0, если он был, иначе время до появления следующего"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """Токен-бакеты по (клиент, класс эндпоинта) в LRU ограниченного размера"""
+
+    def __init__(self, limits=None, max_keys=10000):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.evictions = 0
+
+    def check(self, identity, admission_class, now=None):
+        """0, если запрос укладывается в лимит, иначе секунды до следующей попытки"""
+        limit = self.limits.get(admission_class)
+        if limit is None:
+            return 0.0
+        rate, burst = limit
+        now = time.monotonic() if now is None else now
+        key = (identity, admission_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(burst, now)
+            # Вытесняется давно молчавший клиент: его бакет все равно успел бы наполниться
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(rate, burst, now)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """Допуск запросов к API: лимит частоты на клиента, общий предел параллельности и короткая очередь с приоритетами"""
+
+    def __init__(self, max_concurrent=64, queue_size=128, queue_timeout=0.5, reserved=8, limiter=None,
+                 user_limiter=None, max_lag_ms=None, lag_source=None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        # Последние reserved слотов не достаются чтениям: платежам всегда есть куда войти
+        self.reserved = min(reserved, self.max_concurrent - 1)
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        # Бакеты по user_id — отдельный LRU: сменой id нельзя вытеснить бакеты адресов
+        self.user_limiter = user_limiter if user_limiter is not None else RateLimiter(self.limiter.limits)
+        # Обработчики почти не ждут ввода-вывода: перегрузка видна как задержка event loop, а не как in_flight
+        self.max_lag_ms = max_lag_ms
+        self.lag_source = lag_source
+
+        self.in_flight = 0
+        # Куча (приоритет, порядок, future); отмененные ожидания удаляются лениво
+        self._waiters = []
+        self._queued = 0
+        self._order = itertools.count()
+        self.queue_wait = Histogram(FINE_BUCKETS_MS)
+        self.stats = {name: {'admitted': 0, 'queued': 0, 'rate_limited': 0, 'shed': 0} for name in PRIORITIES}
+
+    def _capacity(self, priority):
+        if priority == PRIORITIES['read']:
+            return self.max_concurrent - self.reserved
+        return self.max_concurrent
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= self._capacity(priority):
+                return
+            heapq.heappop(self._waiters)
+            self._queued -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _shed_worst(self, priority):
+        """Освобождает место в полной очереди, вытесняя самое позднее ожидание с худшим приоритетом"""
+        live = [entry for entry in self._waiters if not entry[2].done()]
+        if not live:
+            return True
+        worst = max(live, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            return False
+        self._queued -= 1
+        worst[2].set_exception(Rejected(503, 'Server is busy'))
+        return True
+
+    async def _wait_turn(self, admission_class, priority):
+        if self._queued >= self.queue_size and not self._shed_worst(priority):
+            raise Rejected(503, 'Server is busy')
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._queued += 1
+        self.stats[admission_class]['queued'] += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except Rejected:
+            # Вытеснен более важным запросом: из очереди уже вычтен
+            raise
+        except asyncio.TimeoutError:
+            self._queued -= 1
+            raise Rejected(503, 'Server is busy')
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Слот уже выдан, но клиент ушел: возвращаем его следующему
+                self._release()
+            elif not (future.done() and not future.cancelled()):
+                self._queued -= 1
+            raise
+        finally:
+            self.queue_wait.observe((time.perf_counter() - started) * 1000)
+
+    def _check_rate(self, admission_class, identity, user_key=None):
+        # Бакет адреса списывается всегда; бакет пользователя только дополнительно ограничивает
+        retry_after = self.limiter.check(identity, admission_class)
+        if retry_after or user_key is None:
+            return retry_after
+        return self.user_limiter.check(user_key, admission_class)
+
+    @asynccontextmanager
+    async def admit(self, admission_class, identity, user_key=None):
+        """Держит слот на время обработки; Rejected, если запрос не допущен"""
+        stats = self.stats[admission_class]
+        retry_after = self._check_rate(admission_class, identity, user_key)
+        if retry_after:
+            stats['rate_limited'] += 1
+            raise Rejected(429, 'Too many requests', retry_after)
+
+        priority = PRIORITIES[admission_class]
+        if (priority == PRIORITIES['read'] and self.max_lag_ms and self.lag_source is not None
+                and self.lag_source() > self.max_lag_ms):
+            stats['shed'] += 1
+            raise Rejected(503, 'Server is busy')
+        if self.in_flight < self._capacity(priority):
+            self.in_flight += 1
+        else:
+            try:
+                await self._wait_turn(admission_class, priority)
+            except Rejected:
+                stats['shed'] += 1
+                raise
+        stats['admitted'] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def get_stats(self):
+        stats = {
+            'in_flight': self.in_flight,
+            'queued': self._queued,
+            'max_concurrent': self.max_concurrent,
+            'queue_size': self.queue_size,
+            'rate_limit_keys': len(self.limiter),
+            'rate_limit_evictions': self.limiter.evictions,
+            'user_rate_limit_keys': len(self.user_limiter),
+            'user_rate_limit_evictions': self.user_limiter.evictions,
+        }
+        for name, counters in self.stats.items():
+            for key, value in counters.items():
+                stats[f'{name}_{key}'] = value
+        stats['queue_wait'] = self.queue_wait.snapshot()
+        return stats
+
+
+# За обратным прокси (Render, nginx) адрес клиента приходит в X-Forwarded-For
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', '1' if os.environ.get('RENDER') else '0') == '1'
+
+# Сколько своих прокси дописывают адрес в X-Forwarded-For: левее них значения присылает сам клиент
+TRUSTED_PROXY_HOPS = max(1, int(os.environ.get('TRUSTED_PROXY_HOPS', 1)))
+
+
+def client_identity(request):
+    """Ключ лимита по адресу клиента: адрес, дописанный нашим прокси справа, а не левое значение клиента"""
+    forwarded = request.headers.get('X-Forwarded-For') if TRUST_PROXY_HEADERS else None
+    if forwarded:
+        hops = [hop.strip() for hop in forwarded.split(',')]
+        address = hops[-TRUSTED_PROXY_HOPS] if len(hops) >= TRUSTED_PROXY_HOPS else hops[0]
+        if address:
+            return f'ip:{address}'
+    return f'ip:{request.remote}'
+
+
+def user_identity(params, data):
+    """Дополнительный ключ лимита по user_id, только для эндпоинтов, чья схема его принимает"""
+    user_id = data.get('user_id') if params and 'user_id' in params else None
+    return f'user:{user_id}' if user_id else None
+
+
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get('ADMISSION_MAX_CONCURRENT', 64)),
+    queue_size=int(os.environ.get('ADMISSION_QUEUE_SIZE', 128)),
+    queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5)),
+    reserved=int(os.environ.get('ADMISSION_RESERVED', 8)),
+    limiter=RateLimiter(parse_limits(os.environ.get('RATE_LIMITS')),
+                        max_keys=int(os.environ.get('RATE_LIMIT_KEYS', 10000))),
+    user_limiter=RateLimiter(parse_limits(os.environ.get('RATE_LIMITS')),
+                             max_keys=int(os.environ.get('RATE_LIMIT_KEYS', 10000))),
+    max_lag_ms=float(os.environ.get('ADMISSION_MAX_LAG_MS', 100)),
+    lag_source=lambda: loop_monitor.last_ms
+)
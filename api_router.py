@@ -0,0 +1,131 @@
+# api_router.py
+import time
+
+from metrics import Histogram
+
+
+class ApiError(Exception):
+    """Ошибка запроса, которую отдаем клиенту как {'success': False, 'error': ...}"""
+
+
+class Endpoint:
+    """Описание эндпоинта: обработчик, методы, схема параметров и тип ответа"""
+
+    def __init__(self, name, handler, methods=('GET', 'POST'), params=None, response='json', cache_version=None,
+                 admission_class='read'):
+        self.name = name
+        self.handler = handler
+        self.methods = frozenset(methods)
+        # None — обработчик вызывается без данных запроса; иначе {имя: тип}
+        self.params = params
+        self.response = response
+        # Асинхронная функция версии данных: пока она не изменилась, ответ берется из кэша
+        self.cache_version = cache_version
+        # Класс для допуска запросов (admission.PRIORITIES): лимиты частоты и приоритет в очереди
+        self.admission_class = admission_class
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latency = Histogram()
+
+    def coerce(self, data):
+        """Приводит параметры к типам из схемы; лишние поля пропускает как есть"""
+        data = dict(data)
+        for name, kind in self.params.items():
+            value = data.get(name)
+            if value is None or value == '' or isinstance(value, kind):
+                continue
+            try:
+                data[name] = kind(value)
+            except (TypeError, ValueError):
+                raise ApiError(f'Invalid parameter: {name}')
+        return data
+
+    def cache_key(self, data):
+        """Ключ кэша: имя и параметры схемы после приведения типов, пустые значения равны отсутствующим"""
+        if self.params is None:
+            return (self.name,)
+        data = self.coerce(data)
+        return (self.name,) + tuple((name, data.get(name) if data.get(name) != '' else None)
+                                    for name in sorted(self.params))
+
+    async def call(self, data):
+        if self.params is None:
+            return await self.handler()
+        return await self.handler(self.coerce(data))
+
+    def get_stats(self):
+        stats = {
+            'methods': sorted(self.methods),
+            'admission_class': self.admission_class,
+            'requests': self.requests,
+            'cache_hits': self.cache_hits,
+            'failures': self.failures,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+        }
+        stats.update(self.latency.snapshot())
+        return stats
+
+
+class ApiRouter:
+    """Таблица эндпоинтов /api/{endpoint}: поиск по точному имени вместо цепочки if"""
+
+    def __init__(self):
+        self.endpoints = {}
+
+    def register(self, name, handler, methods=('GET', 'POST'), params=None, response='json', cache_version=None,
+                 admission_class='read'):
+        if name in self.endpoints:
+            raise ValueError(f'Endpoint already registered: {name}')
+        endpoint = Endpoint(name, handler, methods, params, response, cache_version, admission_class)
+        self.endpoints[name] = endpoint
+        return endpoint
+
+    def get(self, name):
+        return self.endpoints.get(name)
+
+    async def dispatch(self, endpoint, data):
+        """Вызывает эндпоинт и учитывает задержку, ошибки и неуспешные ответы"""
+        endpoint.requests += 1
+        endpoint.in_flight += 1
+        started = time.perf_counter()
+        try:
+            result = await endpoint.call(data)
+        except ApiError:
+            endpoint.failures += 1
+            raise
+        except Exception:
+            endpoint.errors += 1
+            raise
+        finally:
+            endpoint.in_flight -= 1
+            endpoint.latency.observe((time.perf_counter() - started) * 1000)
+
+        if isinstance(result, dict) and result.get('success') is False:
+            endpoint.failures += 1
+        return result
+
+    async def dispatch_cached(self, endpoint, data, cache):
+        """Как dispatch, но успешный ответ кодируется один раз на версию данных: CachedResponse или dict ошибки"""
+        started = time.perf_counter()
+        key = endpoint.cache_key(data)
+        version = await endpoint.cache_version()
+        entry = cache.get(key, version)
+        if entry is not None:
+            endpoint.requests += 1
+            endpoint.cache_hits += 1
+            endpoint.latency.observe((time.perf_counter() - started) * 1000)
+            return entry
+
+        result = await self.dispatch(endpoint, data)
+        if not isinstance(result, dict) or result.get('success') is False:
+            return result
+        # Версия снята до вызова: если данные изменились во время расчета, следующий запрос пересчитает
+        return cache.put(key, version, result)
+
+    def get_stats(self):
+        return {name: endpoint.get_stats() for name, endpoint in self.endpoints.items()}
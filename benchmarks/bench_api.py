@@ -0,0 +1,127 @@
+# benchmarks/bench_api.py
+"""Нагрузочный прогон API в одном процессе: задержки p50/p95/p99 и RPS по эндпоинтам.
+
+Запуск: python benchmarks/bench_api.py [--seconds 10] [--concurrency 32] [--replay traffic.jsonl] [--json]
+
+Приложение из main.init_app() поднимается на локальном порту поверх временной
+базы SQLite. Запросы берутся из синтетической смеси (benchmarks/traffic.py)
+или из записанного трафика --replay: JSONL со строками
+{"method": "GET", "endpoint": "get_statistics", "data": {}}.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from traffic import load_recorded, replay, summarize, synthetic
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    # Путь базы stats_db читает при импорте, а файл и пул открываются позже, в init_database(): задаем его заранее
+    os.environ['STATS_DB_PATH'] = os.path.join(args.tmp, 'bench.db')
+    # Все синтетические клиенты приходят с одного адреса: лимиты частоты на клиента не применяем
+    os.environ.setdefault('RATE_LIMITS', 'off')
+
+    from aiohttp.test_utils import TestClient, TestServer
+    import main
+    from database import stats_db
+
+    # Глобальная база открывается в on_startup приложения, а наполнить ее нужно раньше
+    stats_db.init_database()
+    if args.seed_purchases:
+        seed = [(f'seed{i % 1000}', f'seed{i % 1000}', f'g{i % 25}', f'Gift {i % 25}', 10.0)
+                for i in range(args.seed_purchases)]
+        for start in range(0, len(seed), 1000):
+            stats_db.register_purchases_batch(seed[start:start + 1000])
+        stats_db.load_leaderboards()
+
+    source = replay(load_recorded(args.replay)) if args.replay else synthetic(seed=args.seed)
+    latencies = {}
+    errors = {}
+
+    async with TestClient(TestServer(main.init_app())) as client:
+        # Каталог собирается при первом обращении: в замер не включаем
+        await (await client.get('/api/get_all_gifts')).read()
+
+        deadline = time.monotonic() + args.seconds
+        remaining = args.requests
+
+        async def worker():
+            nonlocal remaining
+            while time.monotonic() < deadline:
+                if remaining is not None:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                method, endpoint, data = next(source)
+                started = time.perf_counter()
+                if method == 'GET':
+                    response = await client.get(f'/api/{endpoint}', params=data)
+                else:
+                    response = await client.post(f'/api/{endpoint}', json=data)
+                body = await response.read()
+                latencies.setdefault(endpoint, []).append((time.perf_counter() - started) * 1000)
+                if response.status != 200 or b'"success":false' in body.replace(b' ', b''):
+                    errors[endpoint] = errors.get(endpoint, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    endpoints = {endpoint: summarize(values, elapsed, errors.get(endpoint, 0))
+                 for endpoint, values in sorted(latencies.items())}
+    total = summarize([value for values in latencies.values() for value in values], elapsed,
+                      sum(errors.values()))
+    return {
+        'revision': git_revision(),
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'source': args.replay or 'synthetic',
+        'total': total,
+        'endpoints': endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--requests', type=int, default=None, help='остановиться после N запросов')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--replay', help='JSONL с записанным трафиком')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--seed-purchases', type=int, default=10000, help='покупок в базе до прогона')
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    # Служебные print приложения уводим в stderr, чтобы не портить JSON
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        args.tmp = tmp
+        result = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"revision={result['revision']} concurrency={result['concurrency']} elapsed={result['elapsed_s']}s")
+    for name, stats in [('TOTAL', result['total'])] + list(result['endpoints'].items()):
+        print(f'{name:>20}: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# benchmarks/bench_micro.py
+"""Микробенчмарки методов StatisticsDB, WebAppAPI.search_gifts и расчета цен на растущих объемах данных.
+
+Запуск: python benchmarks/bench_micro.py [--sizes 1000 10000 100000] [--repeat 200] [--json]
+
+Для каждого размера база заполняется size покупками от size/10 пользователей,
+каталог — size подарками; время одного вызова — медиана по --repeat повторам (мкс).
+Группа pricing: сборка каталога с ценами из листингов, смена комиссий и первая страница.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def median_us(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return round(samples[len(samples) // 2], 2)
+
+
+def bench_database(size, repeat, tmp):
+    from database import StatisticsDB
+
+    db = StatisticsDB(os.path.join(tmp, f'micro-{size}.db'))
+    rng = random.Random(size)
+    users = max(1, size // 10)
+    purchases = [(f'u{rng.randrange(users)}', f'user{rng.randrange(users)}', f'g{g}', f'Gift {g}',
+                  round(rng.uniform(5, 150), 2))
+                 for g in (rng.randrange(500) for _ in range(size))]
+    for start in range(0, size, 1000):
+        db.register_purchases_batch(purchases[start:start + 1000])
+
+    now = time.time()
+    counter = iter(range(10 ** 9))
+    results = {
+        'get_statistics': median_us(db.get_statistics, repeat),
+        'get_top_buyers': median_us(lambda: db.get_top_buyers(10), repeat),
+        'get_top_buyers_week': median_us(lambda: db.get_top_buyers(10, 'week'), repeat),
+        'get_popular_gifts': median_us(lambda: db.get_popular_gifts(10), repeat),
+        'get_revenue_between': median_us(lambda: db.get_revenue_between(now - 86400, now), repeat),
+        'register_user_activity': median_us(lambda: db.register_user_activity(f'u{next(counter)}', 'x'), repeat),
+        'register_purchase': median_us(lambda: db.register_purchase('u1', 'x', 'g1', 'Gift 1', 10.0), repeat),
+        'sync_presence': median_us(db.sync_presence, repeat),
+        'load_leaderboards': median_us(db.load_leaderboards, max(3, repeat // 20)),
+    }
+    db.close()
+    return results
+
+
+WORDS = ['Astral', 'Berry', 'Candle', 'Crystal', 'Eternal', 'Genie', 'Lamp', 'Ring', 'Rose', 'Skull']
+
+
+def make_listings(size):
+    rng = random.Random(size)
+    return [{
+        'id': f'gift{i}',
+        'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}',
+        'base_price': round(rng.uniform(5, 4500), 2),
+    } for i in range(size)]
+
+
+def bench_search(size, repeat):
+    from webapp_api import WebAppAPI
+
+    api = WebAppAPI()
+    listings = make_listings(size)
+
+    async def load_all_gifts():
+        return listings
+    api._load_all_gifts = load_all_gifts
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(api.get_catalog())
+        search = lambda **kwargs: loop.run_until_complete(api.search_gifts_page(limit=50, **kwargs))
+        return {
+            'search_all': median_us(lambda: search(), repeat),
+            'search_price_range': median_us(lambda: search(min_price=100, max_price=200), repeat),
+            'search_short_term': median_us(lambda: search(search_term='la'), repeat),
+            'search_term': median_us(lambda: search(search_term='crystal'), repeat),
+            'search_term_price_desc': median_us(lambda: search(search_term='rose', sort_by='price_desc'), repeat),
+        }
+    finally:
+        loop.close()
+
+
+def bench_pricing(size, repeat):
+    from catalog_index import CatalogIndex
+    from pricing import PricedCatalog
+    from webapp_api import WebAppAPI
+
+    api = WebAppAPI()
+    listings = make_listings(size)
+    build = lambda: CatalogIndex(PricedCatalog.from_listings(listings, 0.05, 0.08, api._placeholder_url))
+    index = build()
+    commissions = iter([(0.05, 0.08), (0.06, 0.08)] * repeat)
+    return {
+        'build_catalog': median_us(build, max(3, repeat // 20)),
+        'reprice': median_us(lambda: index.reprice(*next(commissions)), max(3, repeat // 20)),
+        'first_page': median_us(lambda: build().search(limit=50), max(3, repeat // 20)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    # Служебные print приложения уводим в stderr, чтобы не портить JSON
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        # Глобальный stats_db при импорте только запоминает путь, файл открывает init_database(): уводим его во временный каталог
+        os.environ.setdefault('STATS_DB_PATH', os.path.join(tmp, 'global.db'))
+        results = {}
+        for size in args.sizes:
+            results[size] = {
+                'database': bench_database(size, args.repeat, tmp),
+                'search': bench_search(size, args.repeat),
+                'pricing': bench_pricing(size, args.repeat),
+            }
+
+    if args.json:
+        print(json.dumps({str(size): result for size, result in results.items()}, indent=2))
+        return
+
+    for size, result in results.items():
+        print(f'size={size}')
+        for group, timings in result.items():
+            print(f'  {group}: ' + ', '.join(f'{name}={value}us' for name, value in timings.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_payments.py
+"""Нагрузка на проверку платежей: опрос блокчейна на каждый запрос против PaymentWatcher.
+
+Запуск: python benchmarks/bench_payments.py [--payments 1000] [--seconds 5] [--chain-latency 0.05]
+
+Каждый клиент заводит платеж, "оплачивает" его в случайный момент и опрашивает
+check_payment раз в --client-interval секунд. Источник — FakeChainSource с
+задержкой --chain-latency на вызов.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payments import FakeChainSource, PaymentWatcher
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(mode, args):
+    source = FakeChainSource(latency=args.chain_latency)
+    watcher = PaymentWatcher(source, poll_interval=args.poll_interval)
+    rng = random.Random(7)
+    latencies = []
+    confirmations = []
+
+    async def naive_check(payment):
+        # Прежняя схема: каждый опрос клиента — отдельный запрос к блокчейну
+        transfers = await source.fetch_incoming(0)
+        watcher.apply_transfers(transfers)
+        return watcher.check(payment.payment_id)
+
+    async def client():
+        payment = watcher.register(1.5)
+        paid_at = time.perf_counter() + rng.uniform(0, args.seconds / 2)
+        paid = False
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            if not paid and time.perf_counter() >= paid_at:
+                source.add_transfer(payment.comment, 1.5)
+                paid = True
+            started = time.perf_counter()
+            if mode == 'naive':
+                state = await naive_check(payment)
+            else:
+                state = watcher.check(payment.payment_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if state.status == 'paid':
+                confirmations.append((time.perf_counter() - paid_at) * 1000)
+                return
+            await asyncio.sleep(args.client_interval)
+
+    if mode == 'watcher':
+        watcher.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.payments)))
+    elapsed = time.perf_counter() - started
+    if mode == 'watcher':
+        await watcher.stop()
+
+    return {
+        'checks': len(latencies),
+        'chain_calls': source.calls,
+        'confirmed': len(confirmations),
+        'elapsed_s': round(elapsed, 3),
+        'check_p50_ms': round(percentile(latencies, 0.5), 3),
+        'check_p99_ms': round(percentile(latencies, 0.99), 3),
+        'confirm_p50_ms': round(percentile(confirmations, 0.5), 1),
+        'confirm_p99_ms': round(percentile(confirmations, 0.99), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--payments', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--client-interval', type=float, default=1.0)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--chain-latency', type=float, default=0.05)
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    results = {mode: asyncio.run(run(mode, args)) for mode in ('naive', 'watcher')}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for mode, result in results.items():
+        print(f'{mode:>8}: ' + ', '.join(f'{key}={value}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/bench_presence.py
+"""Сравнение PresenceTracker с прежним учетом онлайна через таблицу online_users.
+
+Запуск: python benchmarks/bench_presence.py [--sizes 10000,100000,1000000] [--table-samples 2000]
+
+Для таблицы меряется прежний путь одного heartbeat (INSERT OR REPLACE + DELETE со
+сканированием datetime() + commit) и COUNT(*) на таблице из N строк. Прогонять
+heartbeat для всех N пользователей через таблицу нереально (каждый запрос
+сканирует всю таблицу), поэтому берется выборка из --table-samples запросов.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from presence import PresenceTracker
+
+
+def bench_tracker(users):
+    tracker = PresenceTracker(window=300)
+    now = time.time()
+    ids = [str(i) for i in range(users)]
+
+    started = time.perf_counter()
+    for i, user_id in enumerate(ids):
+        tracker.touch(user_id, now=now + i * 300.0 / users)
+    touch_total = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        tracker.count(now=now + 300)
+    count_avg = (time.perf_counter() - started) / 1000
+
+    # Повторные heartbeat случайных пользователей поверх заполненного колеса
+    sample = random.sample(ids, min(users, 10000))
+    started = time.perf_counter()
+    for user_id in sample:
+        tracker.touch(user_id, now=now + 301)
+    retouch_avg = (time.perf_counter() - started) / len(sample)
+
+    return {
+        'heartbeat_us': round(touch_total / users * 1e6, 3),
+        'reheartbeat_us': round(retouch_avg * 1e6, 3),
+        'count_us': round(count_avg * 1e6, 3),
+    }
+
+
+def bench_table(users, samples):
+    path = tempfile.mktemp(suffix='.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''
+        CREATE TABLE online_users (
+            user_id TEXT PRIMARY KEY,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO online_users (user_id, last_activity) VALUES (?, CURRENT_TIMESTAMP)',
+        ((str(i),) for i in range(users))
+    )
+    conn.commit()
+
+    sample = random.sample(range(users), min(users, samples))
+    started = time.perf_counter()
+    for user_id in sample:
+        conn.execute('''
+            INSERT OR REPLACE INTO online_users (user_id, last_activity)
+            VALUES (?, CURRENT_TIMESTAMP)
+        ''', (str(user_id),))
+        conn.execute('''
+            DELETE FROM online_users
+            WHERE datetime(last_activity) < datetime('now', '-5 minutes')
+        ''')
+        conn.commit()
+    heartbeat_avg = (time.perf_counter() - started) / len(sample)
+
+    started = time.perf_counter()
+    for _ in range(20):
+        conn.execute('SELECT COUNT(*) FROM online_users').fetchone()
+    count_avg = (time.perf_counter() - started) / 20
+
+    conn.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    return {
+        'heartbeat_us': round(heartbeat_avg * 1e6, 3),
+        'count_us': round(count_avg * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--table-samples', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    results = []
+    for users in (int(size) for size in args.sizes.split(',')):
+        results.append({
+            'users': users,
+            'tracker': bench_tracker(users),
+            'table': bench_table(users, args.table_samples),
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'users':>9} | {'tracker hb us':>13} {'re-hb us':>9} {'count us':>9} | {'table hb us':>12} {'count us':>10}")
+    for row in results:
+        tracker, table = row['tracker'], row['table']
+        print(f"{row['users']:>9} | {tracker['heartbeat_us']:>13} {tracker['reheartbeat_us']:>9} "
+              f"{tracker['count_us']:>9} | {table['heartbeat_us']:>12} {table['count_us']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# benchmarks/bench_purchases.py
+"""Пропускная способность записи покупок (покупок в секунду): до и после upsert-конвейера.
+
+Запуск: python benchmarks/bench_purchases.py [--purchases 5000] [--users 1000] [--batch 100] [--seed-users 100000]
+
+"legacy" воспроизводит прежний register_purchase: INSERT OR REPLACE с
+коррелированными SELECT, COUNT(*) по users и online_users и commit на каждую
+продажу (с исправленным числом параметров, иначе прежний код падал).
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import StatisticsDB
+
+LEGACY_SCHEMA = (
+    '''CREATE TABLE users (user_id TEXT PRIMARY KEY, username TEXT,
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total_spent REAL DEFAULT 0, total_purchases INTEGER DEFAULT 0)''',
+    '''CREATE TABLE online_users (user_id TEXT PRIMARY KEY, last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE purchases (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, gift_name TEXT,
+        gift_id TEXT, amount REAL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE popular_gifts (gift_id TEXT PRIMARY KEY, gift_name TEXT, total_sales INTEGER DEFAULT 0,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE daily_stats (date TEXT PRIMARY KEY, total_users INTEGER DEFAULT 0, online_users INTEGER DEFAULT 0,
+        daily_turnover REAL DEFAULT 0, gifts_sold INTEGER DEFAULT 0, total_revenue REAL DEFAULT 0)''',
+)
+
+
+def make_purchases(count, users):
+    rng = random.Random(42)
+    return [
+        (str(rng.randrange(users)), f'user{rng.randrange(users)}', f'gift{g}', f'Gift {g}', round(rng.uniform(5, 150), 2))
+        for g in (rng.randrange(25) for _ in range(count))
+    ]
+
+
+def temp_path():
+    return tempfile.mktemp(suffix='.db')
+
+
+def cleanup(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def seed_users(conn, count):
+    """Предзаполняет users и online_users, чтобы COUNT(*) работал на реалистичном объеме"""
+    rows = [(f'seed{i}',) for i in range(count)]
+    conn.executemany('INSERT INTO users (user_id) VALUES (?)', rows)
+    conn.executemany('INSERT INTO online_users (user_id) VALUES (?)', rows)
+    conn.commit()
+
+
+def bench_legacy(purchases, seed):
+    path = temp_path()
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for ddl in LEGACY_SCHEMA:
+        conn.execute(ddl)
+    conn.commit()
+    seed_users(conn, seed)
+
+    started = time.perf_counter()
+    for user_id, username, gift_id, gift_name, amount in purchases:
+        today = datetime.now().strftime('%Y-%m-%d')
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO users (user_id, username, last_seen, total_spent, total_purchases)
+            VALUES (?, ?, CURRENT_TIMESTAMP,
+                    COALESCE((SELECT total_spent FROM users WHERE user_id = ?), 0) + ?,
+                    COALESCE((SELECT total_purchases FROM users WHERE user_id = ?), 0) + 1)
+        ''', (user_id, username, user_id, amount, user_id))
+        cursor.execute('INSERT INTO purchases (user_id, gift_name, gift_id, amount) VALUES (?, ?, ?, ?)',
+                       (user_id, gift_name, gift_id, amount))
+        cursor.execute('''
+            INSERT OR REPLACE INTO popular_gifts (gift_id, gift_name, total_sales, last_updated)
+            VALUES (?, ?, COALESCE((SELECT total_sales FROM popular_gifts WHERE gift_id = ?), 0) + 1, CURRENT_TIMESTAMP)
+        ''', (gift_id, gift_name, gift_id))
+        cursor.execute('''
+            INSERT OR REPLACE INTO daily_stats (date, total_users, online_users, daily_turnover, gifts_sold, total_revenue)
+            VALUES (?, (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM online_users),
+                    COALESCE((SELECT daily_turnover FROM daily_stats WHERE date = ?), 0) + ?,
+                    COALESCE((SELECT gifts_sold FROM daily_stats WHERE date = ?), 0) + 1,
+                    COALESCE((SELECT total_revenue FROM daily_stats WHERE date = ?), 0) + ?)
+        ''', (today, today, amount, today, today, amount))
+        conn.commit()
+    elapsed = time.perf_counter() - started
+
+    conn.close()
+    cleanup(path)
+    return elapsed
+
+
+def bench_current(purchases, batch, seed):
+    path = temp_path()
+    db = StatisticsDB(path, readers=1)
+    with db.pool.writer() as conn:
+        conn.executemany('INSERT INTO users (user_id) VALUES (?)', [(f'seed{i}',) for i in range(seed)])
+
+    started = time.perf_counter()
+    if batch <= 1:
+        for purchase in purchases:
+            db.register_purchase(*purchase)
+    else:
+        for i in range(0, len(purchases), batch):
+            db.register_purchases_batch(purchases[i:i + batch])
+    elapsed = time.perf_counter() - started
+
+    report = db.verify_counters()
+    db.close()
+    cleanup(path)
+    assert report['ok'], report
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--purchases', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--seed-users', type=int, default=100000)
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    purchases = make_purchases(args.purchases, args.users)
+    results = {
+        'legacy': bench_legacy(purchases, args.seed_users),
+        'upsert': bench_current(purchases, 1, args.seed_users),
+        f'upsert_batch_{args.batch}': bench_current(purchases, args.batch, args.seed_users),
+    }
+    rates = {name: round(len(purchases) / elapsed, 1) for name, elapsed in results.items()}
+
+    if args.json:
+        print(json.dumps({'purchases': len(purchases), 'seed_users': args.seed_users,
+                          'purchases_per_second': rates}, indent=2))
+        return
+
+    for name, rate in rates.items():
+        print(f'{name:>20}: {rate:>10} purchases/s')
+
+
+if __name__ == '__main__':
+    main()
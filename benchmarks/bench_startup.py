@@ -0,0 +1,95 @@
+# benchmarks/bench_startup.py
+"""Время холодного старта: от запуска процесса до открытия порта и первых ответов.
+
+Запуск: python benchmarks/bench_startup.py [--runs 5] [--mode lazy eager] [--json]
+
+Каждый прогон поднимает python main.py на свободном порту с новой базой SQLite
+(как после деплоя на Render), замеряет время до открытия порта, до первого
+ответа / и /api/get_statistics, /api/get_all_gifts, и забирает отчет
+приложения get_startup_stats (импорты, миграции, прогрев каталога).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_workers import free_port
+
+
+def wait_for_port(port, started, timeout=30.0):
+    while time.perf_counter() - started < timeout:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def fetch(port, path):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=30) as response:
+        return response.read()
+
+
+def measure(mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, STATS_DB_PATH=os.path.join(tmp, 'bench.db'), PORT=str(port), STARTUP_MODE=mode)
+        started = time.perf_counter()
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            result = {'mode': mode}
+            wait_for_port(port, started)
+            result['port_open_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            for name, path in (('index', '/'), ('statistics', '/api/get_statistics'),
+                               ('all_gifts', '/api/get_all_gifts')):
+                fetch(port, path)
+                result[f'{name}_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            result['report'] = json.loads(fetch(port, '/api/get_startup_stats'))['data']
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--mode', nargs='+', default=['lazy', 'eager'], choices=['lazy', 'eager'])
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.mode:
+        runs = [measure(mode) for _ in range(args.runs)]
+        summary = {key: median([run[key] for run in runs]) for key in runs[0] if key.endswith('_ms')}
+        phases = runs[0]['report']['phases_ms']
+        summary['phases_ms'] = {phase: median([run['report']['phases_ms'].get(phase, 0) for run in runs])
+                                for phase in phases}
+        results[mode] = summary
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for mode, summary in results.items():
+        phases = summary.pop('phases_ms')
+        print(f'{mode}: ' + ', '.join(f'{key}={value}' for key, value in summary.items()))
+        print('  phases: ' + ', '.join(f'{phase}={value}ms' for phase, value in phases.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# benchmarks/bench_workers.py
+"""Пропускная способность API в зависимости от числа воркеров супервизора.
+
+Запуск: python benchmarks/bench_workers.py [--workers 1 2 4] [--seconds 10] [--clients 4] [--concurrency 32]
+
+Для каждого числа воркеров поднимает supervisor.py на свободном порту с временной
+базой, гоняет смесь запросов из --clients процессов-клиентов и считает RPS.
+Клиенты делят те же ядра, что и сервер: на машине с малым числом ядер прирост
+упрется в них раньше, чем в сервер.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from traffic import make_request
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+async def client_loop(port, seconds, concurrency, seed):
+    import aiohttp
+
+    rng = random.Random(seed)
+    base = f'http://127.0.0.1:{port}/api/'
+    done = 0
+    errors = 0
+    deadline = time.monotonic() + seconds
+
+    async def worker(session):
+        nonlocal done, errors
+        while time.monotonic() < deadline:
+            method, endpoint, data = make_request(rng)
+            try:
+                if method == 'GET':
+                    response = await session.get(base + endpoint, params=data)
+                else:
+                    response = await session.post(base + endpoint, json=data)
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+                done += 1
+            except aiohttp.ClientError:
+                errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return done, errors
+
+
+def client_process(args):
+    return asyncio.run(client_loop(*args))
+
+
+def measure(workers, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, STATS_DB_PATH=os.path.join(tmp, 'bench.db'), WEB_WORKERS=str(workers))
+        env.setdefault('RATE_LIMITS', 'off')
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'supervisor.py'), '--workers', str(workers),
+             '--host', '127.0.0.1', '--port', str(port)],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port)
+            # Каталог собирается при первом обращении в каждом воркере: прогреваем
+            client_process((port, 2.0, 4, 0))
+            started = time.perf_counter()
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(client_process, [
+                    (port, args.seconds, args.concurrency, seed + 1) for seed in range(args.clients)
+                ])
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    requests = sum(done for done, _ in results)
+    return {
+        'workers': workers,
+        'requests': requests,
+        'errors': sum(errors for _, errors in results),
+        'rps': round(requests / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--json', action='store_true', help='машиночитаемый вывод')
+    args = parser.parse_args()
+
+    results = [measure(workers, args) for workers in args.workers]
+
+    if args.json:
+        print(json.dumps({'cpus': os.cpu_count(), 'results': results}, indent=2))
+        return
+
+    print(f'cpus={os.cpu_count()}')
+    for result in results:
+        print(', '.join(f'{key}={value}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
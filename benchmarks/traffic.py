@@ -0,0 +1,75 @@
+# benchmarks/traffic.py
+"""Общие части нагрузочных прогонов: синтетическая смесь запросов, запись/воспроизведение и перцентили."""
+import json
+import random
+
+# (метод, эндпоинт, вес)
+REQUEST_MIX = (
+    ('GET', 'get_statistics', 30),
+    ('GET', 'get_top_buyers', 15),
+    ('GET', 'search_gifts', 25),
+    ('POST', 'register_activity', 25),
+    ('GET', 'get_popular_gifts', 5),
+)
+
+SEARCH_TERMS = ('ca', 'ring', 'egg', 'lamp', '')
+
+
+def make_request(rng, mix=REQUEST_MIX, users=5000):
+    """Случайный запрос из смеси: (метод, эндпоинт, данные)"""
+    method, endpoint, _ = rng.choices(mix, weights=[weight for _, _, weight in mix])[0]
+    user_id = str(rng.randrange(users))
+    if endpoint == 'register_activity':
+        return method, endpoint, {'user_id': user_id, 'username': f'user{user_id}'}
+    if endpoint == 'search_gifts':
+        return method, endpoint, {'search_term': rng.choice(SEARCH_TERMS), 'limit': '20'}
+    return method, endpoint, {}
+
+
+def synthetic(seed=1, **kwargs):
+    """Бесконечный поток синтетических запросов"""
+    rng = random.Random(seed)
+    while True:
+        yield make_request(rng, **kwargs)
+
+
+def load_recorded(path):
+    """Записанный трафик: JSONL со строками {"method", "endpoint", "data"}"""
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            requests.append((entry.get('method', 'GET').upper(), entry['endpoint'], entry.get('data') or {}))
+    if not requests:
+        raise ValueError(f'no requests in {path}')
+    return requests
+
+
+def replay(requests):
+    """Бесконечный повтор записанного трафика по кругу"""
+    while True:
+        yield from requests
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(latencies_ms, elapsed, errors=0):
+    """Сводка по набору задержек: количество, пропускная способность и перцентили"""
+    latencies_ms = sorted(latencies_ms)
+    return {
+        'count': len(latencies_ms),
+        'errors': errors,
+        'rps': round(len(latencies_ms) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies_ms, 0.50), 3),
+        'p95_ms': round(percentile(latencies_ms, 0.95), 3),
+        'p99_ms': round(percentile(latencies_ms, 0.99), 3),
+        'max_ms': round(latencies_ms[-1], 3) if latencies_ms else 0.0,
+    }
@@ -0,0 +1,104 @@
+# cache.py
+import asyncio
+import time
+
+
+class CacheEntry:
+    __slots__ = ('value', 'fetched_at')
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class SWRCache:
+    """TTL-кэш со stale-while-revalidate и single-flight загрузкой"""
+
+    def __init__(self, ttl=300, stale_ttl=3600):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._inflight = {}
+
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'refresh_total_ms': 0.0,
+            'refresh_max_ms': 0.0,
+            'last_refresh_ms': 0.0,
+        }
+
+    def peek(self, key):
+        """Последнее успешно загруженное значение без проверки TTL"""
+        entry = self._entries.get(key)
+        return entry.value if entry else None
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def get(self, key, loader):
+        """Возвращает значение из кэша; при устаревании отдает старое и обновляет в фоне"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                return entry.value
+            if age < self.ttl + self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                self._refresh(key, loader)
+                return entry.value
+
+        self.stats['misses'] += 1
+        return await asyncio.shield(self._refresh(key, loader))
+
+    def _refresh(self, key, loader):
+        # Single-flight: одновременные промахи ждут одну и ту же загрузку
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+            return task
+        task = asyncio.get_running_loop().create_task(self._load(key, loader))
+        self._inflight[key] = task
+        return task
+
+    async def _load(self, key, loader):
+        started = time.perf_counter()
+        try:
+            value = await loader()
+        except Exception as e:
+            self.stats['refresh_errors'] += 1
+            print(f"Cache refresh error for {key}: {e}")
+            entry = self._entries.get(key)
+            if entry is None:
+                raise
+            # Лучше отдать последний удачный снимок, чем ошибку
+            return entry.value
+        finally:
+            self._inflight.pop(key, None)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self._entries[key] = CacheEntry(value, time.monotonic())
+        self.stats['refreshes'] += 1
+        self.stats['refresh_total_ms'] += elapsed
+        self.stats['last_refresh_ms'] = round(elapsed, 3)
+        if elapsed > self.stats['refresh_max_ms']:
+            self.stats['refresh_max_ms'] = round(elapsed, 3)
+        return value
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale_hits']) / lookups, 4) if lookups else 0.0
+        stats['refresh_avg_ms'] = round(stats['refresh_total_ms'] / stats['refreshes'], 3) if stats['refreshes'] else 0.0
+        stats['refresh_total_ms'] = round(stats['refresh_total_ms'], 3)
+        stats['entries'] = len(self._entries)
+        stats['inflight'] = len(self._inflight)
+        return stats
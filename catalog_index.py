@@ -0,0 +1,141 @@
+# catalog_index.py
+import base64
+import itertools
+import json
+from bisect import bisect_left, bisect_right
+
+from api_router import ApiError
+
+# Длина n-грамм для подстрочного поиска
+NGRAM = 3
+
+# Номер сборки индекса: по нему кэш ответов замечает обновление каталога
+_versions = itertools.count(1)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(цена, id) из курсора; ApiError, если курсор испорчен или подделан"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        price, gift_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(price), str(gift_id)
+    except (ValueError, TypeError):
+        raise ApiError('Invalid cursor')
+
+
+class CatalogIndex:
+    """Индекс над столбцовым каталогом (pricing.PricedCatalog): цены для bisect и n-граммы для поиска"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.version = next(_versions)
+        self.order = None
+        self._rows = None
+        self._build()
+
+    def _build(self):
+        totals = self.catalog.rounded_totals()
+        ids = self.catalog.ids
+        # Порядок строк по (цена, id): позиция в этом списке и есть ключ сортировки.
+        # Общая комиссия масштабирует все цены одинаково, поэтому после reprice прежний порядок обычно верен
+        order = self.order
+        keys = [(totals[row], ids[row]) for row in order] if order is not None else None
+        if keys is None or any(a > b for a, b in zip(keys, itertools.islice(keys, 1, None))):
+            order = sorted(range(len(ids)), key=lambda row: (totals[row], ids[row]))
+            keys = [(totals[row], ids[row]) for row in order]
+        self.keys = keys
+        self.prices = [key[0] for key in self.keys]
+        # Словари подарков собираются только для отдаваемых страниц и запоминаются по позиции
+        self._views = [None] * len(order)
+        if order == self.order:
+            return
+        self.order = order
+        self.names = [self.catalog.names[row].lower() for row in order]
+
+        # n-грамма -> отсортированные позиции подарков
+        postings = {}
+        for position, name in enumerate(self.names):
+            for gram in {name[i:i + NGRAM] for i in range(len(name) - NGRAM + 1)}:
+                postings.setdefault(gram, []).append(position)
+        self.ngrams = postings
+
+    def reprice(self, market_commission, my_commission):
+        """Новые комиссии без пересборки каталога: n-граммы переиспользуются, если порядок цен не изменился"""
+        self.catalog.set_commissions(market_commission, my_commission)
+        self._build()
+        self.version = next(_versions)
+
+    def __len__(self):
+        return len(self.order)
+
+    def get(self, gift_id):
+        """Подарок по id с текущими ценами или None"""
+        if self._rows is None:
+            # id -> строка каталога: не зависит от порядка цен и переживает reprice
+            self._rows = {gift_id: row for row, gift_id in enumerate(self.catalog.ids)}
+        row = self._rows.get(gift_id)
+        return self.catalog.gift(row) if row is not None else None
+
+    def _view(self, position):
+        gift = self._views[position]
+        if gift is None:
+            gift = self._views[position] = self.catalog.gift(self.order[position])
+        return gift
+
+    @property
+    def gifts(self):
+        """Весь каталог словарями (для get_all_gifts; поиск собирает только свою страницу)"""
+        return [self._view(position) for position in range(len(self.order))]
+
+    def _price_range(self, min_price, max_price):
+        lo = bisect_left(self.prices, min_price) if min_price is not None else 0
+        hi = bisect_right(self.prices, max_price) if max_price is not None else len(self.prices)
+        return lo, hi
+
+    def _match_positions(self, term, lo, hi):
+        """Позиции в [lo, hi), чье имя содержит term, по возрастанию цены"""
+        if len(term) < NGRAM:
+            return [p for p in range(lo, hi) if term in self.names[p]]
+
+        # Самый редкий n-грамм дает кандидатов; подстроку проверяем по заранее приведенным именам
+        shortest = None
+        for gram in {term[i:i + NGRAM] for i in range(len(term) - NGRAM + 1)}:
+            posting = self.ngrams.get(gram)
+            if not posting:
+                return []
+            if shortest is None or len(posting) < len(shortest):
+                shortest = posting
+
+        candidates = shortest[bisect_left(shortest, lo):bisect_left(shortest, hi)]
+        return [p for p in candidates if term in self.names[p]]
+
+    def search(self, search_term=None, min_price=None, max_price=None, sort_by='price_asc',
+               cursor=None, limit=None):
+        """Возвращает (подарки, курсор следующей страницы, всего совпадений)"""
+        lo, hi = self._price_range(min_price, max_price)
+        term = search_term.lower() if search_term else None
+        positions = self._match_positions(term, lo, hi) if term else range(lo, hi)
+        descending = sort_by == 'price_desc'
+
+        # Курсор хранит (цена, id) последнего элемента и переживает обновление каталога
+        start = 0
+        if cursor:
+            key = decode_cursor(cursor)
+            if descending:
+                start = len(positions) - bisect_left(positions, bisect_left(self.keys, key))
+            else:
+                start = bisect_left(positions, bisect_right(self.keys, key))
+
+        total = len(positions)
+        end = total if limit is None else min(total, start + limit)
+        if descending:
+            page = [positions[total - 1 - i] for i in range(start, end)]
+        else:
+            page = [positions[i] for i in range(start, end)]
+
+        next_cursor = encode_cursor(list(self.keys[page[-1]])) if page and end < total else None
+        return [self._view(p) for p in page], next_cursor, total
@@ -0,0 +1,79 @@
+# change_watcher.py
+import asyncio
+import os
+import time
+
+from database import stats_db
+
+
+class ChangeWatcher:
+    """Подхват записей других воркеров: рейтинги в памяти и версия данных для кэшей"""
+
+    def __init__(self, db, interval=0.5):
+        self.db = db
+        self.interval = interval
+        self._task = None
+        # Корутины без аргументов, вызываемые после каждого замеченного изменения базы
+        self.listeners = []
+
+        self.stats = {
+            'polls': 0,
+            'changes': 0,
+            'external_purchases': 0,
+            'errors': 0,
+            'last_poll_ms': 0.0,
+        }
+
+    async def poll_once(self):
+        started = time.perf_counter()
+        version = self.db.data_version
+        try:
+            purchases = await self.db.run(self.db.poll_changes)
+        except Exception as e:
+            print(f"Change watcher error: {e}")
+            self.stats['errors'] += 1
+            return 0
+        self.stats['polls'] += 1
+        if self.db.data_version != version:
+            self.stats['changes'] += 1
+            for listener in self.listeners:
+                try:
+                    await listener()
+                except Exception as e:
+                    print(f"Change listener error: {e}")
+                    self.stats['errors'] += 1
+        self.stats['external_purchases'] += purchases
+        self.stats['last_poll_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return purchases
+
+    def on_change(self, listener):
+        self.listeners.append(listener)
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.poll_once()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['running'] = self._task is not None
+        return stats
+
+
+change_watcher = ChangeWatcher(
+    stats_db,
+    interval=float(os.environ.get('CHANGE_POLL_INTERVAL', 0.5)),
+)
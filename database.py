@@ -1,216 +1,1158 @@
 # api/database.py
 import sqlite3
 import json
-from datetime import datetime, timedelta
+import csv
+import gzip
+from datetime import date, datetime, timedelta
 import time
 import os
+import secrets
+import functools
+import threading
 
-class StatisticsDB:
-    def __init__(self, db_path='giftprises_stats.db'):
-        self.db_path = db_path
-        self.init_database()
+from db_pool import SQLitePool
+from presence import PresenceTracker
+from leaderboards import Leaderboards, PERIODS
+from metrics import TimingRegistry
+
+# Окно, в течение которого пользователь считается онлайн (секунды)
+ONLINE_WINDOW = 300
+
+# Верхняя граница суммы одной покупки (TON): больше не стоит ни один подарок каталога
+MAX_PURCHASE_AMOUNT = float(os.environ.get('MAX_PURCHASE_AMOUNT', 100000))
+
+# Текущее время в виде целого unix epoch на стороне SQLite
+NOW_EPOCH = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+TOP_BUYERS_QUERY = '''
+    SELECT username, total_spent, total_purchases 
+    FROM users 
+    WHERE total_spent > 0 
+    ORDER BY total_spent DESC 
+    LIMIT ?
+'''
+
+POPULAR_GIFTS_QUERY = '''
+    SELECT gift_name, total_sales 
+    FROM popular_gifts 
+    ORDER BY total_sales DESC 
+    LIMIT ?
+'''
+
+REVENUE_BETWEEN_QUERY = '''
+    SELECT COUNT(*), COALESCE(SUM(amount), 0)
+    FROM purchases
+    WHERE timestamp >= ? AND timestamp < ?
+'''
+
+# То же по месячной партиции purchases_YYYY_MM
+PARTITION_REVENUE_QUERY = '''
+    SELECT COUNT(*), COALESCE(SUM(amount), 0)
+    FROM {table}
+    WHERE timestamp >= ? AND timestamp < ?
+'''
+
+# Начальные данные рейтингов: очки за все время и посуточные очки за самое длинное окно
+LEADERBOARD_BUYERS_QUERY = '''
+    SELECT user_id, username, total_spent, total_purchases
+    FROM users
+    WHERE total_spent > 0
+'''
+
+LEADERBOARD_GIFTS_QUERY = '''
+    SELECT gift_id, gift_name, total_sales
+    FROM popular_gifts
+'''
+
+WINDOW_BUYERS_QUERY = '''
+    SELECT date(p.timestamp, 'unixepoch', 'localtime') AS day, p.user_id, u.username,
+           SUM(p.amount), COUNT(*)
+    FROM purchases p
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE p.timestamp >= ?
+    GROUP BY day, p.user_id
+'''
+
+WINDOW_GIFTS_QUERY = '''
+    SELECT date(timestamp, 'unixepoch', 'localtime') AS day, gift_id, MAX(gift_name), COUNT(*)
+    FROM purchases
+    WHERE timestamp >= ?
+    GROUP BY day, gift_id
+'''
+
+# Покупки с id больше отметки: по ним воркер догоняет рейтинги после чужих коммитов
+NEW_PURCHASES_QUERY = '''
+    SELECT p.id, p.origin, p.user_id, u.username, p.gift_id, p.gift_name, p.amount,
+           date(p.timestamp, 'unixepoch', 'localtime')
+    FROM purchases p
+    LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE p.id > ?
+    ORDER BY p.id
+'''
+
+# Столбцы покупок: общие для горячей таблицы, месячных партиций и представления all_purchases
+PURCHASE_COLUMNS = ('id', 'user_id', 'gift_name', 'gift_id', 'amount', 'timestamp', 'origin')
+
+# Партиции, пересекающиеся с полуинтервалом [start, end): прочие месяцы запрос не трогает
+PARTITIONS_IN_RANGE_QUERY = '''
+    SELECT month, table_name, start_ts, end_ts, purchases, revenue
+    FROM purchase_partitions
+    WHERE start_ts < ? AND end_ts > ?
+'''
+
+# Месяцы по умолчанию, которые остаются в горячей таблице purchases (текущий и предыдущий)
+HOT_MONTHS = 2
+
+PAYMENT_COLUMNS = ('payment_id', 'comment', 'amount', 'details', 'status',
+                   'created_at', 'paid_at', 'paid_amount', 'tx_hash')
+
+ONLINE_SINCE_QUERY = '''
+    SELECT user_id, last_activity
+    FROM online_users
+    WHERE last_activity >= ?
+'''
+
+# Запрос -> индекс, который он обязан использовать (проверяется через EXPLAIN QUERY PLAN)
+QUERY_PLAN_CHECKS = {
+    'top_buyers': (TOP_BUYERS_QUERY, (10,), 'idx_users_total_spent'),
+    'popular_gifts': (POPULAR_GIFTS_QUERY, (10,), 'idx_popular_gifts_sales'),
+    'revenue_between': (REVENUE_BETWEEN_QUERY, (0, 1), 'idx_purchases_timestamp'),
+    'online_since': (ONLINE_SINCE_QUERY, (0,), 'idx_online_users_activity'),
+    'purchases_by_user': ('SELECT SUM(amount) FROM purchases WHERE user_id = ?', ('1',), 'idx_purchases_user'),
+    'purchases_by_gift': ('SELECT COUNT(*) FROM purchases WHERE gift_id = ?', ('1',), 'idx_purchases_gift'),
+}
+
+class QueryPlanError(Exception):
+    """Ключевой запрос не использует ожидаемый индекс"""
+
+def _epoch_expr(column):
+    """Переводит TEXT-время в unix epoch, не трогая уже целые значения"""
+    return (f"COALESCE(CASE WHEN typeof({column}) = 'integer' THEN {column} "
+            f"ELSE CAST(strftime('%s', {column}) AS INTEGER) END, {NOW_EPOCH})")
+
+def _create_counter_triggers(cursor):
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_counter_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'total_users';
+        END
+    ''')
     
-    def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_counter_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'total_users';
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS purchases_counter_insert AFTER INSERT ON purchases
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'gifts_sold';
+            UPDATE counters SET value = value + NEW.amount WHERE name = 'total_revenue';
+        END
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS purchases_counter_delete AFTER DELETE ON purchases
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'gifts_sold';
+            UPDATE counters SET value = value - OLD.amount WHERE name = 'total_revenue';
+        END
+    ''')
+
+# Месяцы, сырые строки которых удалены после выгрузки: их итоги живут только в реестре и daily_stats
+DROPPED_MONTHS = 'SELECT month FROM purchase_partitions WHERE table_name IS NULL'
+
+def _rollup_daily(cursor, source, first_day=None, end_day=None, exclude_dropped=False):
+    """Пересчитывает дневные срезы [first_day, end_day) из сырых строк source по локальной дате"""
+    where = ['true']
+    params = []
+    if first_day is not None:
+        where.append('date >= ? AND date < ?')
+        params += [first_day, end_day]
+    if exclude_dropped:
+        where.append(f'substr(date, 1, 7) NOT IN ({DROPPED_MONTHS})')
+    cursor.execute(f'''
+        UPDATE daily_stats SET daily_turnover = 0, gifts_sold = 0, total_revenue = 0
+        WHERE {' AND '.join(where)}
+    ''', params)
+    
+    range_filter = 'timestamp >= ? AND timestamp < ?' if first_day is not None else 'true'
+    range_params = []
+    if first_day is not None:
+        range_params = [int(datetime.fromisoformat(first_day).timestamp()),
+                        int(datetime.fromisoformat(end_day).timestamp())]
+    cursor.execute(f'''
+        INSERT INTO daily_stats (date, daily_turnover, gifts_sold, total_revenue)
+        SELECT date(timestamp, 'unixepoch', 'localtime'), SUM(amount), COUNT(*), SUM(amount)
+        FROM {source}
+        WHERE {range_filter}
+        GROUP BY date(timestamp, 'unixepoch', 'localtime')
+        ON CONFLICT(date) DO UPDATE SET
+            daily_turnover = excluded.daily_turnover,
+            gifts_sold = excluded.gifts_sold,
+            total_revenue = excluded.total_revenue
+    ''', range_params)
+
+def _rebuild_counters(cursor, partitioned=False):
+    # После миграции 6 покупки лежат в горячей таблице и месячных партициях (представление all_purchases)
+    source = 'all_purchases' if partitioned else 'purchases'
+    dropped_count = dropped_revenue = '0'
+    if partitioned:
+        dropped_count = '(SELECT COALESCE(SUM(purchases), 0) FROM purchase_partitions WHERE table_name IS NULL)'
+        dropped_revenue = '(SELECT COALESCE(SUM(revenue), 0) FROM purchase_partitions WHERE table_name IS NULL)'
+    
+    cursor.execute('DELETE FROM counters')
+    cursor.execute(f'''
+        INSERT INTO counters (name, value) VALUES
+            ('total_users', (SELECT COUNT(*) FROM users)),
+            ('gifts_sold', (SELECT COUNT(*) FROM {source}) + {dropped_count}),
+            ('total_revenue', (SELECT COALESCE(SUM(amount), 0) FROM {source}) + {dropped_revenue})
+    ''')
+    
+    # Дневные срезы пересчитываются по локальной дате, как их пишет register_purchase;
+    # срезы удаленных месяцев пересчитать не из чего, они остаются как есть
+    _rollup_daily(cursor, source, exclude_dropped=partitioned)
+
+def _month_bounds(month):
+    """Локальные границы месяца 'YYYY-MM': (начало, начало следующего)"""
+    start = datetime.strptime(month, '%Y-%m')
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def _partition_table(month):
+    return 'purchases_' + month.replace('-', '_')
+
+def _create_purchases_view(cursor):
+    """Пересоздает all_purchases: горячая таблица плюс все сохраненные месячные партиции"""
+    columns = ', '.join(PURCHASE_COLUMNS)
+    tables = ['purchases'] + [row[0] for row in cursor.execute('''
+        SELECT table_name FROM purchase_partitions WHERE table_name IS NOT NULL ORDER BY month
+    ''').fetchall()]
+    cursor.execute('DROP VIEW IF EXISTS all_purchases')
+    cursor.execute('CREATE VIEW all_purchases AS ' + ' UNION ALL '.join(
+        f'SELECT {columns} FROM {table}' for table in tables
+    ))
+
+def _migration_baseline(cursor):
+    # Таблица пользователей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            total_spent REAL DEFAULT 0,
+            total_purchases INTEGER DEFAULT 0
+        )
+    ''')
+    
+    # Таблица онлайн пользователей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS online_users (
+            user_id TEXT PRIMARY KEY,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Таблица покупок
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            gift_name TEXT,
+            gift_id TEXT,
+            amount REAL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # Таблица популярных подарков
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS popular_gifts (
+            gift_id TEXT PRIMARY KEY,
+            gift_name TEXT,
+            total_sales INTEGER DEFAULT 0,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Таблица статистики
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            date TEXT PRIMARY KEY,
+            total_users INTEGER DEFAULT 0,
+            online_users INTEGER DEFAULT 0,
+            daily_turnover REAL DEFAULT 0,
+            gifts_sold INTEGER DEFAULT 0,
+            total_revenue REAL DEFAULT 0
+        )
+    ''')
+    
+    # Агрегаты, поддерживаемые при записи вместо COUNT(*)/SUM() при чтении
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value REAL DEFAULT 0
+        )
+    ''')
+
+def _migration_epoch_timestamps(cursor):
+    # SQLite не меняет тип столбца: пересоздаем таблицы с INTEGER-временем
+    tables = {
+        'users': (f'''
+            CREATE TABLE users_new (
                 user_id TEXT PRIMARY KEY,
                 username TEXT,
-                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                first_seen INTEGER NOT NULL DEFAULT ({NOW_EPOCH}),
+                last_seen INTEGER NOT NULL DEFAULT ({NOW_EPOCH}),
                 total_spent REAL DEFAULT 0,
                 total_purchases INTEGER DEFAULT 0
             )
-        ''')
-        
-        # Таблица онлайн пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS online_users (
+        ''', ['user_id', 'username', 'first_seen', 'last_seen', 'total_spent', 'total_purchases'],
+            ['first_seen', 'last_seen']),
+        'online_users': (f'''
+            CREATE TABLE online_users_new (
                 user_id TEXT PRIMARY KEY,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                last_activity INTEGER NOT NULL DEFAULT ({NOW_EPOCH})
             )
-        ''')
-        
-        # Таблица покупок
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS purchases (
+        ''', ['user_id', 'last_activity'], ['last_activity']),
+        'purchases': (f'''
+            CREATE TABLE purchases_new (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id TEXT,
                 gift_name TEXT,
                 gift_id TEXT,
                 amount REAL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                timestamp INTEGER NOT NULL DEFAULT ({NOW_EPOCH}),
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
-        ''')
-        
-        # Таблица популярных подарков
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS popular_gifts (
+        ''', ['id', 'user_id', 'gift_name', 'gift_id', 'amount', 'timestamp'], ['timestamp']),
+        'popular_gifts': (f'''
+            CREATE TABLE popular_gifts_new (
                 gift_id TEXT PRIMARY KEY,
                 gift_name TEXT,
                 total_sales INTEGER DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                last_updated INTEGER NOT NULL DEFAULT ({NOW_EPOCH})
             )
+        ''', ['gift_id', 'gift_name', 'total_sales', 'last_updated'], ['last_updated']),
+    }
+    
+    for table, (create_sql, columns, epoch_columns) in tables.items():
+        cursor.execute(create_sql)
+        select = ', '.join(_epoch_expr(c) if c in epoch_columns else c for c in columns)
+        cursor.execute(f'''
+            INSERT INTO {table}_new ({', '.join(columns)})
+            SELECT {select} FROM {table}
         ''')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    
+    # Триггеры удалены вместе со старыми таблицами
+    _create_counter_triggers(cursor)
+    _rebuild_counters(cursor)
+
+def _migration_indexes(cursor):
+    # Покрывающие индексы под диапазоны по времени, топы и выборки по пользователю/подарку
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_timestamp ON purchases (timestamp, amount)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases (user_id, timestamp, amount)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_gift ON purchases (gift_id, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_total_spent ON users (total_spent, username, total_purchases)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_popular_gifts_sales ON popular_gifts (total_sales, gift_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_online_users_activity ON online_users (last_activity)')
+
+def _migration_payments(cursor):
+    # Платежи видны всем воркерам: проверка и выдача подарка могут прийти не в тот процесс, где платеж создан
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id TEXT PRIMARY KEY,
+            comment TEXT NOT NULL UNIQUE,
+            amount REAL NOT NULL,
+            details TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at INTEGER NOT NULL,
+            paid_at INTEGER,
+            paid_amount REAL,
+            tx_hash TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_status ON payments (status, created_at)')
+
+def _migration_purchase_origin(cursor):
+    # Процесс-автор покупки: воркер не применяет к рейтингам свои же строки повторно
+    cursor.execute('ALTER TABLE purchases ADD COLUMN origin TEXT')
+
+def _migration_purchase_partitions(cursor):
+    # Реестр месячных партиций покупок: закрытые месяцы переезжают из purchases в purchases_YYYY_MM
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchase_partitions (
+            month TEXT PRIMARY KEY,
+            table_name TEXT,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            purchases INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            archived_at INTEGER NOT NULL,
+            export_path TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchase_partitions_range ON purchase_partitions (start_ts, end_ts)')
+    _create_purchases_view(cursor)
+
+def _migration_settings(cursor):
+    # Настройки, которые меняются без перезапуска (комиссии): общие для всех воркеров
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        )
+    ''')
+
+# Упорядоченные миграции схемы: (версия, описание, функция)
+MIGRATIONS = [
+    (1, 'baseline schema', _migration_baseline),
+    (2, 'integer epoch timestamps', _migration_epoch_timestamps),
+    (3, 'covering indexes', _migration_indexes),
+    (4, 'shared payments table', _migration_payments),
+    (5, 'purchase origin', _migration_purchase_origin),
+    (6, 'monthly purchase partitions', _migration_purchase_partitions),
+    (7, 'runtime settings', _migration_settings),
+]
+
+def timed_query(method):
+    """Учитывает длительность вызова метода базы в StatisticsDB.timings"""
+    name = method.__name__
+    
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.timings.observe(name, (time.perf_counter() - started) * 1000)
+    return wrapper
+
+class StatisticsDB:
+    def __init__(self, db_path='giftprises_stats.db', readers=None, leaderboard_size=None, initialize=True):
+        self.db_path = db_path
+        if readers is None:
+            readers = int(os.environ.get('DB_POOL_READERS', 4))
+        if leaderboard_size is None:
+            leaderboard_size = int(os.environ.get('LEADERBOARD_SIZE', 100))
+        self.readers = readers
+        # Пул и файл базы создаются в open() (из init_database), а не при импорте модуля
+        self.pool = None
+        self._open_lock = threading.Lock()
+        self.presence = PresenceTracker(window=ONLINE_WINDOW)
+        self.leaderboards = Leaderboards(capacity=leaderboard_size)
+        # Длительность вызовов по методам, мс
+        self.timings = TimingRegistry()
+        self._presence_synced_at = None
+        # Растет после каждой записи: по ней кэши и подписчики замечают изменения
+        self.data_version = 0
+        self._version_lock = threading.Lock()
+        # Метка строк этого процесса и отметки для подхвата чужих коммитов (poll_changes)
+        self.origin = secrets.token_hex(8)
+        self._purchase_watermark = 0
+        self._seen_data_version = None
+        self._watch_conn = None
+        # Схема применена и рейтинги загружены; при initialize=False это делает init_database позже
+        self.ready = False
+        if initialize:
+            self.init_database()
+    
+    def _bump_version(self):
+        # Записи и poll_changes идут из разных потоков пула уже после отпускания писателя: без блокировки
+        # инкремент может потеряться, и кэш ответов продолжит отдавать устаревшую версию
+        with self._version_lock:
+            self.data_version += 1
+    
+    def open(self):
+        """Открывает пул соединений (и создает файл базы), если он еще не открыт"""
+        with self._open_lock:
+            if self.pool is None:
+                self.pool = SQLitePool(self.db_path, readers=self.readers)
+        return self.pool
+    
+    async def run(self, method, *args, **kwargs):
+        """Вызывает синхронный метод базы в пуле потоков, не блокируя event loop"""
+        if self.pool is None:
+            raise RuntimeError('Database is not open: init_database() has not run yet')
+        return await self.pool.run(method, *args, **kwargs)
+    
+    def get_pool_metrics(self):
+        """Метрики пула соединений; пусто, пока база не открыта"""
+        return self.pool.get_metrics() if self.pool is not None else {}
+    
+    def close(self):
+        if self._watch_conn is not None:
+            self._watch_conn.close()
+            self._watch_conn = None
+        if self.pool is not None:
+            self.pool.close()
+    
+    @timed_query
+    def init_database(self):
+        self.open()
+        self.migrate()
+        self.load_leaderboards()
+        self.ready = True
+    
+    def get_schema_version(self):
+        with self.pool.reader() as conn:
+            row = conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()
+        return row[0]
+    
+    def migrate(self):
+        """Применяет недостающие миграции схемы, каждую в своей транзакции"""
+        with self.pool.writer() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at INTEGER NOT NULL
+                )
+            ''')
         
-        # Таблица статистики
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS daily_stats (
-                date TEXT PRIMARY KEY,
-                total_users INTEGER DEFAULT 0,
-                online_users INTEGER DEFAULT 0,
-                daily_turnover REAL DEFAULT 0,
-                gifts_sold INTEGER DEFAULT 0,
-                total_revenue REAL DEFAULT 0
-            )
-        ''')
+        applied = []
+        for version, description, migration in MIGRATIONS:
+            with self.pool.writer() as conn:
+                cursor = conn.cursor()
+                # IMMEDIATE берет блокировку записи: параллельно стартующие воркеры не применят миграцию дважды
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+                if cursor.fetchone()[0] >= version:
+                    continue
+                migration(cursor)
+                cursor.execute(f'''
+                    INSERT INTO schema_version (version, description, applied_at)
+                    VALUES (?, ?, {NOW_EPOCH})
+                ''', (version, description))
+                applied.append(version)
+        
+        if applied:
+            print(f"Database migrated to version {applied[-1]}")
+        return applied
+    
+    def explain_query_plans(self):
+        """EXPLAIN QUERY PLAN для ключевых запросов: {запрос: (индекс используется, план)}"""
+        report = {}
+        # Отдельное соединение: читатели пула, открытые до migrate(), строят EXPLAIN по старой схеме
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for name, (query, params, index) in QUERY_PLAN_CHECKS.items():
+                plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+                uses_index = any(index in detail for detail in plan)
+                report[name] = (uses_index, plan)
+        finally:
+            conn.close()
+        return report
+    
+    def check_query_plans(self):
+        """Проверяет, что ключевые запросы идут по индексам; QueryPlanError, если нет"""
+        failed = [f'{name}: expected {QUERY_PLAN_CHECKS[name][2]}, got plan {plan}'
+                  for name, (uses_index, plan) in self.explain_query_plans().items() if not uses_index]
+        if failed:
+            raise QueryPlanError('; '.join(failed))
+    
+    @timed_query
+    def rebuild_counters(self):
+        """Пересчитывает счетчики и дневные срезы из сырых строк"""
+        with self.pool.writer() as conn:
+            _rebuild_counters(conn.cursor(), partitioned=True)
+        self.load_leaderboards()
+        self._bump_version()
+    
+    @timed_query
+    def load_leaderboards(self):
+        """Заполняет рейтинги в памяти из SQLite: агрегаты за все время и покупки за самое длинное окно"""
+        longest = max(days for days in PERIODS.values() if days is not None)
+        window_start = datetime.combine(date.today() - timedelta(days=longest - 1), datetime.min.time())
+        
+        with self.pool.reader() as conn:
+            # Один снимок на все чтения: отметка покупок согласована с загруженными очками
+            conn.execute('BEGIN')
+            try:
+                buyers = conn.execute(LEADERBOARD_BUYERS_QUERY).fetchall()
+                gifts = conn.execute(LEADERBOARD_GIFTS_QUERY).fetchall()
+                window_buyers = conn.execute(WINDOW_BUYERS_QUERY, (int(window_start.timestamp()),)).fetchall()
+                window_gifts = conn.execute(WINDOW_GIFTS_QUERY, (int(window_start.timestamp()),)).fetchall()
+                watermark = conn.execute('SELECT COALESCE(MAX(id), 0) FROM purchases').fetchone()[0]
+            finally:
+                conn.execute('COMMIT')
+        
+        self._purchase_watermark = watermark
+        self.leaderboards.reset()
+        self.leaderboards.seed_all_time(buyers, gifts)
+        self.leaderboards.seed_window(
+            [(date.fromisoformat(day).toordinal(), *rest) for day, *rest in window_buyers],
+            [(date.fromisoformat(day).toordinal(), *rest) for day, *rest in window_gifts]
+        )
+    
+    @timed_query
+    def verify_counters(self):
+        """Сверяет счетчики с сырыми строками и возвращает найденные расхождения"""
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT name, value FROM counters')
+            stored = dict(cursor.fetchall())
+            
+            # Удаленные после выгрузки месяцы учитываются по итогам из реестра партиций
+            cursor.execute('''
+                SELECT 
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(*) FROM all_purchases)
+                        + (SELECT COALESCE(SUM(purchases), 0) FROM purchase_partitions WHERE table_name IS NULL),
+                    (SELECT COALESCE(SUM(amount), 0) FROM all_purchases)
+                        + (SELECT COALESCE(SUM(revenue), 0) FROM purchase_partitions WHERE table_name IS NULL)
+            ''')
+            actual = dict(zip(('total_users', 'gifts_sold', 'total_revenue'), cursor.fetchone()))
+            
+            cursor.execute(f'''
+                SELECT d.date, d.daily_turnover, d.gifts_sold, COALESCE(p.turnover, 0), COALESCE(p.sold, 0)
+                FROM daily_stats d
+                LEFT JOIN (
+                    SELECT date(timestamp, 'unixepoch', 'localtime') AS day, SUM(amount) AS turnover, COUNT(*) AS sold
+                    FROM all_purchases
+                    GROUP BY day
+                ) p ON p.day = d.date
+                WHERE substr(d.date, 1, 7) NOT IN ({DROPPED_MONTHS})
+                UNION ALL
+                SELECT p.day, NULL, NULL, p.turnover, p.sold
+                FROM (
+                    SELECT date(timestamp, 'unixepoch', 'localtime') AS day, SUM(amount) AS turnover, COUNT(*) AS sold
+                    FROM all_purchases
+                    GROUP BY day
+                ) p
+                WHERE p.day NOT IN (SELECT date FROM daily_stats)
+            ''')
+            days = cursor.fetchall()
         
-        conn.commit()
-        conn.close()
+        drift = {}
+        for name, value in actual.items():
+            if name not in stored or abs(stored[name] - value) > 0.005:
+                drift[name] = {'stored': stored.get(name), 'actual': value}
+        
+        daily_drift = []
+        for date, turnover, sold, actual_turnover, actual_sold in days:
+            if turnover is None or abs(turnover - actual_turnover) > 0.005 or sold != actual_sold:
+                daily_drift.append({
+                    'date': date,
+                    'stored': {'turnover': turnover, 'sold': sold},
+                    'actual': {'turnover': round(actual_turnover, 2), 'sold': actual_sold}
+                })
+        
+        return {'ok': not drift and not daily_drift, 'counters': drift, 'daily_stats': daily_drift}
     
     def register_user_activity(self, user_id, username=None):
         """Регистрирует активность пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.register_activity_batch([(user_id, username, None)])
+        self.presence.touch(user_id)
+    
+    @timed_query
+    def register_activity_batch(self, entries):
+        """Записывает пачку активности [(user_id, username, last_seen epoch)] одной транзакцией"""
+        if not entries:
+            return
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, last_seen)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        ''', (user_id, username))
+        with self.pool.writer() as conn:
+            # Upsert не затирает total_spent/first_seen, в отличие от INSERT OR REPLACE
+            conn.executemany('''
+                INSERT INTO users (user_id, username, last_seen)
+                VALUES (?, ?, COALESCE(?, CAST(strftime('%s', 'now') AS INTEGER)))
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, users.username),
+                    last_seen = excluded.last_seen
+            ''', entries)
+        self._bump_version()
+    
+    @timed_query
+    def sync_presence(self):
+        """Сохраняет снимок онлайна в online_users и подтягивает активность других воркеров"""
+        entries = self.presence.drain_dirty()
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO online_users (user_id, last_activity)
-            VALUES (?, CURRENT_TIMESTAMP)
-        ''', (user_id,))
+        synced_at = int(time.time())
         
-        cursor.execute('''
-            DELETE FROM online_users 
-            WHERE datetime(last_activity) < datetime('now', '-5 minutes')
-        ''')
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            
+            cursor.executemany('''
+                INSERT INTO online_users (user_id, last_activity)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET last_activity = excluded.last_activity
+                WHERE excluded.last_activity > online_users.last_activity
+            ''', entries)
+            
+            cursor.execute('''
+                DELETE FROM online_users 
+                WHERE last_activity < ?
+            ''', (synced_at - ONLINE_WINDOW,))
+            
+            # Первый проход читает все окно, дальше только свежие записи
+            since = self._presence_synced_at
+            if since is None:
+                since = synced_at - ONLINE_WINDOW
+            cursor.execute(ONLINE_SINCE_QUERY, (since,))
+            rows = cursor.fetchall()
+        
+        for user_id, seen_at in rows:
+            self.presence.touch(user_id, seen_at=seen_at)
         
-        conn.commit()
-        conn.close()
+        self._presence_synced_at = synced_at
+        return len(entries)
+    
+    @staticmethod
+    def check_amount(amount):
+        """Сумма покупки как float; ValueError для nan/inf, нуля, отрицательных и завышенных сумм"""
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid purchase amount: {amount!r}')
+        # nan не проходит ни одно сравнение, inf отсекается верхней границей
+        if not (0 < amount <= MAX_PURCHASE_AMOUNT):
+            raise ValueError(f'Invalid purchase amount: {amount!r}')
+        return amount
     
     def register_purchase(self, user_id, username, gift_id, gift_name, amount):
         """Регистрирует покупку"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.register_purchases_batch([(user_id, username, gift_id, gift_name, amount)])
+    
+    @timed_query
+    def register_purchases_batch(self, purchases):
+        """Регистрирует пачку покупок [(user_id, username, gift_id, gift_name, amount)] одной транзакцией"""
+        if not purchases:
+            return
+        # Одна nan в пачке обнулила бы total_revenue и total_spent: проверяем до транзакции
+        for purchase in purchases:
+            self.check_amount(purchase[4])
         
         today = datetime.now().strftime('%Y-%m-%d')
+        online = self.presence.count()
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, last_seen, total_spent, total_purchases)
-            VALUES (?, ?, CURRENT_TIMESTAMP, 
-                    COALESCE((SELECT total_spent FROM users WHERE user_id = ?), 0) + ?,
-                    COALESCE((SELECT total_purchases FROM users WHERE user_id = ?), 0) + 1)
-        ''', (user_id, username, user_id, amount, user_id, 1))
-        
-        cursor.execute('''
-            INSERT INTO purchases (user_id, gift_name, gift_id, amount)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, gift_name, gift_id, amount))
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO popular_gifts (gift_id, gift_name, total_sales, last_updated)
-            VALUES (?, ?, COALESCE((SELECT total_sales FROM popular_gifts WHERE gift_id = ?), 0) + 1, CURRENT_TIMESTAMP)
-        ''', (gift_id, gift_name, gift_id))
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO daily_stats (date, total_users, online_users, daily_turnover, gifts_sold, total_revenue)
-            VALUES (?, 
-                    (SELECT COUNT(*) FROM users),
-                    (SELECT COUNT(*) FROM online_users),
-                    COALESCE((SELECT daily_turnover FROM daily_stats WHERE date = ?), 0) + ?,
-                    COALESCE((SELECT gifts_sold FROM daily_stats WHERE date = ?), 0) + 1,
-                    COALESCE((SELECT total_revenue FROM daily_stats WHERE date = ?), 0) + ?)
-        ''', (today, today, amount, today, amount))
+        # Схлопываем пачку до одной строки на пользователя и подарок
+        users = {}
+        gifts = {}
+        turnover = 0
+        for user_id, username, gift_id, gift_name, amount in purchases:
+            known_name, spent, count = users.get(user_id, (None, 0, 0))
+            users[user_id] = (username or known_name, spent + amount, count + 1)
+            gifts[gift_id] = (gift_name, gifts.get(gift_id, (None, 0))[1] + 1)
+            turnover += amount
         
-        conn.commit()
-        conn.close()
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            
+            # Upsert-инкременты: строка не пересоздается, first_seen и счетчики сохраняются
+            cursor.executemany('''
+                INSERT INTO users (user_id, username, last_seen, total_spent, total_purchases)
+                VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER), ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, users.username),
+                    last_seen = excluded.last_seen,
+                    total_spent = users.total_spent + excluded.total_spent,
+                    total_purchases = users.total_purchases + excluded.total_purchases
+            ''', [(user_id, username, spent, count) for user_id, (username, spent, count) in users.items()])
+            
+            cursor.executemany('''
+                INSERT INTO purchases (user_id, gift_name, gift_id, amount, origin)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(user_id, gift_name, gift_id, amount, self.origin)
+                  for user_id, _, gift_id, gift_name, amount in purchases])
+            
+            cursor.executemany('''
+                INSERT INTO popular_gifts (gift_id, gift_name, total_sales, last_updated)
+                VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+                ON CONFLICT(gift_id) DO UPDATE SET
+                    gift_name = excluded.gift_name,
+                    total_sales = popular_gifts.total_sales + excluded.total_sales,
+                    last_updated = excluded.last_updated
+            ''', [(gift_id, gift_name, sales) for gift_id, (gift_name, sales) in gifts.items()])
+            
+            # Число пользователей берется из счетчика, а не COUNT(*) по users
+            cursor.execute('''
+                INSERT INTO daily_stats (date, total_users, online_users, daily_turnover, gifts_sold, total_revenue)
+                VALUES (?, (SELECT value FROM counters WHERE name = 'total_users'), ?, ?, ?, ?)
+                ON CONFLICT(date) DO UPDATE SET
+                    total_users = excluded.total_users,
+                    online_users = excluded.online_users,
+                    daily_turnover = daily_stats.daily_turnover + excluded.daily_turnover,
+                    gifts_sold = daily_stats.gifts_sold + excluded.gifts_sold,
+                    total_revenue = daily_stats.total_revenue + excluded.total_revenue
+            ''', (today, online, turnover, len(purchases), turnover))
+        self.leaderboards.record_purchases(purchases)
+        self._bump_version()
     
-    def get_statistics(self):
-        """Получает текущую статистику"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @timed_query
+    def poll_changes(self):
+        """Подхватывает коммиты других процессов: чужие покупки в рейтинги и новая версия данных"""
+        if self._watch_conn is None:
+            self._watch_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # PRAGMA data_version меняется, когда базу изменило любое другое соединение
+        version = self._watch_conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._seen_data_version:
+            return 0
+        self._seen_data_version = version
         
-        today = datetime.now().strftime('%Y-%m-%d')
+        with self.pool.reader() as conn:
+            rows = conn.execute(NEW_PURCHASES_QUERY, (self._purchase_watermark,)).fetchall()
         
-        cursor.execute('''
-            SELECT 
-                (SELECT COUNT(*) FROM users) as total_users,
-                (SELECT COUNT(*) FROM online_users) as today_online,
-                COALESCE((SELECT daily_turnover FROM daily_stats WHERE date = ?), 0) as daily_turnover,
-                (SELECT COUNT(*) FROM purchases) as gifts_sold,
-                COALESCE((SELECT SUM(total_spent) FROM users), 0) as total_revenue,
-                COALESCE((SELECT COUNT(*) FROM purchases WHERE date(timestamp) = ?), 0) as today_sales,
-                COALESCE((SELECT SUM(amount) FROM purchases WHERE date(timestamp) >= date('now', '-7 days')), 0) as week_revenue
-        ''', (today, today))
+        external = {}
+        for purchase_id, origin, user_id, username, gift_id, gift_name, amount, day in rows:
+            self._purchase_watermark = purchase_id
+            if origin != self.origin:
+                external.setdefault(day, []).append((user_id, username, gift_id, gift_name, amount))
+        for day, purchases in external.items():
+            self.leaderboards.record_purchases(purchases, day=date.fromisoformat(day).toordinal())
         
-        stats = cursor.fetchone()
+        self._bump_version()
+        return sum(len(purchases) for purchases in external.values())
+    
+    @timed_query
+    def save_payment(self, row):
+        """Сохраняет новый платеж: строка в порядке PAYMENT_COLUMNS"""
+        with self.pool.writer() as conn:
+            conn.execute(f'''
+                INSERT INTO payments ({', '.join(PAYMENT_COLUMNS)})
+                VALUES ({', '.join('?' * len(PAYMENT_COLUMNS))})
+            ''', row)
+    
+    @timed_query
+    def update_payments(self, rows):
+        """Фиксирует исход ожидающих платежей [(status, paid_at, paid_amount, tx_hash, payment_id)]"""
+        if not rows:
+            return
+        with self.pool.writer() as conn:
+            conn.executemany('''
+                UPDATE payments
+                SET status = ?, paid_at = ?, paid_amount = ?, tx_hash = ?
+                WHERE payment_id = ? AND status = 'pending'
+            ''', rows)
+    
+    @timed_query
+    def get_payment(self, payment_id):
+        with self.pool.reader() as conn:
+            return conn.execute(f'''
+                SELECT {', '.join(PAYMENT_COLUMNS)} FROM payments WHERE payment_id = ?
+            ''', (payment_id,)).fetchone()
+    
+    @timed_query
+    def consume_payment(self, payment_id):
+        """Атомарно помечает оплаченный платеж использованным; False, если его уже забрал другой запрос"""
+        with self.pool.writer() as conn:
+            cursor = conn.execute('''
+                UPDATE payments SET status = 'consumed'
+                WHERE payment_id = ? AND status = 'paid'
+            ''', (payment_id,))
+            return cursor.rowcount == 1
+    
+    @timed_query
+    def release_payment(self, payment_id):
+        """Возвращает использованный платеж в 'paid', если покупку по нему не удалось записать"""
+        with self.pool.writer() as conn:
+            cursor = conn.execute('''
+                UPDATE payments SET status = 'paid'
+                WHERE payment_id = ? AND status = 'consumed'
+            ''', (payment_id,))
+            return cursor.rowcount == 1
+    
+    @timed_query
+    def get_settings(self):
+        """Сохраненные настройки {имя: значение}"""
+        with self.pool.reader() as conn:
+            return dict(conn.execute('SELECT name, value FROM settings').fetchall())
+    
+    @timed_query
+    def save_settings(self, values):
+        """Записывает настройки {имя: значение}; остальные воркеры подхватят их через ChangeWatcher"""
+        with self.pool.writer() as conn:
+            conn.executemany('''
+                INSERT INTO settings (name, value) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value
+            ''', list(values.items()))
+    
+    @timed_query
+    def load_pending_payments(self, since):
+        with self.pool.reader() as conn:
+            return conn.execute(f'''
+                SELECT {', '.join(PAYMENT_COLUMNS)} FROM payments
+                WHERE status = 'pending' AND created_at >= ?
+            ''', (int(since),)).fetchall()
+    
+    @timed_query
+    def get_statistics(self):
+        """Получает текущую статистику"""
+        now = datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        week_start = (now - timedelta(days=7)).strftime('%Y-%m-%d')
+        
+        # Только точечные чтения счетчиков и диапазон по первичному ключу daily_stats
+        with self.pool.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    COALESCE((SELECT value FROM counters WHERE name = 'total_users'), 0) as total_users,
+                    COALESCE((SELECT daily_turnover FROM daily_stats WHERE date = ?), 0) as daily_turnover,
+                    COALESCE((SELECT value FROM counters WHERE name = 'gifts_sold'), 0) as gifts_sold,
+                    COALESCE((SELECT value FROM counters WHERE name = 'total_revenue'), 0) as total_revenue,
+                    COALESCE((SELECT gifts_sold FROM daily_stats WHERE date = ?), 0) as today_sales,
+                    COALESCE((SELECT SUM(daily_turnover) FROM daily_stats WHERE date >= ?), 0) as week_revenue
+            ''', (today, today, week_start))
+            stats = cursor.fetchone()
         
         result = {
-            'totalUsers': stats[0] if stats else 0,
-            'todayOnline': stats[1] if stats else 0,
-            'dailyTurnover': round(stats[2], 2) if stats else 0,
-            'giftsSold': stats[3] if stats else 0,
-            'totalRevenue': round(stats[4], 2) if stats else 0,
-            'todayRevenue': round(stats[2], 2) if stats else 0,
-            'weekRevenue': round(stats[6], 2) if stats else 0,
-            'totalSales': stats[3] if stats else 0
+            'totalUsers': int(stats[0]) if stats else 0,
+            'todayOnline': self.presence.count(),
+            'dailyTurnover': round(stats[1], 2) if stats else 0,
+            'giftsSold': int(stats[2]) if stats else 0,
+            'totalRevenue': round(stats[3], 2) if stats else 0,
+            'todayRevenue': round(stats[1], 2) if stats else 0,
+            'weekRevenue': round(stats[5], 2) if stats else 0,
+            'totalSales': int(stats[2]) if stats else 0
         }
-        
-        conn.close()
         return result
     
-    def get_top_buyers(self, limit=10):
-        """Получает топ покупателей"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT username, total_spent, total_purchases 
-            FROM users 
-            WHERE total_spent > 0 
-            ORDER BY total_spent DESC 
-            LIMIT ?
-        ''', (limit,))
-        
+    @timed_query
+    def get_top_buyers(self, limit=10, period='all'):
+        """Получает топ покупателей из рейтинга в памяти"""
         buyers = []
-        for row in cursor.fetchall():
+        for _, spent, purchases, username in self.leaderboards.top_buyers(limit, period):
             buyers.append({
-                'username': row[0] or 'Аноним',
-                'spent': round(row[1], 2),
-                'purchases': row[2]
+                'username': username or 'Аноним',
+                'spent': round(spent, 2),
+                'purchases': purchases
             })
-        
-        conn.close()
         return buyers
     
-    def get_popular_gifts(self, limit=10):
-        """Получает популярные подарки"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT gift_name, total_sales 
-            FROM popular_gifts 
-            ORDER BY total_sales DESC 
-            LIMIT ?
-        ''', (limit,))
-        
+    @timed_query
+    def get_popular_gifts(self, limit=10, period='all'):
+        """Получает популярные подарки из рейтинга в памяти"""
         gifts = []
-        for row in cursor.fetchall():
+        for _, sales, _, gift_name in self.leaderboards.top_gifts(limit, period):
             gifts.append({
-                'name': row[0],
-                'sales': row[1]
+                'name': gift_name,
+                'sales': sales
             })
-        
-        conn.close()
         return gifts
 
-# Глобальный экземпляр базы данных
-stats_db = StatisticsDB()
\ No newline at end of file
+    @timed_query
+    def get_revenue_between(self, start, end):
+        """Количество и сумма покупок в полуинтервале [start, end) unix-времени"""
+        start, end = int(start), int(end)
+        with self.pool.reader() as conn:
+            # Один снимок: месяц не должен переехать в партицию между чтением реестра и таблиц
+            conn.execute('BEGIN')
+            try:
+                count, revenue = conn.execute(REVENUE_BETWEEN_QUERY, (start, end)).fetchone()
+                for month, table, month_start, month_end, purchases, month_revenue in conn.execute(
+                        PARTITIONS_IN_RANGE_QUERY, (end, start)).fetchall():
+                    if start <= month_start and month_end <= end:
+                        # Месяц целиком в диапазоне: итоги из реестра без чтения строк
+                        part_count, part_revenue = purchases, month_revenue
+                    elif table is not None:
+                        part_count, part_revenue = conn.execute(
+                            PARTITION_REVENUE_QUERY.format(table=table), (start, end)
+                        ).fetchone()
+                    else:
+                        # Строки удалены после выгрузки: остаются дневные срезы, точность до дня
+                        part_count, part_revenue = conn.execute('''
+                            SELECT COALESCE(SUM(gifts_sold), 0), COALESCE(SUM(daily_turnover), 0)
+                            FROM daily_stats
+                            WHERE date >= ? AND date <= ? AND substr(date, 1, 7) = ?
+                        ''', (date.fromtimestamp(start).isoformat(), date.fromtimestamp(end - 1).isoformat(),
+                              month)).fetchone()
+                    count += part_count
+                    revenue += part_revenue
+            finally:
+                conn.execute('COMMIT')
+        return {'count': count, 'revenue': round(revenue, 2)}
+    
+    def get_partitions(self):
+        """Реестр месячных партиций покупок"""
+        with self.pool.reader() as conn:
+            rows = conn.execute('''
+                SELECT month, table_name, purchases, revenue, archived_at, export_path
+                FROM purchase_partitions
+                ORDER BY month
+            ''').fetchall()
+        return [
+            {'month': month, 'table': table, 'purchases': purchases, 'revenue': round(revenue, 2),
+             'archived_at': archived_at, 'export_path': export_path}
+            for month, table, purchases, revenue, archived_at, export_path in rows
+        ]
+    
+    def closed_months(self, hot_months=HOT_MONTHS, today=None):
+        """Месяцы с покупками в горячей таблице, которые можно вынести в партиции"""
+        today = today or date.today()
+        # Горячими остаются hot_months последних месяцев и окна рейтингов (они читают только purchases)
+        longest = max(days for days in PERIODS.values() if days is not None)
+        month_index = today.year * 12 + today.month - 1 - (max(1, hot_months) - 1)
+        cutoff = min(date(month_index // 12, month_index % 12 + 1, 1), today - timedelta(days=longest))
+        
+        # Только месяцы со строками: от каждой покупки прыгаем к первой покупке после конца ее месяца
+        # (MIN по idx_purchases_timestamp), пустые месяцы между ними не порождают партиций
+        months = []
+        after = None
+        with self.pool.reader() as conn:
+            while True:
+                if after is None:
+                    oldest = conn.execute('SELECT MIN(timestamp) FROM purchases').fetchone()[0]
+                else:
+                    oldest = conn.execute('SELECT MIN(timestamp) FROM purchases WHERE timestamp >= ?',
+                                          (after,)).fetchone()[0]
+                if oldest is None:
+                    return months
+                month = date.fromtimestamp(oldest).strftime('%Y-%m')
+                end = _month_bounds(month)[1]
+                if end.date() > cutoff:
+                    return months
+                months.append(month)
+                after = int(end.timestamp())
+    
+    @timed_query
+    def archive_month(self, month):
+        """Переносит покупки месяца 'YYYY-MM' в партицию и пересчитывает его дневные срезы"""
+        start, end = _month_bounds(month)
+        start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+        table = _partition_table(month)
+        columns = ', '.join(PURCHASE_COLUMNS)
+        
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            if cursor.execute('SELECT 1 FROM purchase_partitions WHERE month = ?', (month,)).fetchone():
+                return None
+            
+            cursor.execute(f'''
+                CREATE TABLE {table} (
+                    id INTEGER PRIMARY KEY,
+                    user_id TEXT,
+                    gift_name TEXT,
+                    gift_id TEXT,
+                    amount REAL,
+                    timestamp INTEGER NOT NULL,
+                    origin TEXT
+                )
+            ''')
+            cursor.execute(f'''
+                INSERT INTO {table} ({columns})
+                SELECT {columns} FROM purchases WHERE timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp
+            ''', (start_ts, end_ts))
+            cursor.execute(f'CREATE INDEX idx_{table}_timestamp ON {table} (timestamp, amount)')
+            count, revenue = cursor.execute(
+                f'SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM {table}'
+            ).fetchone()
+            
+            cursor.execute('DELETE FROM purchases WHERE timestamp >= ? AND timestamp < ?', (start_ts, end_ts))
+            # Триггер удаления уменьшил счетчики, а покупки не исчезли, а переехали
+            cursor.execute("UPDATE counters SET value = value + ? WHERE name = 'gifts_sold'", (count,))
+            cursor.execute("UPDATE counters SET value = value + ? WHERE name = 'total_revenue'", (revenue,))
+            
+            # Закрытый месяц больше не меняется: его дневные срезы сверяются с сырыми строками один раз
+            _rollup_daily(cursor, table, start.date().isoformat(), end.date().isoformat())
+            cursor.execute(f'''
+                INSERT INTO purchase_partitions (month, table_name, start_ts, end_ts, purchases, revenue, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, {NOW_EPOCH})
+            ''', (month, table, start_ts, end_ts, count, revenue))
+            _create_purchases_view(cursor)
+        return {'month': month, 'table': table, 'purchases': count, 'revenue': round(revenue, 2)}
+    
+    @timed_query
+    def export_partition(self, month, directory):
+        """Выгружает партицию месяца в directory/purchases-YYYY-MM.csv.gz и возвращает путь"""
+        with self.pool.reader() as conn:
+            row = conn.execute('SELECT table_name FROM purchase_partitions WHERE month = ?', (month,)).fetchone()
+            if row is None or row[0] is None:
+                raise ValueError(f'Partition {month} has no rows to export')
+            
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'purchases-{month}.csv.gz')
+            # Пишем во временный файл: оборванная выгрузка не выдаст себя за готовый архив
+            with gzip.open(path + '.tmp', 'wt', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(PURCHASE_COLUMNS)
+                writer.writerows(conn.execute(f'''
+                    SELECT {', '.join(PURCHASE_COLUMNS)} FROM {row[0]} ORDER BY timestamp, id
+                '''))
+            os.replace(path + '.tmp', path)
+        
+        with self.pool.writer() as conn:
+            conn.execute('UPDATE purchase_partitions SET export_path = ? WHERE month = ?', (path, month))
+        return path
+    
+    @timed_query
+    def drop_partition(self, month):
+        """Удаляет сырые строки выгруженной партиции; месяц остается в daily_stats и итогах реестра"""
+        with self.pool.writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            row = cursor.execute('''
+                SELECT table_name, export_path FROM purchase_partitions WHERE month = ?
+            ''', (month,)).fetchone()
+            if row is None or row[0] is None:
+                return False
+            if row[1] is None:
+                raise ValueError(f'Partition {month} must be exported before it is dropped')
+            cursor.execute('UPDATE purchase_partitions SET table_name = NULL WHERE month = ?', (month,))
+            _create_purchases_view(cursor)
+            cursor.execute(f'DROP TABLE {row[0]}')
+        return True
+    
+    def archive_closed_months(self, hot_months=HOT_MONTHS, export_dir=None, drop=False, today=None):
+        """Выносит закрытые месяцы в партиции, при export_dir выгружает их, при drop удаляет сырые строки"""
+        archived = []
+        for month in self.closed_months(hot_months, today):
+            result = self.archive_month(month)
+            if result is not None:
+                archived.append(result)
+        
+        if export_dir or drop:
+            for partition in self.get_partitions():
+                if partition['table'] is None:
+                    continue
+                if export_dir and partition['export_path'] is None:
+                    self.export_partition(partition['month'], export_dir)
+                if drop:
+                    self.drop_partition(partition['month'])
+        return archived
+
+# Глобальный экземпляр базы данных: миграции и загрузка рейтингов идут в on_startup, а не при импорте
+stats_db = StatisticsDB(os.environ.get('STATS_DB_PATH', 'giftprises_stats.db'), initialize=False)
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Обслуживание агрегатов статистики')
+    parser.add_argument('command', choices=['verify', 'rebuild', 'migrate', 'explain', 'archive'])
+    parser.add_argument('--db', default='giftprises_stats.db')
+    parser.add_argument('--hot-months', type=int, default=HOT_MONTHS, help='archive: месяцев в горячей таблице')
+    parser.add_argument('--export-dir', help='archive: каталог для purchases-YYYY-MM.csv.gz')
+    parser.add_argument('--drop', action='store_true', help='archive: удалить сырые строки выгруженных партиций')
+    args = parser.parse_args()
+    
+    db = StatisticsDB(args.db)
+    if args.command == 'archive':
+        if args.drop and not args.export_dir:
+            parser.error('--drop requires --export-dir')
+        archived = db.archive_closed_months(args.hot_months, args.export_dir, args.drop)
+        partitions = db.get_partitions()
+        db.close()
+        print(json.dumps({'archived': archived, 'partitions': partitions}, ensure_ascii=False, indent=2))
+        raise SystemExit(0)
+    if args.command == 'migrate':
+        print(f"Schema version: {db.get_schema_version()}")
+        db.close()
+        raise SystemExit(0)
+    if args.command == 'explain':
+        plans = db.explain_query_plans()
+        db.close()
+        for name, (uses_index, plan) in plans.items():
+            print(f"{'OK  ' if uses_index else 'FAIL'} {name}: {'; '.join(plan)}")
+        raise SystemExit(0 if all(uses_index for uses_index, _ in plans.values()) else 1)
+    if args.command == 'rebuild':
+        db.rebuild_counters()
+    report = db.verify_counters()
+    db.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    raise SystemExit(0 if report['ok'] else 1)
\ No newline at end of file
@@ -0,0 +1,148 @@
+# db_pool.py
+import sqlite3
+import threading
+import queue
+import time
+import asyncio
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Прагмы, применяемые к каждому соединению пула
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-8000',
+)
+
+
+class SQLitePool:
+    """Пул долгоживущих соединений SQLite: один писатель и N читателей"""
+
+    def __init__(self, db_path, readers=4, acquire_timeout=10.0):
+        self.db_path = db_path
+        self.readers_count = max(1, int(readers))
+        self.acquire_timeout = acquire_timeout
+
+        self._writer = self._connect()
+        self._writer_lock = threading.Lock()
+        self._readers = queue.Queue()
+        for _ in range(self.readers_count):
+            self._readers.put(self._connect())
+
+        # Один поток на соединение: задачи в executor не ждут друг друга дольше, чем соединение
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.readers_count + 1,
+            thread_name_prefix='sqlite-pool'
+        )
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'reads': 0,
+            'writes': 0,
+            'readers_in_use': 0,
+            'writer_in_use': 0,
+            'read_wait_total': 0.0,
+            'read_wait_max': 0.0,
+            'write_wait_total': 0.0,
+            'write_wait_max': 0.0,
+            'timeouts': 0,
+        }
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5.0)
+        cursor = conn.cursor()
+        for pragma in CONNECTION_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+        return conn
+
+    def _record_wait(self, kind, waited):
+        with self._metrics_lock:
+            self._metrics[f'{kind}s'] += 1
+            self._metrics[f'{kind}_wait_total'] += waited
+            if waited > self._metrics[f'{kind}_wait_max']:
+                self._metrics[f'{kind}_wait_max'] = waited
+
+    def _set_in_use(self, key, delta):
+        with self._metrics_lock:
+            self._metrics[key] += delta
+
+    def _timeout(self, kind):
+        with self._metrics_lock:
+            self._metrics['timeouts'] += 1
+        raise TimeoutError(f'SQLite pool: no {kind} connection available in {self.acquire_timeout}s')
+
+    @contextmanager
+    def reader(self):
+        """Выдает соединение для чтения из пула"""
+        if self._closed:
+            raise RuntimeError('SQLite pool is closed')
+        started = time.perf_counter()
+        try:
+            conn = self._readers.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            self._timeout('reader')
+        self._record_wait('read', time.perf_counter() - started)
+        self._set_in_use('readers_in_use', 1)
+        try:
+            yield conn
+        finally:
+            self._set_in_use('readers_in_use', -1)
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Выдает единственное соединение для записи; коммитит при успехе, откатывает при ошибке"""
+        if self._closed:
+            raise RuntimeError('SQLite pool is closed')
+        started = time.perf_counter()
+        if not self._writer_lock.acquire(timeout=self.acquire_timeout):
+            self._timeout('writer')
+        self._record_wait('write', time.perf_counter() - started)
+        self._set_in_use('writer_in_use', 1)
+        try:
+            yield self._writer
+            self._writer.commit()
+        except Exception:
+            self._writer.rollback()
+            raise
+        finally:
+            self._set_in_use('writer_in_use', -1)
+            self._writer_lock.release()
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет синхронную функцию в пуле потоков, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics['readers'] = self.readers_count
+        metrics['readers_idle'] = self._readers.qsize()
+        reads, writes = metrics['reads'], metrics['writes']
+        metrics['read_wait_avg'] = metrics['read_wait_total'] / reads if reads else 0.0
+        metrics['write_wait_avg'] = metrics['write_wait_total'] / writes if writes else 0.0
+        # Время ожидания отдаем в миллисекундах
+        for key in ('read_wait_total', 'read_wait_max', 'read_wait_avg',
+                    'write_wait_total', 'write_wait_max', 'write_wait_avg'):
+            metrics[f'{key}_ms'] = round(metrics.pop(key) * 1000, 3)
+        return metrics
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.executor.shutdown(wait=True)
+        with self._writer_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,30 @@
+# images.py
+import hashlib
+
+# Префикс маршрута, по которому main.init_app отдает изображения
+IMAGE_ROUTE_PREFIX = '/img/'
+
+
+class ImageStore:
+    """Хранилище отрисованных изображений, адресуемых хэшем содержимого"""
+
+    def __init__(self):
+        self._images = {}
+
+    def put(self, content, extension='svg'):
+        """Сохраняет байты и возвращает постоянный URL вида /img/{hash}.svg"""
+        digest = hashlib.sha256(content).hexdigest()[:20]
+        self._images.setdefault(digest, content)
+        return f'{IMAGE_ROUTE_PREFIX}{digest}.{extension}'
+
+    def get(self, digest):
+        return self._images.get(digest)
+
+    def __len__(self):
+        return len(self._images)
+
+    def total_bytes(self):
+        return sum(len(content) for content in self._images.values())
+
+
+image_store = ImageStore()
@@ -0,0 +1,149 @@
+# instrumentation.py
+import asyncio
+import time
+
+from aiohttp import web
+
+from metrics import FINE_BUCKETS_MS, Histogram
+
+
+class RouteStats:
+    __slots__ = ('requests', 'in_flight', 'statuses', 'latency')
+
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        # класс статуса ('2xx', '4xx', ...) -> количество
+        self.statuses = {}
+        self.latency = Histogram()
+
+
+class HttpMetrics:
+    """Счетчики HTTP по маршрутам: запросы, ответы по классам статуса, in-flight и задержки"""
+
+    def __init__(self):
+        self.routes = {}
+
+    def _route(self, request):
+        resource = request.match_info.route.resource
+        # Шаблон маршрута, а не путь: /img/{digest}.svg не плодит метрики на каждый файл
+        name = resource.canonical if resource is not None else 'unmatched'
+        stats = self.routes.get(name)
+        if stats is None:
+            stats = self.routes[name] = RouteStats()
+        return stats
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        stats = self._route(request)
+        stats.requests += 1
+        stats.in_flight += 1
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            stats.in_flight -= 1
+            stats.latency.observe((time.perf_counter() - started) * 1000)
+            status_class = f'{status // 100}xx'
+            stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже заданного срабатывает периодический таймер"""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.lag = Histogram(FINE_BUCKETS_MS)
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self._task = None
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, (loop.time() - expected) * 1000)
+            self.lag.observe(lag)
+            self.last_ms = round(lag, 3)
+            if lag > self.max_ms:
+                self.max_ms = round(lag, 3)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class PrometheusText:
+    """Сборщик текстового формата Prometheus: сэмплы группируются по семействам метрик"""
+
+    def __init__(self, prefix='giftprises'):
+        self.prefix = prefix
+        # имя -> (тип, описание, строки)
+        self._families = {}
+
+    def _family(self, name, kind, help_text):
+        name = f'{self.prefix}_{name}'
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help_text, [])
+        return name, family[2]
+
+    def sample(self, name, value, labels=None, kind='gauge', help_text=''):
+        name, lines = self._family(name, kind, help_text)
+        lines.append(f'{name}{_labels(labels)} {float(value):g}')
+
+    def histogram(self, name, histogram, labels=None, help_text=''):
+        name, lines = self._family(name, 'histogram', help_text)
+        labels = dict(labels or {})
+        for bound, running in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'{name}_bucket{_labels({**labels, "le": le})} {running}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram.sum:g}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+    def component(self, component, stats):
+        """Числовые поля get_stats() компонента как gauge giftprises_<component>{field=...}"""
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                self.sample(component, value, {'field': key}, help_text=f'{component} get_stats() fields')
+
+    def render(self):
+        out = []
+        for name, (kind, help_text, lines) in self._families.items():
+            if help_text:
+                out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+http_metrics = HttpMetrics()
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,193 @@
+# leaderboards.py
+import heapq
+import threading
+from datetime import date
+
+# Периоды рейтингов: имя -> число дней в окне (None — за все время)
+PERIODS = {'all': None, 'week': 7, 'today': 1}
+
+
+class Leaderboard:
+    """Рейтинг с неубывающими очками: все очки в словаре, отсортированный топ-K в списке"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        # key -> [score, count, label]
+        self.entries = {}
+        # Ключи топа по убыванию очков
+        self._top = []
+        self._in_top = set()
+
+    def add(self, key, score, count=1, label=None, day=None):
+        """Прибавляет очки; позиция в топе поправляется за O(K)"""
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0, 0, label]
+        entry[0] += score
+        entry[1] += count
+        if label is not None:
+            entry[2] = label
+        self._promote(key, entry[0])
+
+    def _promote(self, key, score):
+        top = self._top
+        if key in self._in_top:
+            position = top.index(key)
+        elif len(top) < self.capacity or score > self.entries[top[-1]][0]:
+            top.append(key)
+            self._in_top.add(key)
+            position = len(top) - 1
+        else:
+            return
+        # Очки только растут, поэтому ключ может двигаться лишь вверх
+        while position > 0 and self.entries[top[position - 1]][0] < score:
+            top[position - 1], top[position] = key, top[position - 1]
+            position -= 1
+        if len(top) > self.capacity:
+            self._in_top.discard(top.pop())
+
+    def subtract(self, scores):
+        """Вычитает очки {key: (score, count)}; после вычитаний нужен rebuild()"""
+        for key, (score, count) in scores.items():
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            entry[0] -= score
+            entry[1] -= count
+            if entry[1] <= 0:
+                del self.entries[key]
+
+    def rebuild(self):
+        """Пересобирает топ из всех очков"""
+        self._top = heapq.nlargest(self.capacity, self.entries, key=lambda key: self.entries[key][0])
+        self._in_top = set(self._top)
+
+    def top(self, limit):
+        """[(key, score, count, label)] по убыванию очков"""
+        if limit <= len(self._top) or len(self._top) == len(self.entries):
+            keys = self._top[:limit]
+        else:
+            # Запрошено больше, чем держит топ: редкий случай, сортируем все очки
+            keys = heapq.nlargest(limit, self.entries, key=lambda key: self.entries[key][0])
+        return [(key, *self.entries[key]) for key in keys]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class WindowedLeaderboard:
+    """Рейтинг за последние days дней: посуточные корзины, истекшие вычитаются целиком"""
+
+    def __init__(self, days, capacity=100):
+        self.days = days
+        self.board = Leaderboard(capacity)
+        # день (date.toordinal) -> {key: [score, count]}
+        self._buckets = {}
+        self._today = None
+
+    def roll(self, today):
+        """Сдвигает окно на сегодняшний день"""
+        if today == self._today:
+            return
+        self._today = today
+        cutoff = today - self.days + 1
+        stale = [day for day in self._buckets if day < cutoff]
+        if not stale:
+            return
+        for day in stale:
+            self.board.subtract(self._buckets.pop(day))
+        self.board.rebuild()
+
+    def add(self, key, score, count=1, label=None, day=None):
+        if day <= self._today - self.days:
+            return
+        bucket = self._buckets.setdefault(day, {})
+        totals = bucket.setdefault(key, [0, 0])
+        totals[0] += score
+        totals[1] += count
+        self.board.add(key, score, count, label)
+
+    def top(self, limit):
+        return self.board.top(limit)
+
+    def __len__(self):
+        return len(self.board)
+
+
+class Leaderboards:
+    """Топ покупателей и подарков за все время, неделю и сегодня"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _boards(self):
+        return {period: Leaderboard(self.capacity) if days is None else WindowedLeaderboard(days, self.capacity)
+                for period, days in PERIODS.items()}
+
+    def reset(self):
+        with self._lock:
+            self.buyers = self._boards()
+            self.gifts = self._boards()
+            self._roll(date.today().toordinal())
+
+    def _roll(self, today):
+        # Сдвигаются только оконные рейтинги: рейтинг за все время не устаревает
+        for boards in (self.buyers, self.gifts):
+            for board in boards.values():
+                if isinstance(board, WindowedLeaderboard):
+                    board.roll(today)
+
+    def seed_all_time(self, buyers, gifts):
+        """Начальные очки за все время: [(user_id, username, spent, purchases)], [(gift_id, name, sales)]"""
+        with self._lock:
+            for user_id, username, spent, purchases in buyers:
+                self.buyers['all'].add(user_id, spent, purchases, username)
+            for gift_id, gift_name, sales in gifts:
+                self.gifts['all'].add(gift_id, sales, sales, gift_name)
+
+    def seed_window(self, buyers, gifts, today=None):
+        """Посуточные очки окна: [(day, user_id, username, spent, purchases)], [(day, gift_id, name, sales)]"""
+        today = date.today().toordinal() if today is None else today
+        windows = [period for period, days in PERIODS.items() if days is not None]
+        with self._lock:
+            self._roll(today)
+            for day, user_id, username, spent, purchases in buyers:
+                for period in windows:
+                    self.buyers[period].add(user_id, spent, purchases, username, day=day)
+            for day, gift_id, gift_name, sales in gifts:
+                for period in windows:
+                    self.gifts[period].add(gift_id, sales, sales, gift_name, day=day)
+
+    def record_purchases(self, purchases, day=None, today=None):
+        """Учитывает пачку покупок [(user_id, username, gift_id, gift_name, amount)], совершенных в день day"""
+        today = date.today().toordinal() if today is None else today
+        day = today if day is None else day
+        with self._lock:
+            self._roll(today)
+            for user_id, username, gift_id, gift_name, amount in purchases:
+                for board in self.buyers.values():
+                    board.add(user_id, amount, 1, username, day=day)
+                for board in self.gifts.values():
+                    board.add(gift_id, 1, 1, gift_name, day=day)
+
+    def top_buyers(self, limit=10, period='all'):
+        """[(user_id, spent, purchases, username)] за период"""
+        with self._lock:
+            self._roll(date.today().toordinal())
+            return self.buyers[period].top(limit)
+
+    def top_gifts(self, limit=10, period='all'):
+        """[(gift_id, sales, sales, name)] за период"""
+        with self._lock:
+            self._roll(date.today().toordinal())
+            return self.gifts[period].top(limit)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'buyers': {period: len(board) for period, board in self.buyers.items()},
+                'gifts': {period: len(board) for period, board in self.gifts.items()},
+            }
@@ -1,24 +1,228 @@
 # main.py
-from aiohttp import web
 import asyncio
+import math
 import os
+import secrets
 import sys
 
 # Добавляем текущую директорию в путь Python
 sys.path.append(os.path.dirname(__file__))
 
-# Теперь импортируем модули
+# Теперь импортируем модули; startup первым, он замеряет импорт aiohttp и остальные этапы запуска
 try:
-    from database import stats_db
-    from webapp_api import *
+    from startup import startup
+    from aiohttp import web
+    with startup.phase('import database'):
+        from database import stats_db
+    with startup.phase('import api'):
+        from webapp_api import (
+            webapp_api, image_store, statistics_version, leaderboard_version, catalog_version,
+            register_activity_endpoint, get_statistics_endpoint,
+            get_top_buyers_endpoint, get_popular_gifts_endpoint, search_gifts_endpoint, get_all_gifts_endpoint,
+            check_payment_endpoint, purchase_gift_endpoint, get_db_metrics_endpoint, get_cache_stats_endpoint,
+            get_response_cache_stats_endpoint, get_payment_stats_endpoint
+        )
+        from api_router import ApiRouter, ApiError
+        from response_cache import CachedResponse, response_cache
+        from static_assets import static_assets
+    with startup.phase('import services'):
+        from activity_buffer import activity_buffer
+        from purchase_recorder import purchase_recorder
+        from payments import payment_watcher
+        from change_watcher import change_watcher
+        from admission import Rejected, admission, client_identity, user_identity
+        from instrumentation import PrometheusText, http_metrics, loop_monitor
+        from profiler import profiler, ProfilerBusy
+        from stats_feed import stats_feed, KEEPALIVE_INTERVAL
 except ImportError as e:
     print(f"Import error: {e}")
     print(f"Current directory: {os.getcwd()}")
     print(f"Files in directory: {os.listdir('.')}")
     raise
 
+def static_response(request, asset, cache_control, status=200):
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    etag = asset.etag_for(asset.choose_encoding(accept_encoding))
+    headers = {
+        'ETag': etag,
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding'
+    }
+    if status == 200 and etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    body, encoding = asset.encoded(accept_encoding)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=body, status=status, content_type=asset.content_type, charset='utf-8',
+                        headers=headers)
+
 async def handle_index(request):
-    return web.FileResponse('./static/index.html')
+    page = static_assets.pages.get('index')
+    if page is None:
+        return web.FileResponse('./static/index.html')
+    # Оболочка перепроверяется при каждом открытии: после деплоя она ссылается на новые хэши ассетов
+    return static_response(request, page, 'no-cache')
+
+async def handle_static(request):
+    asset = static_assets.assets.get(request.match_info['name'])
+    if asset is None:
+        raise web.HTTPNotFound()
+    # Имя содержит хэш содержимого: файл по этому адресу никогда не меняется
+    return static_response(request, asset, 'public, max-age=31536000, immutable')
+
+@web.middleware
+async def not_found_middleware(request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPNotFound:
+        page = static_assets.pages.get('404')
+        if page is None or request.method != 'GET' or request.path.startswith('/api/'):
+            raise
+        return static_response(request, page, 'no-cache', status=404)
+
+async def handle_image(request):
+    digest = request.match_info['digest']
+    content = image_store.get(digest)
+    if content is None:
+        # Изображения рисуются при сборке каталога: в свежем процессе собираем его
+        await webapp_api.get_catalog()
+        content = image_store.get(digest)
+    if content is None:
+        raise web.HTTPNotFound()
+    
+    etag = f'"{digest}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'public, max-age=31536000, immutable'
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=content, content_type='image/svg+xml', headers=headers)
+
+async def handle_stats_stream(request):
+    # Server-Sent Events: снимок статистики при подключении, дальше только изменения
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Access-Control-Allow-Origin': '*',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+    
+    try:
+        async with stats_feed.subscribe() as queue:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    payload = b': keepalive\n\n'
+                if payload is None:
+                    break
+                await response.write(payload)
+    except ConnectionResetError:
+        pass
+    return response
+
+def collect_metrics():
+    metrics = PrometheusText()
+    
+    for route, stats in sorted(http_metrics.routes.items()):
+        labels = {'route': route}
+        metrics.sample('http_requests_total', stats.requests, labels, 'counter', 'HTTP requests by route')
+        metrics.sample('http_requests_in_flight', stats.in_flight, labels, help_text='HTTP requests in progress')
+        for status, count in sorted(stats.statuses.items()):
+            metrics.sample('http_responses_total', count, {**labels, 'status': status}, 'counter',
+                           'HTTP responses by status class')
+        metrics.histogram('http_request_duration_ms', stats.latency, labels, 'HTTP request latency, ms')
+    
+    for name, endpoint in sorted(api_router.endpoints.items()):
+        labels = {'endpoint': name}
+        metrics.sample('api_requests_total', endpoint.requests, labels, 'counter', 'API calls by endpoint')
+        metrics.sample('api_failures_total', endpoint.failures, labels, 'counter', 'API calls answered with success=false')
+        metrics.sample('api_errors_total', endpoint.errors, labels, 'counter', 'API calls that raised')
+        metrics.sample('api_cache_hits_total', endpoint.cache_hits, labels, 'counter', 'API calls served from the response cache')
+        metrics.sample('api_in_flight', endpoint.in_flight, labels, help_text='API calls in progress')
+        metrics.histogram('api_duration_ms', endpoint.latency, labels, 'API handler latency, ms')
+    
+    for method, histogram in stats_db.timings.items():
+        metrics.histogram('sqlite_call_duration_ms', histogram, {'method': method}, 'StatisticsDB call duration, ms')
+    
+    metrics.histogram('event_loop_lag_ms', loop_monitor.lag, help_text='Event loop timer lag, ms')
+    metrics.sample('event_loop_lag_max_ms', loop_monitor.max_ms, help_text='Worst event loop lag since start, ms')
+    
+    metrics.component('db_pool', stats_db.get_pool_metrics())
+    metrics.component('gifts_cache', webapp_api.cache.get_stats())
+    metrics.component('response_cache', response_cache.get_stats())
+    metrics.component('activity_buffer', activity_buffer.get_stats())
+    metrics.component('purchase_recorder', purchase_recorder.get_stats())
+    metrics.component('payment_watcher', payment_watcher.get_stats())
+    metrics.component('stats_feed', stats_feed.get_stats())
+    metrics.component('change_watcher', change_watcher.get_stats())
+    metrics.component('admission', admission.get_stats())
+    metrics.component('startup', startup.get_stats())
+    for name, asset in list(static_assets.pages.items()) + list(static_assets.assets.items()):
+        for encoding, size in asset.sizes().items():
+            metrics.sample('static_asset_bytes', size, {'asset': name, 'encoding': encoding},
+                           help_text='Built static asset size by encoding')
+    for phase, value in startup.phases.items():
+        metrics.sample('startup_phase_ms', value, {'phase': phase}, help_text='Startup phase duration, ms')
+    metrics.histogram('admission_queue_wait_ms', admission.queue_wait, help_text='Time spent in the admission queue, ms')
+    metrics.sample('image_store_bytes', image_store.total_bytes(), help_text='Bytes held by the image store')
+    return metrics.render()
+
+async def handle_metrics(request):
+    return web.Response(text=collect_metrics(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-store'})
+
+async def handle_profile(request):
+    # Профилировщик включается только явно: стеки раскрывают внутренности процесса
+    if os.environ.get('DEBUG_PROFILER') != '1':
+        raise web.HTTPNotFound()
+    try:
+        seconds = float(request.query.get('seconds', 10))
+    except ValueError:
+        raise web.HTTPBadRequest(text='seconds must be a number')
+    try:
+        # Семплирование идет в отдельном потоке, event loop продолжает обслуживать запросы
+        stacks = await asyncio.to_thread(profiler.sample, max(0.1, seconds))
+    except ProfilerBusy as e:
+        raise web.HTTPConflict(text=str(e))
+    return web.Response(text=stacks, content_type='text/plain', charset='utf-8')
+
+async def handle_commissions(request):
+    # Админ-маршрут существует, только если задан ADMIN_TOKEN; запрос подписывается заголовком Bearer
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token:
+        raise web.HTTPNotFound()
+    if not secrets.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        raise web.HTTPForbidden()
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text='Body must be JSON')
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(text='Body must be a JSON object')
+    try:
+        # Комиссии сохраняются в базе: остальные воркеры и перезапуск увидят те же цены
+        commissions = await webapp_api.update_commissions(data.get('market_commission'), data.get('my_commission'))
+    except ValueError as e:
+        return web.json_response({'success': False, 'error': str(e)}, status=400)
+    return web.json_response({'success': True, 'data': commissions}, headers={'Cache-Control': 'no-store'})
+
+def cached_json_response(request, entry, headers):
+    # Сильный ETag по телу и сжатию: повторный GET с If-None-Match получает 304 без тела
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    etag = entry.etag_for(entry.choose_encoding(accept_encoding))
+    headers['ETag'] = etag
+    headers['Cache-Control'] = 'no-cache'
+    headers['Vary'] = 'Accept-Encoding'
+    if request.method == 'GET' and response_cache.is_not_modified(etag, request.headers.get('If-None-Match')):
+        return web.Response(status=304, headers=headers)
+    
+    body, encoding = entry.encoded(accept_encoding)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return web.Response(body=body, content_type='application/json', headers=headers)
 
 async def handle_api(request):
     try:
@@ -38,39 +242,34 @@ async def handle_api(request):
                 data = await request.json()
             except:
                 data = {}
+            if not isinstance(data, dict):
+                data = {}
         else:
             data = dict(request.query)
         
-        path = request.path
-        
-        # Route requests
-        if '/register_activity' in path:
-            result = await register_activity_endpoint(data)
-        elif '/get_statistics' in path:
-            result = await get_statistics_endpoint()
-        elif '/get_top_buyers' in path:
-            result = await get_top_buyers_endpoint()
-        elif '/get_popular_gifts' in path:
-            result = await get_popular_gifts_endpoint()
-        elif '/search_gifts' in path:
-            result = await search_gifts_endpoint(data)
-        elif '/get_all_gifts' in path:
-            result = await get_all_gifts_endpoint()
-        elif '/check_payment' in path:
-            result = await check_payment_endpoint(data)
-        elif '/purchase_gift' in path:
-            result = await purchase_gift_endpoint(data)
-        elif '/generate_payment' in path:
-            result = await generate_payment_endpoint(data)
-        elif '/update_purchase_status' in path:
-            result = await update_purchase_status_endpoint(data)
-        elif '/get_button_status' in path:
-            result = await get_button_status_endpoint(data)
-        elif '/set_button_status' in path:
-            result = await set_button_status_endpoint(data)
-        else:
+        endpoint = api_router.get(request.match_info['endpoint'])
+        if endpoint is None:
             result = {'success': False, 'error': 'Endpoint not found'}
+        elif request.method not in endpoint.methods:
+            headers['Allow'] = ', '.join(sorted(endpoint.methods))
+            return web.json_response({'success': False, 'error': 'Method not allowed'}, status=405, headers=headers)
+        else:
+            try:
+                async with admission.admit(endpoint.admission_class, client_identity(request),
+                                           user_identity(endpoint.params, data)):
+                    if endpoint.cache_version is not None:
+                        result = await api_router.dispatch_cached(endpoint, data, response_cache)
+                    else:
+                        result = await api_router.dispatch(endpoint, data)
+            except ApiError as e:
+                result = {'success': False, 'error': str(e)}
+            except Rejected as e:
+                # Отказ до обработки: клиент повторит позже, не нагружая процесс и писателя SQLite
+                headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+                return web.json_response({'success': False, 'error': str(e)}, status=e.status, headers=headers)
         
+        if isinstance(result, CachedResponse):
+            return cached_json_response(request, result, headers)
         return web.json_response(result, headers=headers)
         
     except Exception as e:
@@ -78,10 +277,26 @@ async def handle_api(request):
         return web.json_response({'success': False, 'error': str(e)}, headers=headers)
 
 async def generate_payment_endpoint(data):
+    # Сумма и название берутся из каталога: присланная клиентом сумма не учитывается
+    if not data.get('user_id'):
+        raise ApiError('User ID required')
+    gift = await webapp_api.get_gift(data.get('gift_id'))
+    if gift is None:
+        raise ApiError('Unknown gift')
+    amount = gift['total_price']
+    payment = await payment_watcher.create(
+        amount,
+        user_id=data.get('user_id'),
+        username=data.get('username'),
+        gift_id=gift['id'],
+        gift_name=gift['name']
+    )
     return {
         'success': True, 
-        'wallet_address': 'UQAaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
-        'amount': data.get('amount', 0)
+        'wallet_address': payment_watcher.wallet_address,
+        'amount': amount,
+        'payment_id': payment.payment_id,
+        'comment': payment.comment
     }
 
 async def update_purchase_status_endpoint(data):
@@ -94,14 +309,143 @@ async def get_button_status_endpoint(data):
 async def set_button_status_endpoint(data):
     return {'success': True}
 
+async def get_endpoint_stats_endpoint():
+    return {'success': True, 'data': api_router.get_stats()}
+
+async def get_feed_stats_endpoint():
+    return {'success': True, 'data': stats_feed.get_stats()}
+
+async def get_admission_stats_endpoint():
+    return {'success': True, 'data': admission.get_stats()}
+
+async def get_startup_stats_endpoint():
+    return {'success': True, 'data': startup.get_stats()}
+
+async def get_static_stats_endpoint():
+    return {'success': True, 'data': static_assets.get_stats()}
+
+# Таблица API: имя -> обработчик, допустимые методы, схема параметров, тип ответа
+api_router = ApiRouter()
+api_router.register('register_activity', register_activity_endpoint, methods=('POST',),
+                    params={'user_id': str, 'username': str}, admission_class='write')
+# register_purchase намеренно не публикуется: покупки приходят только через purchase_gift после оплаты
+api_router.register('get_statistics', get_statistics_endpoint, cache_version=statistics_version)
+api_router.register('get_top_buyers', get_top_buyers_endpoint, params={'limit': int, 'period': str},
+                    cache_version=leaderboard_version)
+api_router.register('get_popular_gifts', get_popular_gifts_endpoint, params={'limit': int, 'period': str},
+                    cache_version=leaderboard_version)
+api_router.register('search_gifts', search_gifts_endpoint,
+                    params={'search_term': str, 'min_price': float, 'max_price': float,
+                            'sort_by': str, 'cursor': str, 'limit': int})
+api_router.register('get_all_gifts', get_all_gifts_endpoint, cache_version=catalog_version)
+api_router.register('check_payment', check_payment_endpoint, params={'payment_id': str}, admission_class='payment')
+api_router.register('purchase_gift', purchase_gift_endpoint, methods=('POST',), params={'payment_id': str},
+                    admission_class='payment')
+api_router.register('generate_payment', generate_payment_endpoint, methods=('POST',),
+                    params={'user_id': str, 'username': str, 'gift_id': str},
+                    admission_class='payment')
+api_router.register('update_purchase_status', update_purchase_status_endpoint, methods=('POST',), params={},
+                    admission_class='write')
+api_router.register('get_button_status', get_button_status_endpoint, params={'button_id': str})
+api_router.register('set_button_status', set_button_status_endpoint, methods=('POST',), params={},
+                    admission_class='write')
+api_router.register('get_db_metrics', get_db_metrics_endpoint, methods=('GET',))
+api_router.register('get_cache_stats', get_cache_stats_endpoint, methods=('GET',))
+api_router.register('get_response_cache_stats', get_response_cache_stats_endpoint, methods=('GET',))
+api_router.register('get_payment_stats', get_payment_stats_endpoint, methods=('GET',))
+api_router.register('get_endpoint_stats', get_endpoint_stats_endpoint, methods=('GET',))
+api_router.register('get_feed_stats', get_feed_stats_endpoint, methods=('GET',))
+api_router.register('get_admission_stats', get_admission_stats_endpoint, methods=('GET',))
+api_router.register('get_startup_stats', get_startup_stats_endpoint, methods=('GET',))
+api_router.register('get_static_stats', get_static_stats_endpoint, methods=('GET',))
+
+def start_services():
+    # Фоновая запись heartbeat-активности
+    activity_buffer.start()
+    # Фоновая сверка платежей с блокчейном
+    payment_watcher.start()
+    # Push-рассылка изменений статистики
+    stats_feed.start()
+    # Под супервизором: подхватываем записи других воркеров, в том числе новые комиссии
+    if int(os.environ.get('WEB_WORKERS', 1)) > 1:
+        change_watcher.on_change(webapp_api.sync_commissions)
+        change_watcher.start()
+
+async def warm_up():
+    # Открытие пула, миграции и загрузка рейтингов идут в отдельном потоке, event loop уже принимает соединения
+    try:
+        if not stats_db.ready:
+            with startup.phase('database'):
+                await asyncio.to_thread(stats_db.init_database)
+    except Exception as e:
+        print(f"Database startup error: {e}")
+        startup.mark_ready(error=e)
+        return
+    start_services()
+    startup.mark_ready()
+    
+    # Каталог собирается заранее: первый запрос к нему не ждет загрузку
+    with startup.phase('catalog'):
+        try:
+            # Комиссии, заданные через /admin/commissions, важнее значений из env
+            await webapp_api.sync_commissions()
+            await webapp_api.get_catalog()
+        except Exception as e:
+            print(f"Catalog warm-up error: {e}")
+
+async def on_startup(app):
+    # Замер задержки event loop для /metrics
+    loop_monitor.start()
+    # HTML-оболочки и ассеты собираются и сжимаются один раз, до открытия порта
+    with startup.phase('static assets'):
+        try:
+            await asyncio.to_thread(static_assets.build)
+        except (OSError, ValueError) as e:
+            print(f"Static assets build error: {e}")
+    # Порт открывается сразу: /api, /stream и /admin ждут готовности базы в startup.middleware
+    app['warm_up'] = asyncio.get_running_loop().create_task(warm_up())
+    if os.environ.get('STARTUP_MODE') == 'eager':
+        await startup.ready.wait()
+
+async def on_shutdown(app):
+    warm_up_task = app.get('warm_up')
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+        try:
+            await warm_up_task
+        except asyncio.CancelledError:
+            pass
+    # Закрываем SSE-потоки, иначе остановка ждет отключения клиентов
+    await stats_feed.stop()
+    await change_watcher.stop()
+    await loop_monitor.stop()
+    # Сбрасываем буфер активности, чтобы не потерять heartbeat
+    await activity_buffer.stop()
+    await purchase_recorder.flush()
+    await payment_watcher.stop()
+
+async def on_cleanup(app):
+    # Закрываем пул соединений SQLite
+    stats_db.close()
+
 def init_app():
-    app = web.Application()
+    app = web.Application(middlewares=[http_metrics.middleware, not_found_middleware, startup.middleware])
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
     
     # Routes
     app.router.add_get('/', handle_index)
     app.router.add_get('/index.html', handle_index)
-    app.router.add_post('/api/{endpoint:.*}', handle_api)
-    app.router.add_get('/api/{endpoint:.*}', handle_api)
+    app.router.add_get('/img/{digest:[0-9a-f]+}.svg', handle_image)
+    app.router.add_get('/static/{name}', handle_static)
+    app.router.add_get('/stream/statistics', handle_stats_stream)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/debug/profile', handle_profile)
+    app.router.add_post('/admin/commissions', handle_commissions)
+    app.router.add_post('/api/{endpoint}', handle_api)
+    app.router.add_get('/api/{endpoint}', handle_api)
+    app.router.add_route('OPTIONS', '/api/{endpoint}', handle_api)
     
     return app
 
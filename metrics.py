@@ -0,0 +1,86 @@
+# metrics.py
+import threading
+from bisect import bisect_left
+
+# Границы корзин гистограммы задержек, мс
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Запросы SQLite и задержка event loop обычно укладываются в доли миллисекунды
+FINE_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (кумулятивная выдача в стиле Prometheus)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.sum = self.sum
+        return histogram
+
+    def cumulative(self):
+        """[(граница, накопленное количество)], последняя граница — +Inf"""
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        for bound, running in self.cumulative():
+            if running >= target:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_ms': round(self.sum, 3),
+            'avg_ms': round(self.sum / self.count, 3) if self.count else 0.0,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): running
+                        for bound, running in self.cumulative()},
+        }
+
+
+class TimingRegistry:
+    """Гистограммы длительности по именам; можно наполнять из потоков пула"""
+
+    def __init__(self, buckets=FINE_BUCKETS_MS):
+        self.buckets = buckets
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def items(self):
+        """Согласованные копии [(имя, гистограмма)]"""
+        with self._lock:
+            return [(name, histogram.copy()) for name, histogram in sorted(self.histograms.items())]
+
+    def snapshot(self):
+        return {name: histogram.snapshot() for name, histogram in self.items()}
@@ -0,0 +1,407 @@
+# payments.py
+import asyncio
+import json
+from abc import ABC, abstractmethod
+import os
+import secrets
+import time
+
+from database import StatisticsDB, stats_db
+
+# Сколько ждем оплату и сколько держим завершенные платежи в таблице (секунды)
+PAYMENT_TTL = 30 * 60
+FINISHED_RETENTION = 60 * 60
+
+NANOTONS = 10 ** 9
+
+
+class Transfer:
+    """Входящий перевод на кошелек магазина"""
+    __slots__ = ('comment', 'amount', 'tx_hash', 'lt')
+
+    def __init__(self, comment, amount, tx_hash, lt):
+        self.comment = comment
+        self.amount = amount
+        self.tx_hash = tx_hash
+        self.lt = lt
+
+
+class ChainSource(ABC):
+    """Источник входящих переводов; один вызов покрывает все ожидающие платежи"""
+
+    wallet_address = None
+
+    @abstractmethod
+    async def fetch_incoming(self, since_lt=0):
+        """Переводы с logical time больше since_lt"""
+
+    async def close(self):
+        pass
+
+
+class FakeChainSource(ChainSource):
+    """Локальный источник для разработки, тестов и нагрузочных прогонов"""
+
+    def __init__(self, wallet_address='UQAaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa', latency=0.0):
+        self.wallet_address = wallet_address
+        self.latency = latency
+        self.transfers = []
+        self.calls = 0
+
+    def add_transfer(self, comment, amount):
+        lt = len(self.transfers) + 1
+        self.transfers.append(Transfer(comment, amount, f'fake-{lt}', lt))
+        return lt
+
+    async def fetch_incoming(self, since_lt=0):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [t for t in self.transfers if t.lt > since_lt]
+
+
+class TonCenterSource(ChainSource):
+    """Переводы на кошелек через TON Center HTTP API"""
+
+    def __init__(self, wallet_address, api_url='https://toncenter.com/api/v2', api_key=None, limit=100,
+                 max_pages=50):
+        self.wallet_address = wallet_address
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key
+        self.limit = limit
+        # Предел страниц за один опрос: при since_lt=0 (первый опрос) не листаем всю историю кошелька
+        self.max_pages = max_pages
+        self._session = None
+
+    async def _get_transactions(self, params):
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        headers = {'X-API-Key': self.api_key} if self.api_key else {}
+        async with self._session.get(f'{self.api_url}/getTransactions', params=params, headers=headers) as response:
+            payload = await response.json()
+        if not payload.get('ok'):
+            raise RuntimeError(f"TON Center error: {payload.get('error')}")
+        return payload.get('result', [])
+
+    async def fetch_incoming(self, since_lt=0):
+        """Листает транзакции от новых к старым по (lt, hash), пока не дойдет до since_lt"""
+        params = {'address': self.wallet_address, 'limit': self.limit, 'archival': 'false'}
+        transfers = []
+        cursor = None
+        for _ in range(self.max_pages):
+            page = await self._get_transactions(params)
+            reached = False
+            for tx in page:
+                lt = int(tx['transaction_id']['lt'])
+                tx_hash = tx['transaction_id']['hash']
+                # Страница с курсором начинается с той же транзакции, на которой закончилась предыдущая
+                if (lt, tx_hash) == cursor:
+                    continue
+                if lt <= since_lt:
+                    reached = True
+                    break
+                cursor = (lt, tx_hash)
+                in_msg = tx.get('in_msg') or {}
+                if not in_msg.get('source'):
+                    continue
+                transfers.append(Transfer(
+                    in_msg.get('message') or '',
+                    int(in_msg.get('value') or 0) / NANOTONS,
+                    tx_hash,
+                    lt
+                ))
+            if reached or len(page) < self.limit or cursor is None:
+                break
+            params['lt'], params['hash'] = cursor
+        else:
+            if since_lt:
+                print(f"TON Center: more than {self.max_pages} pages since lt {since_lt}, older transfers skipped")
+        return transfers
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class PendingPayment:
+    __slots__ = ('payment_id', 'comment', 'amount', 'details', 'status', 'created_at',
+                 'paid_at', 'paid_amount', 'tx_hash')
+
+    def __init__(self, payment_id, comment, amount, details):
+        self.payment_id = payment_id
+        self.comment = comment
+        self.amount = amount
+        self.details = details
+        self.status = 'pending'
+        self.created_at = time.time()
+        self.paid_at = None
+        self.paid_amount = None
+        self.tx_hash = None
+
+
+class PaymentWatcher:
+    """Фоновая сверка ожидающих платежей с блокчейном; check() отвечает из памяти"""
+
+    def __init__(self, source, poll_interval=5.0, payment_ttl=PAYMENT_TTL, store=None):
+        self.source = source
+        self.poll_interval = poll_interval
+        self.payment_ttl = payment_ttl
+        # Общая база (StatisticsDB): платежи видны всем воркерам; None — только память процесса
+        self.store = store
+
+        # payment_id -> PendingPayment и комментарий -> payment_id
+        self.payments = {}
+        self._by_comment = {}
+        self._since_lt = 0
+        self._task = None
+        # Платежи, чей исход еще не записан в store
+        self._unsaved = []
+
+        self.stats = {
+            'registered': 0,
+            'polls': 0,
+            'poll_errors': 0,
+            'transfers_seen': 0,
+            'matched': 0,
+            'underpaid': 0,
+            'expired': 0,
+            'adopted': 0,
+            'released': 0,
+            'store_errors': 0,
+            'last_poll_ms': 0.0,
+        }
+
+    @property
+    def wallet_address(self):
+        return self.source.wallet_address
+
+    def register(self, amount, **details):
+        """Заводит ожидающий платеж; клиент переводит amount с комментарием comment"""
+        # С nan любой перевод с комментарием считался бы полной оплатой, с нулем — бесплатной
+        amount = StatisticsDB.check_amount(amount)
+        payment_id = secrets.token_hex(8)
+        comment = f'gp-{payment_id}'
+        payment = PendingPayment(payment_id, comment, amount, details)
+        self.payments[payment_id] = payment
+        self._by_comment[comment] = payment_id
+        self.stats['registered'] += 1
+        return payment
+
+    @staticmethod
+    def _to_row(payment):
+        return (payment.payment_id, payment.comment, payment.amount,
+                json.dumps(payment.details, ensure_ascii=False), payment.status, int(payment.created_at),
+                payment.paid_at, payment.paid_amount, payment.tx_hash)
+
+    @staticmethod
+    def _from_row(row):
+        payment_id, comment, amount, details, status, created_at, paid_at, paid_amount, tx_hash = row
+        payment = PendingPayment(payment_id, comment, amount, json.loads(details or '{}'))
+        payment.status = status
+        payment.created_at = created_at
+        payment.paid_at = paid_at
+        payment.paid_amount = paid_amount
+        payment.tx_hash = tx_hash
+        return payment
+
+    async def create(self, amount, **details):
+        """register() с записью в общую базу: проверить платеж можно в любом воркере"""
+        payment = self.register(amount, **details)
+        if self.store is not None:
+            await self.store.run(self.store.save_payment, self._to_row(payment))
+        return payment
+
+    async def lookup(self, payment_id):
+        """Статус платежа из памяти, а для платежей других воркеров — из общей базы"""
+        payment = self.check(payment_id)
+        if payment is not None or self.store is None:
+            return payment
+        row = await self.store.run(self.store.get_payment, payment_id)
+        if row is None:
+            return None
+        payment = self._from_row(row)
+        if payment.status == 'pending' and time.time() - payment.created_at > self.payment_ttl:
+            payment.status = 'expired'
+        return payment
+
+    async def claim(self, payment_id):
+        """consume() для нескольких воркеров: подарок по платежу выдается ровно один раз"""
+        if self.store is None:
+            return self.consume(payment_id)
+        payment = await self.lookup(payment_id)
+        if payment is None or payment.status != 'paid':
+            return None
+        # Исход опроса мог еще не дойти до базы
+        await self._save_outcomes()
+        if not await self.store.run(self.store.consume_payment, payment_id):
+            return None
+        payment.status = 'consumed'
+        return payment
+
+    async def release(self, payment):
+        """Отменяет claim(): запись покупки не удалась, платеж снова можно забрать"""
+        payment.status = 'paid'
+        if self.store is not None:
+            await self.store.run(self.store.release_payment, payment.payment_id)
+        self.stats['released'] += 1
+
+    def _mark_unsaved(self, payment):
+        if self.store is not None:
+            self._unsaved.append(payment)
+
+    async def _save_outcomes(self):
+        if self.store is None or not self._unsaved:
+            return
+        batch, self._unsaved = self._unsaved, []
+        rows = [(p.status, int(p.paid_at) if p.paid_at else None, p.paid_amount, p.tx_hash, p.payment_id)
+                for p in batch]
+        try:
+            await self.store.run(self.store.update_payments, rows)
+        except Exception as e:
+            print(f"Payment store error: {e}")
+            self.stats['store_errors'] += 1
+            self._unsaved = batch + self._unsaved
+
+    async def adopt_pending(self):
+        """Берет под наблюдение ожидающие платежи из базы, в том числе оставшиеся от остановленных воркеров"""
+        if self.store is None:
+            return 0
+        rows = await self.store.run(self.store.load_pending_payments, time.time() - self.payment_ttl)
+        adopted = 0
+        for row in rows:
+            if row[0] in self.payments:
+                continue
+            payment = self._from_row(row)
+            self.payments[payment.payment_id] = payment
+            self._by_comment[payment.comment] = payment.payment_id
+            adopted += 1
+        self.stats['adopted'] += adopted
+        return adopted
+
+    def check(self, payment_id):
+        """Текущий статус платежа без обращения к блокчейну"""
+        payment = self.payments.get(payment_id)
+        if payment is None:
+            return None
+        if payment.status == 'pending' and time.time() - payment.created_at > self.payment_ttl:
+            self._expire(payment)
+        return payment
+
+    def consume(self, payment_id):
+        """Помечает оплаченный платеж использованным, чтобы не выдать подарок дважды"""
+        payment = self.check(payment_id)
+        if payment is None or payment.status != 'paid':
+            return None
+        payment.status = 'consumed'
+        return payment
+
+    def pending_count(self):
+        return sum(1 for payment in self.payments.values() if payment.status == 'pending')
+
+    def _expire(self, payment):
+        payment.status = 'expired'
+        self._by_comment.pop(payment.comment, None)
+        self._mark_unsaved(payment)
+        self.stats['expired'] += 1
+
+    def apply_transfers(self, transfers):
+        for transfer in transfers:
+            self.stats['transfers_seen'] += 1
+            if transfer.lt > self._since_lt:
+                self._since_lt = transfer.lt
+            payment_id = self._by_comment.get(transfer.comment.strip())
+            if payment_id is None:
+                continue
+            payment = self.payments[payment_id]
+            if payment.status != 'pending':
+                continue
+            # Допуск на округление при переводе в нанотоны
+            if transfer.amount + 1e-9 < payment.amount:
+                self.stats['underpaid'] += 1
+                continue
+            payment.status = 'paid'
+            payment.paid_at = time.time()
+            payment.paid_amount = transfer.amount
+            payment.tx_hash = transfer.tx_hash
+            self._by_comment.pop(payment.comment, None)
+            self._mark_unsaved(payment)
+            self.stats['matched'] += 1
+
+    def _evict(self):
+        now = time.time()
+        for payment_id, payment in list(self.payments.items()):
+            if payment.status == 'pending' and now - payment.created_at > self.payment_ttl:
+                self._expire(payment)
+            elif payment.status != 'pending' and now - payment.created_at > self.payment_ttl + FINISHED_RETENTION:
+                del self.payments[payment_id]
+
+    async def poll_once(self):
+        """Один запрос к источнику на все ожидающие платежи"""
+        self._evict()
+        if not self._by_comment:
+            await self._save_outcomes()
+            return 0
+        started = time.perf_counter()
+        try:
+            transfers = await self.source.fetch_incoming(self._since_lt)
+        except Exception as e:
+            self.stats['poll_errors'] += 1
+            print(f"Payment poll error: {e}")
+            return 0
+        self.stats['polls'] += 1
+        self.stats['last_poll_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self.apply_transfers(transfers)
+        await self._save_outcomes()
+        return len(transfers)
+
+    async def _poll_loop(self):
+        try:
+            await self.adopt_pending()
+        except Exception as e:
+            print(f"Payment adopt error: {e}")
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll_once()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._save_outcomes()
+        await self.source.close()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = self.pending_count()
+        stats['tracked'] = len(self.payments)
+        return stats
+
+
+def create_chain_source():
+    """TON Center при заданном TON_WALLET_ADDRESS, иначе локальный фейковый источник"""
+    wallet = os.environ.get('TON_WALLET_ADDRESS')
+    if wallet:
+        return TonCenterSource(
+            wallet,
+            api_url=os.environ.get('TON_API_URL', 'https://toncenter.com/api/v2'),
+            api_key=os.environ.get('TON_API_KEY')
+        )
+    return FakeChainSource()
+
+
+payment_watcher = PaymentWatcher(
+    create_chain_source(),
+    poll_interval=float(os.environ.get('PAYMENT_POLL_INTERVAL', 5.0)),
+    store=stats_db,
+)
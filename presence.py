@@ -0,0 +1,75 @@
+# presence.py
+import threading
+import time
+
+
+class PresenceTracker:
+    """Учет онлайна в памяти: колесо посекундных корзин с амортизированным истечением"""
+
+    def __init__(self, window=300):
+        self.window = int(window)
+        self._lock = threading.Lock()
+        # user_id -> секунда последней активности
+        self._last_seen = {}
+        # секунда -> множество user_id, последний раз активных в эту секунду
+        self._buckets = {}
+        self._oldest = int(time.time()) - self.window
+        # Пользователи, изменившиеся с последнего снимка
+        self._dirty = set()
+
+    def _expire(self, now):
+        cutoff = int(now) - self.window
+        steps = cutoff - self._oldest
+        if steps <= 0:
+            return
+        # После долгого простоя дешевле пройти по существующим корзинам, чем по секундам
+        if steps > len(self._buckets):
+            stale = [key for key in self._buckets if key < cutoff]
+        else:
+            stale = range(self._oldest, cutoff)
+        for key in stale:
+            users = self._buckets.pop(key, None)
+            if users:
+                for user_id in users:
+                    del self._last_seen[user_id]
+                    self._dirty.discard(user_id)
+        self._oldest = cutoff
+
+    def touch(self, user_id, seen_at=None, now=None):
+        """Отмечает активность пользователя за O(1)"""
+        now = time.time() if now is None else now
+        second = int(now if seen_at is None else seen_at)
+        with self._lock:
+            self._expire(now)
+            if second < self._oldest:
+                return
+            previous = self._last_seen.get(user_id)
+            if previous is not None:
+                if previous >= second:
+                    return
+                bucket = self._buckets[previous]
+                bucket.discard(user_id)
+                if not bucket:
+                    del self._buckets[previous]
+            self._last_seen[user_id] = second
+            self._buckets.setdefault(second, set()).add(user_id)
+            if seen_at is None:
+                self._dirty.add(user_id)
+
+    def count(self, now=None):
+        """Количество пользователей, активных в пределах окна"""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return len(self._last_seen)
+
+    def is_online(self, user_id, now=None):
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+            return user_id in self._last_seen
+
+    def drain_dirty(self):
+        """Забирает изменения с последнего снимка: [(user_id, epoch)]"""
+        with self._lock:
+            entries = [(user_id, self._last_seen[user_id]) for user_id in self._dirty]
+            self._dirty = set()
+        return entries
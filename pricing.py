@@ -0,0 +1,109 @@
+# pricing.py
+import hashlib
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Границы редкости по базовой цене: цена выше границы переводит подарок в следующий класс
+RARITY_THRESHOLDS = (35, 60, 100)
+RARITY_NAMES = ('common', 'rare', 'epic', 'legendary')
+
+
+def stable_hash(text):
+    """Хэш строки, одинаковый во всех процессах (в отличие от hash())"""
+    return int(hashlib.md5(text.encode()).hexdigest(), 16)
+
+
+def _column(typecode, values):
+    if numpy is not None:
+        return numpy.asarray(values, dtype={'d': numpy.float64, 'q': numpy.int64}[typecode])
+    return array(typecode, values)
+
+
+def _scaled(column, factor):
+    if numpy is not None:
+        return column * factor
+    return array('d', (value * factor for value in column))
+
+
+def _sum3(a, b, c):
+    # Порядок сложения как в поштучном расчете: base + market_fee + my_fee
+    if numpy is not None:
+        return a + b + c
+    return array('d', (x + y + z for x, y, z in zip(a, b, c)))
+
+
+def _rarity_codes(prices):
+    # bisect_left по границам: цена, равная границе, остается в младшем классе (как 'price > 35')
+    if numpy is not None:
+        return numpy.searchsorted(numpy.asarray(RARITY_THRESHOLDS, dtype=numpy.float64), prices,
+                                  side='left').astype(numpy.int8)
+    return array('b', (bisect_left(RARITY_THRESHOLDS, price) for price in prices))
+
+
+class PricedCatalog:
+    """Каталог по столбцам: базовые цены, комиссии, итог и коды редкости считаются целыми массивами"""
+
+    def __init__(self, ids, names, base_prices, sales_counts, image_urls, markets,
+                 market_commission, my_commission):
+        self.ids = ids
+        self.names = names
+        self.base_price = _column('d', base_prices)
+        self.sales_count = _column('q', sales_counts)
+        self.image_urls = image_urls
+        self.markets = markets
+        # Редкость зависит только от базовой цены и не пересчитывается при смене комиссий
+        self.rarity = _rarity_codes(self.base_price)
+        self.set_commissions(market_commission, my_commission)
+
+    @classmethod
+    def from_listings(cls, listings, market_commission, my_commission, placeholder):
+        """Столбцы из листингов {'name', 'base_price', ['id', 'sales_count', 'image_url', 'market']}"""
+        ids, names, base_prices, sales_counts, image_urls, markets = [], [], [], [], [], []
+        for listing in listings:
+            name = listing['name']
+            digest = stable_hash(name)
+            names.append(name)
+            ids.append(str(listing.get('id') or f'real_{digest & 0xFFFFFFFFFFFF:012x}'))
+            base_prices.append(float(listing['base_price']))
+            sales_counts.append(listing.get('sales_count') or digest % 50 + 1)
+            image_urls.append(listing.get('image_url') or placeholder(digest))
+            markets.append(listing.get('market', 'Portals'))
+        return cls(ids, names, base_prices, sales_counts, image_urls, markets, market_commission, my_commission)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_commissions(self, market_commission, my_commission):
+        """Пересчитывает только столбцы комиссий и итоговой цены"""
+        self.market_commission = market_commission
+        self.my_commission = my_commission
+        self.market_fee = _scaled(self.base_price, market_commission)
+        self.my_fee = _scaled(self.base_price, my_commission)
+        self.total_price = _sum3(self.base_price, self.market_fee, self.my_fee)
+
+    def rounded_totals(self):
+        """Итоговые цены, округленные так же, как в выдаче"""
+        return [round(price, 2) for price in self.total_price.tolist()]
+
+    def gift(self, row):
+        """Словарь подарка для ответа API"""
+        name = self.names[row]
+        return {
+            'id': self.ids[row],
+            'name': name,
+            'base_price': float(self.base_price[row]),
+            'market_fee': round(float(self.market_fee[row]), 2),
+            'my_fee': round(float(self.my_fee[row]), 2),
+            'total_price': round(float(self.total_price[row]), 2),
+            'image_url': self.image_urls[row],
+            'market': self.markets[row],
+            'attributes': {'model': name},
+            'is_transferable': True,
+            'rarity': RARITY_NAMES[int(self.rarity[row])],
+            'sales_count': int(self.sales_count[row])
+        }
@@ -0,0 +1,56 @@
+# profiler.py
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Предел длительности одного профиля (секунды)
+MAX_PROFILE_SECONDS = 60
+
+
+class ProfilerBusy(Exception):
+    """Профилировщик уже запущен другим запросом"""
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик: стеки всех потоков через sys._current_frames в collapsed-формате"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def sample(self, seconds):
+        """Снимает стеки seconds секунд и возвращает строки 'поток;f1;f2 количество' (для flamegraph.pl/speedscope)"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('Profiler is already running')
+        try:
+            own = threading.get_ident()
+            names = {}
+            counts = Counter()
+            deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+            while time.monotonic() < deadline:
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own:
+                        continue
+                    stack = [names.get(thread_id, str(thread_id))] + self._stack(frame)
+                    counts[';'.join(stack)] += 1
+                time.sleep(self.interval)
+        finally:
+            self._lock.release()
+        return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+profiler = SamplingProfiler(interval=float(os.environ.get('PROFILER_INTERVAL', 0.005)))
@@ -0,0 +1,90 @@
+# purchase_recorder.py
+import asyncio
+import os
+import time
+
+from database import stats_db
+
+
+class PurchaseRecorder:
+    """Групповая запись покупок: одновременные продажи попадают в одну транзакцию"""
+
+    def __init__(self, db, max_batch=200, max_delay=0.005):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._batch = []
+        self._timer = None
+
+        self.stats = {
+            'purchases': 0,
+            'commits': 0,
+            'errors': 0,
+            'last_commit_ms': 0.0,
+        }
+
+    async def record(self, user_id, username, gift_id, gift_name, amount):
+        """Ставит покупку в пачку и ждет фиксации транзакции"""
+        # Неверная сумма отклоняется сразу, а не роняет транзакцию всей пачки
+        amount = self.db.check_amount(amount)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append(((user_id, username, gift_id, gift_name, amount), future))
+
+        if len(self._batch) >= self.max_batch:
+            self._commit_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._commit_now)
+
+        return await future
+
+    def _commit_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        asyncio.get_running_loop().create_task(self._commit(batch))
+
+    async def _commit(self, batch):
+        started = time.perf_counter()
+        try:
+            await self.db.run(self.db.register_purchases_batch, [item for item, _ in batch])
+        except Exception as e:
+            print(f"Purchase batch error: {e}")
+            self.stats['errors'] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats['commits'] += 1
+        self.stats['purchases'] += len(batch)
+        self.stats['last_commit_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(True)
+
+    async def flush(self):
+        """Фиксирует текущую пачку, не дожидаясь таймера"""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self._commit(batch)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = len(self._batch)
+        return stats
+
+
+purchase_recorder = PurchaseRecorder(
+    stats_db,
+    max_batch=int(os.environ.get('PURCHASE_BATCH_SIZE', 200)),
+    max_delay=float(os.environ.get('PURCHASE_BATCH_DELAY', 0.005)),
+)
@@ -0,0 +1,133 @@
+# response_cache.py
+import gzip
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Тела меньше этого размера не сжимаем: заголовки съедят выигрыш
+MIN_COMPRESS_SIZE = 1024
+
+
+def dumps(data):
+    """JSON в байтах: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class CachedResponse:
+    """Закодированный ответ: тело, сильные ETag по вариантам сжатия и лениво сжатые варианты"""
+    __slots__ = ('version', 'body', 'digest', '_encoded')
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        # ETag по содержимому: одинаков во всех воркерах и переживает рестарт
+        self.digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self._encoded = {}
+
+    @property
+    def etag(self):
+        """ETag несжатого тела"""
+        return self.etag_for(None)
+
+    def etag_for(self, encoding):
+        # Сжатые варианты — другие байты: сильный ETag у каждого свой, иначе кэш отдаст не то сжатие
+        if encoding is None:
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def choose_encoding(self, accept_encoding):
+        """Content-Encoding, который получит клиент с таким Accept-Encoding, или None"""
+        if len(self.body) < MIN_COMPRESS_SIZE:
+            return None
+        if brotli is not None and 'br' in accept_encoding:
+            return 'br'
+        if 'gzip' in accept_encoding:
+            return 'gzip'
+        return None
+
+    def encoded(self, accept_encoding):
+        """(тело, Content-Encoding или None) под заголовок Accept-Encoding клиента"""
+        encoding = self.choose_encoding(accept_encoding)
+        if encoding is None:
+            return self.body, None
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding == 'br':
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, compresslevel=6, mtime=0)
+            self._encoded[encoding] = body
+        return body, encoding
+
+
+class ResponseCache:
+    """LRU готовых ответов по (эндпоинт, нормализованный запрос); запись годна, пока совпадает версия данных"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'encodes': 0,
+            'evictions': 0,
+        }
+
+    def get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return entry
+
+    def put(self, key, version, data):
+        entry = CachedResponse(version, dumps(data))
+        self.stats['encodes'] += 1
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+        return entry
+
+    def is_not_modified(self, etag, if_none_match):
+        """Клиент уже держит этот вариант ответа (ETag с учетом сжатия): можно ответить 304 без тела"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*' or etag in if_none_match:
+            self.stats['not_modified'] += 1
+            return True
+        return False
+
+    def invalidate(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['entries'] = len(self._entries)
+        stats['bytes'] = sum(len(entry.body) for entry in self._entries.values())
+        stats['encoder'] = 'orjson' if orjson is not None else 'json'
+        stats['brotli'] = brotli is not None
+        return stats
+
+
+response_cache = ResponseCache(max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', 256)))
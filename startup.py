@@ -0,0 +1,100 @@
+# startup.py
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+IMPORTED_AT = time.time()
+
+# Импорт aiohttp — самая дорогая часть запуска: замеряем его отдельно
+_started = time.perf_counter()
+from aiohttp import web
+AIOHTTP_IMPORT_MS = round((time.perf_counter() - _started) * 1000, 1)
+
+# Пути, которым нужна открытая база: до ее готовности они ждут, остальное (index.html, картинки) отдается сразу
+GATED_PREFIXES = ('/api/', '/stream/', '/admin/')
+
+# Сколько запрос ждет готовности базы, прежде чем получить 503 (секунды)
+READY_TIMEOUT = 30.0
+
+
+def process_started_at():
+    """Время запуска процесса (unix epoch) из /proc; None, если /proc недоступен"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Имя процесса может содержать пробелы: поля считаем после закрывающей скобки
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        started_ticks = int(fields[19])
+        return time.time() - uptime + started_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupReport:
+    """Этапы запуска: импорты, открытие базы, прогрев каталога и время до первого обслуженного запроса"""
+
+    def __init__(self):
+        self.started_at = process_started_at() or IMPORTED_AT
+        # этап -> длительность, мс (в порядке выполнения)
+        self.phases = {
+            'interpreter': round((IMPORTED_AT - self.started_at) * 1000, 1),
+            'import aiohttp': AIOHTTP_IMPORT_MS,
+        }
+        self.first_request_ms = None
+        self.ready_ms = None
+        self.error = None
+        self.ready = asyncio.Event()
+
+    def _since_start(self):
+        return round((time.time() - self.started_at) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - started) * 1000, 1)
+
+    def mark_ready(self, error=None):
+        self.error = error
+        self.ready_ms = self._since_start()
+        self.ready.set()
+
+    async def wait_ready(self, timeout=READY_TIMEOUT):
+        if not self.ready.is_set():
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        if self.error is not None:
+            raise self.error
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        # После неудачного старта база так и не открыта: /api, /stream и /admin отвечают 503, а не ошибкой обработчика
+        if (not self.ready.is_set() or self.error is not None) and request.path.startswith(GATED_PREFIXES):
+            try:
+                await self.wait_ready()
+            except Exception:
+                raise web.HTTPServiceUnavailable(text='Service is starting', headers={'Retry-After': '1'})
+        response = await handler(request)
+        if self.first_request_ms is None:
+            self.first_request_ms = self._since_start()
+            print(f"Startup: {self.summary()}")
+        return response
+
+    def summary(self):
+        phases = ', '.join(f'{name} {value} ms' for name, value in self.phases.items())
+        return f"{phases}; ready after {self.ready_ms} ms, first request after {self.first_request_ms} ms"
+
+    def get_stats(self):
+        return {
+            'started_at': round(self.started_at, 3),
+            'phases_ms': dict(self.phases),
+            'ready_ms': self.ready_ms,
+            'first_request_ms': self.first_request_ms,
+            'error': str(self.error) if self.error is not None else None,
+        }
+
+
+startup = StartupReport()
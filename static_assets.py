@@ -0,0 +1,118 @@
+# static_assets.py
+import gzip
+import hashlib
+import os
+import re
+import time
+
+from response_cache import MIN_COMPRESS_SIZE, CachedResponse, brotli
+
+# Префикс маршрута, по которому main.init_app отдает собранные ассеты
+STATIC_ROUTE_PREFIX = '/static/'
+
+# Инлайн-блоки меньше этого размера остаются в HTML: отдельный запрос дороже самих байт
+INLINE_LIMIT = 1024
+
+# Только блоки без атрибутов: <script src=...> (Telegram WebApp SDK) не трогаем
+INLINE_BLOCK_RE = {tag: re.compile(rf'<{tag}>(.*?)</{tag}>', re.S) for tag in ('style', 'script')}
+HTML_COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.S)
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+
+
+def minify_css(css):
+    """Убирает комментарии и лишние пробелы; пробел перед ':' сохраняется (селекторы вида '.a :hover')"""
+    css = CSS_COMMENT_RE.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def strip_lines(text):
+    """Срезает отступы и пустые строки, не склеивая строки: безопасно для JS без точек с запятой и для HTML"""
+    lines = (line.strip() for line in text.replace('\r\n', '\n').split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def fingerprint(body):
+    return hashlib.blake2b(body, digest_size=5).hexdigest()
+
+
+class StaticAsset(CachedResponse):
+    """Собранный файл: тело, тип, ETag и заранее сжатые gzip/brotli варианты"""
+    __slots__ = ('content_type',)
+
+    def __init__(self, body, content_type):
+        super().__init__(None, body)
+        self.content_type = content_type
+        # Ассеты сжимаются один раз при сборке, поэтому с максимальной степенью
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self._encoded['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self._encoded['br'] = brotli.compress(body, quality=11)
+
+    def sizes(self):
+        sizes = {'raw': len(self.body)}
+        sizes.update({encoding: len(body) for encoding, body in self._encoded.items()})
+        return sizes
+
+
+class AssetPipeline:
+    """Сборка static/*.html при запуске: CSS/JS выносятся в файлы с хэшем в имени, HTML остается оболочкой"""
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        # имя страницы ('index', '404') -> StaticAsset с HTML
+        self.pages = {}
+        # имя файла с хэшем -> StaticAsset
+        self.assets = {}
+        self.stats = {}
+
+    def _extract(self, html, page, tag, extension, content_type, minify, make_tag):
+        def replace(match):
+            code = minify(match.group(1))
+            body = code.encode()
+            if len(body) < INLINE_LIMIT:
+                return f'<{tag}>{code}</{tag}>'
+            name = f'{page}.{fingerprint(body)}.{extension}'
+            self.assets[name] = StaticAsset(body, content_type)
+            return make_tag(STATIC_ROUTE_PREFIX + name)
+        return INLINE_BLOCK_RE[tag].sub(replace, html)
+
+    def build_page(self, page, filename):
+        with open(os.path.join(self.static_dir, filename), encoding='utf-8') as f:
+            source = f.read()
+
+        html = self._extract(source, page, 'style', 'css', 'text/css', minify_css,
+                             lambda url: f'<link rel="stylesheet" href="{url}">')
+        # Внешний скрипт стоит там же, где был инлайн: порядок выполнения не меняется
+        html = self._extract(html, page, 'script', 'js', 'application/javascript', strip_lines,
+                             lambda url: f'<script src="{url}"></script>')
+        html = strip_lines(HTML_COMMENT_RE.sub('', html))
+
+        shell = self.pages[page] = StaticAsset(html.encode(), 'text/html')
+        linked = [asset for name, asset in self.assets.items() if name.startswith(page + '.')]
+        self.stats[page] = {
+            'source_bytes': len(source.encode()),
+            'source_gzip_bytes': len(gzip.compress(source.encode(), compresslevel=6, mtime=0)),
+            'shell': shell.sizes(),
+            'assets': {name: self.assets[name].sizes() for name in self.assets if name.startswith(page + '.')},
+            'total_gzip_bytes': sum(asset.sizes().get('gzip', asset.sizes()['raw'])
+                                    for asset in [shell] + linked),
+        }
+
+    def build(self):
+        started = time.perf_counter()
+        self.pages = {}
+        self.assets = {}
+        self.stats = {}
+        for page, filename in (('index', 'index.html'), ('404', '404.html')):
+            self.build_page(page, filename)
+        self.stats['build_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return self
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+static_assets = AssetPipeline(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
@@ -0,0 +1,156 @@
+# stats_feed.py
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from database import stats_db
+from response_cache import dumps
+
+# Пауза между служебными комментариями, чтобы прокси не рвали тихий поток (секунды)
+KEEPALIVE_INTERVAL = 15.0
+
+
+def sse_event(event, data):
+    """Событие Server-Sent Events, закодированное один раз для всех подписчиков"""
+    return b'event: ' + event.encode() + b'\ndata: ' + dumps(data) + b'\n\n'
+
+
+class StatsFeed:
+    """Push-рассылка статистики: не чаще max_rate раз в секунду, один расчет на всех подписчиков"""
+
+    def __init__(self, db, max_rate=2.0, top_limit=10, queue_size=16):
+        self.db = db
+        self.interval = 1.0 / max_rate
+        self.top_limit = top_limit
+        self.queue_size = queue_size
+
+        self._subscribers = set()
+        self._snapshot = None
+        # (версия данных, онлайн), для которых посчитан снимок
+        self._snapshot_key = None
+        self._compute_lock = asyncio.Lock()
+        self._task = None
+
+        self.stats = {
+            'ticks': 0,
+            'computations': 0,
+            'broadcasts': 0,
+            'events_sent': 0,
+            'dropped_subscribers': 0,
+        }
+
+    def _current_key(self):
+        # Онлайн меняется и без записей в базу: пользователи выпадают из окна
+        return (self.db.data_version, self.db.presence.count())
+
+    async def _compute(self):
+        key = self._current_key()
+        statistics = await self.db.run(self.db.get_statistics)
+        top_buyers = await self.db.run(self.db.get_top_buyers, self.top_limit)
+        popular_gifts = await self.db.run(self.db.get_popular_gifts, self.top_limit)
+        self.stats['computations'] += 1
+        self._snapshot_key = key
+        return {'statistics': statistics, 'top_buyers': top_buyers, 'popular_gifts': popular_gifts}
+
+    async def get_snapshot(self):
+        """Последний разосланный снимок; изменения после него придут ближайшей дельтой"""
+        async with self._compute_lock:
+            if self._snapshot is None:
+                self._snapshot = await self._compute()
+            return self._snapshot
+
+    @staticmethod
+    def _delta(old, new):
+        delta = {}
+        changed = {key: value for key, value in new['statistics'].items()
+                   if old['statistics'].get(key) != value}
+        if changed:
+            delta['statistics'] = changed
+        for section in ('top_buyers', 'popular_gifts'):
+            if old[section] != new[section]:
+                delta[section] = new[section]
+        return delta
+
+    async def tick(self):
+        """Пересчитывает снимок при изменении данных и рассылает подписчикам только разницу"""
+        self.stats['ticks'] += 1
+        if not self._subscribers or self._snapshot_key == self._current_key():
+            return 0
+        async with self._compute_lock:
+            previous = self._snapshot
+            self._snapshot = await self._compute()
+        delta = self._delta(previous, self._snapshot)
+        if not delta:
+            return 0
+        return self._broadcast(sse_event('delta', delta))
+
+    def _broadcast(self, payload):
+        self.stats['broadcasts'] += 1
+        sent = 0
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(payload)
+                sent += 1
+            except asyncio.QueueFull:
+                # Медленный клиент: закрываем поток, после переподключения он получит свежий снимок
+                self._subscribers.discard(queue)
+                self.stats['dropped_subscribers'] += 1
+                self._close(queue)
+        self.stats['events_sent'] += sent
+        return sent
+
+    @staticmethod
+    def _close(queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """Очередь готовых SSE-событий, первым идет полный снимок; None означает конец потока"""
+        snapshot = await self.get_snapshot()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        # Между снимком и подпиской нет await: ни одна дельта не потеряется
+        queue.put_nowait(sse_event('snapshot', snapshot))
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Stats feed error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """Останавливает рассылку и закрывает потоки подписчиков"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in list(self._subscribers):
+            self._subscribers.discard(queue)
+            self._close(queue)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['subscribers'] = len(self._subscribers)
+        return stats
+
+
+stats_feed = StatsFeed(
+    stats_db,
+    max_rate=float(os.environ.get('STATS_FEED_RATE', 2.0)),
+    top_limit=int(os.environ.get('STATS_FEED_TOP_LIMIT', 10)),
+)
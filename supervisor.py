@@ -0,0 +1,182 @@
+# supervisor.py
+"""Pre-fork супервизор: несколько воркеров aiohttp на одном порту.
+
+Запуск: python supervisor.py [--workers 4] [--port 8080]
+
+Воркеры форкаются до импорта приложения, поэтому у каждого свои соединения
+SQLite, пул потоков и event loop. Порт делится через SO_REUSEPORT (ядро
+распределяет соединения между сокетами воркеров), а где его нет — через общий
+слушающий сокет, унаследованный от супервизора.
+
+Общее состояние:
+  * SQLite в WAL: запись сериализует блокировка базы (busy_timeout), группировка
+    покупок и heartbeat держит транзакции короткими;
+  * ChangeWatcher в каждом воркере следит за PRAGMA data_version и подтягивает
+    чужие покупки в рейтинги и новую версию данных в кэши ответов;
+  * платежи хранятся в таблице payments, выдача подарка атомарна через UPDATE;
+  * онлайн сводится через online_users раз в PRESENCE_SNAPSHOT_INTERVAL.
+
+Сигналы: SIGHUP — плавная перезагрузка (новые воркеры поднимаются до остановки
+старых), SIGTERM/SIGINT — плавная остановка, упавший воркер перезапускается.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+# Сколько ждем завершения воркера после SIGTERM, прежде чем убить (секунды)
+GRACEFUL_TIMEOUT = 30.0
+# Пауза перед перезапуском упавшего воркера, чтобы не уйти в цикл падений
+RESPAWN_DELAY = 1.0
+
+
+def create_socket(host, port, reuse_port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(slot, workers, host, port, sock):
+    """Тело дочернего процесса: импортирует приложение и обслуживает порт до SIGTERM"""
+    for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    os.environ['WEB_WORKERS'] = str(workers)
+    os.environ['WORKER_ID'] = str(slot)
+    if sock is None:
+        sock = create_socket(host, port, reuse_port=True)
+
+    from aiohttp import web
+    import main
+
+    web.run_app(main.init_app(), sock=sock, shutdown_timeout=GRACEFUL_TIMEOUT, print=None)
+
+
+class Supervisor:
+    """Держит workers процессов, перезапускает упавшие и меняет поколения по SIGHUP"""
+
+    def __init__(self, workers, host='0.0.0.0', port=8080, reuse_port=None):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        if reuse_port is None:
+            reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        self.reuse_port = reuse_port
+
+        self.sock = None
+        # pid -> (слот, поколение)
+        self.children = {}
+        self.generation = 0
+        self._stopping = False
+        self._reload = False
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(slot, self.workers, self.host, self.port, self.sock)
+            except BaseException as e:
+                print(f"Worker {slot} failed: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = (slot, self.generation)
+        return pid
+
+    def _terminate(self, pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self, block=False):
+        """Собирает завершившиеся процессы: [(pid, слот, поколение, код)]"""
+        finished = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot, generation = self.children.pop(pid, (None, None))
+            finished.append((pid, slot, generation, os.waitstatus_to_exitcode(status)))
+            block = False
+        return finished
+
+    def reload(self):
+        """Новое поколение воркеров, затем плавная остановка старого"""
+        old = list(self.children)
+        self.generation += 1
+        for slot in range(self.workers):
+            self.spawn(slot)
+        self._terminate(old)
+        print(f"Reloaded: generation {self.generation}, {self.workers} workers")
+
+    def stop(self):
+        self._terminate(list(self.children))
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGKILL)
+        self._reap(block=True)
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._reload = True
+        else:
+            self._stopping = True
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = create_socket(self.host, self.port, reuse_port=False)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        for slot in range(self.workers):
+            self.spawn(slot)
+        mode = 'SO_REUSEPORT' if self.reuse_port else 'shared socket'
+        print(f"Supervisor {os.getpid()}: {self.workers} workers on {self.host}:{self.port} ({mode})")
+
+        while not self._stopping:
+            if self._reload:
+                self._reload = False
+                self.reload()
+            for pid, slot, generation, code in self._reap():
+                # Старое поколение после перезагрузки выходит штатно, перезапускаем только текущее
+                if generation == self.generation and not self._stopping:
+                    print(f"Worker {pid} (slot {slot}) exited with {code}, restarting")
+                    time.sleep(RESPAWN_DELAY)
+                    self.spawn(slot)
+            time.sleep(0.2)
+
+        self.stop()
+        if self.sock is not None:
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-fork супервизор воркеров aiohttp')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)))
+    parser.add_argument('--shared-socket', action='store_true',
+                        help='один унаследованный сокет вместо SO_REUSEPORT')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    Supervisor(args.workers, args.host, args.port, reuse_port=False if args.shared_socket else None).run()
+
+
+if __name__ == '__main__':
+    main()
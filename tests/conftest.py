@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Модули приложения лежат в корне репозитория, как и для benchmarks/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,103 @@
+# tests/test_catalog_index.py
+import asyncio
+
+import pytest
+
+import webapp_api
+from api_router import ApiError
+from catalog_index import CatalogIndex
+from pricing import PricedCatalog
+
+
+def make_listings(count, prefix='gift'):
+    # Цены с повторами: порядок внутри одной цены задает id
+    return [{'id': f'{prefix}{i:03d}', 'name': f'Lamp {i}', 'base_price': 10 + i % 7} for i in range(count)]
+
+
+def make_index(listings):
+    return CatalogIndex(PricedCatalog.from_listings(listings, 0.05, 0.08, lambda digest: '/img/x.svg'))
+
+
+def walk(index, sort_by, limit, **kwargs):
+    """Все страницы подряд по курсорам"""
+    seen, cursor = [], None
+    while True:
+        gifts, cursor, total = index.search(sort_by=sort_by, cursor=cursor, limit=limit, **kwargs)
+        seen.extend(gift['id'] for gift in gifts)
+        if cursor is None:
+            return seen, total
+
+
+def expected_order(index):
+    return [gift['id'] for gift in sorted(index.gifts, key=lambda gift: (gift['total_price'], gift['id']))]
+
+
+@pytest.mark.parametrize('limit', [1, 3, 7, 50])
+def test_ascending_pages_cover_catalog_once(limit):
+    index = make_index(make_listings(25))
+    seen, total = walk(index, 'price_asc', limit)
+    assert total == 25
+    assert seen == expected_order(index)
+
+
+@pytest.mark.parametrize('limit', [1, 4, 50])
+def test_descending_pages_cover_catalog_once(limit):
+    index = make_index(make_listings(25))
+    seen, total = walk(index, 'price_desc', limit)
+    assert total == 25
+    assert seen == expected_order(index)[::-1]
+
+
+def test_pages_with_search_term_and_price_range():
+    index = make_index(make_listings(40))
+    seen, total = walk(index, 'price_asc', 2, search_term='lamp 1', min_price=11, max_price=15)
+    expected = [gift_id for gift_id in expected_order(index)
+                if 'lamp 1' in index.get(gift_id)['name'].lower() and 11 <= index.get(gift_id)['total_price'] <= 15]
+    assert seen == expected and total == len(expected)
+
+
+@pytest.mark.parametrize('sort_by', ['price_asc', 'price_desc'])
+def test_cursor_survives_catalog_rebuild(sort_by):
+    old = make_index(make_listings(25))
+    first, cursor, _ = old.search(sort_by=sort_by, limit=5)
+    last = first[-1]
+
+    # Новый каталог: часть подарков пропала, появились новые, в том числе с той же ценой
+    listings = make_listings(25)[3:] + make_listings(6, prefix='new')
+    rebuilt = make_index(listings)
+    rest = []
+    while cursor is not None:
+        gifts, cursor, _ = rebuilt.search(sort_by=sort_by, cursor=cursor, limit=5)
+        rest.extend(gift['id'] for gift in gifts)
+
+    key = (last['total_price'], last['id'])
+    order = expected_order(rebuilt)
+    if sort_by == 'price_asc':
+        expected = [gift_id for gift_id in order if (rebuilt.get(gift_id)['total_price'], gift_id) > key]
+    else:
+        expected = [gift_id for gift_id in order[::-1] if (rebuilt.get(gift_id)['total_price'], gift_id) < key]
+    assert rest == expected
+    assert not set(rest) & {gift['id'] for gift in first}
+
+
+@pytest.mark.parametrize('cursor', ['z8-_', '!!!!', 'bnVsbA', 'WzFd', 'WyJ4IiwxXQ'])
+def test_malformed_cursor_rejected(cursor):
+    index = make_index(make_listings(5))
+    with pytest.raises(ApiError, match='Invalid cursor'):
+        index.search(cursor=cursor, limit=2)
+
+
+def test_endpoint_clamps_limit_and_reports_bad_cursor(monkeypatch):
+    api = webapp_api.WebAppAPI()
+
+    async def load_all_gifts():
+        return make_listings(25)
+    api._load_all_gifts = load_all_gifts
+    monkeypatch.setattr(webapp_api, 'webapp_api', api)
+
+    negative = asyncio.run(webapp_api.search_gifts_endpoint({'limit': -3}))
+    assert negative['success'] is True
+    assert len(negative['data']) == 1 and negative['total'] == 25
+
+    broken = asyncio.run(webapp_api.search_gifts_endpoint({'cursor': 'z8-_'}))
+    assert broken == {'success': False, 'error': 'Invalid cursor'}
@@ -0,0 +1,67 @@
+# tests/test_commissions.py
+import asyncio
+
+import pytest
+
+import webapp_api
+from change_watcher import ChangeWatcher
+from database import StatisticsDB
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'stats.db')
+
+
+def make_api():
+    api = webapp_api.WebAppAPI()
+    api.market_commission, api.my_commission = 0.05, 0.08
+
+    async def load_all_gifts():
+        return [{'id': 'g1', 'name': 'Lamp', 'base_price': 100}]
+    api._load_all_gifts = load_all_gifts
+    return api
+
+
+def test_commissions_reach_other_worker_and_restart(db_path, monkeypatch):
+    first, second = StatisticsDB(db_path), StatisticsDB(db_path)
+    writer, reader = make_api(), make_api()
+    watcher = ChangeWatcher(second)
+    watcher.on_change(reader.sync_commissions)
+
+    async def scenario():
+        await reader.get_catalog()
+        await watcher.poll_once()
+        monkeypatch.setattr(webapp_api, 'stats_db', first)
+        await writer.update_commissions(market_commission=0.1)
+
+        # Второй воркер видит запись только через общую базу
+        monkeypatch.setattr(webapp_api, 'stats_db', second)
+        await watcher.poll_once()
+        gift = await reader.get_gift('g1')
+
+        restarted = make_api()
+        await restarted.sync_commissions()
+        return gift, restarted.get_commissions()
+
+    try:
+        gift, after_restart = asyncio.run(scenario())
+    finally:
+        first.close()
+        second.close()
+    assert reader.get_commissions() == {'market_commission': 0.1, 'my_commission': 0.08}
+    assert gift['total_price'] == 118.0
+    assert after_restart == {'market_commission': 0.1, 'my_commission': 0.08}
+
+
+@pytest.mark.parametrize('value', [-0.1, 1, float('nan'), float('inf'), 'abc'])
+def test_invalid_commission_rejected(db_path, monkeypatch, value):
+    db = StatisticsDB(db_path)
+    monkeypatch.setattr(webapp_api, 'stats_db', db)
+    api = make_api()
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(api.update_commissions(my_commission=value))
+        assert db.get_settings() == {}
+    finally:
+        db.close()
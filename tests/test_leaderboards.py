@@ -0,0 +1,57 @@
+# tests/test_leaderboards.py
+from leaderboards import Leaderboards, WindowedLeaderboard
+
+DAY = 740000
+
+
+def scores(board, limit=10):
+    return {key: (score, count) for key, score, count, _ in board.top(limit)}
+
+
+def test_windowed_board_subtracts_expired_days():
+    board = WindowedLeaderboard(days=7, capacity=2)
+    board.roll(DAY)
+    board.add('a', 50, day=DAY - 6)
+    board.add('b', 30, day=DAY - 1)
+    board.add('c', 20, day=DAY)
+    board.add('a', 5, day=DAY)
+    assert scores(board, limit=2) == {'a': (55, 2), 'b': (30, 1)}
+
+    # Корзина DAY - 6 выпадает из окна: у 'a' остаются только 5 за DAY, топ пересобирается
+    board.roll(DAY + 1)
+    assert scores(board, limit=2) == {'b': (30, 1), 'c': (20, 1)}
+    assert len(board) == 3
+
+    # Все корзины истекли: ключи с нулем покупок удаляются
+    board.roll(DAY + 8)
+    assert scores(board) == {}
+    assert len(board) == 0
+
+
+def test_windowed_board_ignores_days_outside_window():
+    board = WindowedLeaderboard(days=1, capacity=10)
+    board.roll(DAY)
+    board.add('a', 10, day=DAY - 1)
+    board.add('b', 10, day=DAY)
+    assert scores(board) == {'b': (10, 1)}
+
+
+def test_rollover_keeps_all_time_board():
+    boards = Leaderboards(capacity=10)
+    boards.record_purchases([('u1', 'one', 'g1', 'Gift 1', 40.0)], day=DAY - 1, today=DAY)
+    boards.record_purchases([('u2', 'two', 'g2', 'Gift 2', 10.0)], today=DAY)
+
+    assert scores(boards.buyers['today']) == {'u2': (10.0, 1)}
+    assert scores(boards.buyers['week']) == {'u1': (40.0, 1), 'u2': (10.0, 1)}
+
+    # Новый день: 'today' обнуляется, неделя еще держит обе покупки
+    boards.record_purchases([], today=DAY + 1)
+    assert scores(boards.buyers['today']) == {}
+    assert scores(boards.buyers['week']) == {'u1': (40.0, 1), 'u2': (10.0, 1)}
+
+    # Через неделю окно пусто, а рейтинг за все время не тронут
+    boards.record_purchases([], today=DAY + 7)
+    assert scores(boards.buyers['week']) == {}
+    assert scores(boards.gifts['week']) == {}
+    assert scores(boards.buyers['all']) == {'u1': (40.0, 1), 'u2': (10.0, 1)}
+    assert scores(boards.gifts['all']) == {'g1': (1, 1), 'g2': (1, 1)}
@@ -0,0 +1,126 @@
+# tests/test_payments.py
+import asyncio
+import time
+
+import pytest
+
+import webapp_api
+from database import StatisticsDB
+from payments import FakeChainSource, PaymentWatcher
+from purchase_recorder import PurchaseRecorder
+
+BUYER = {'user_id': 'u1', 'username': 'buyer', 'gift_id': 'g1', 'gift_name': 'Gift 1'}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = StatisticsDB(str(tmp_path / 'stats.db'))
+    yield db
+    db.close()
+
+
+def paid_payment(watcher, amount=2.0):
+    """Платеж, оплаченный переводом с его комментарием"""
+    payment = watcher.register(amount, **BUYER)
+    watcher.source.add_transfer(payment.comment, amount)
+    asyncio.run(watcher.poll_once())
+    return payment
+
+
+def test_transfer_matched_by_comment():
+    watcher = PaymentWatcher(FakeChainSource())
+    payment = watcher.register(2.0, **BUYER)
+    other = watcher.register(2.0, **BUYER)
+    watcher.source.add_transfer('unrelated', 5.0)
+    watcher.source.add_transfer(f'  {payment.comment} ', 2.0)
+
+    asyncio.run(watcher.poll_once())
+
+    assert watcher.check(payment.payment_id).status == 'paid'
+    assert payment.paid_amount == 2.0 and payment.tx_hash == 'fake-2'
+    assert watcher.check(other.payment_id).status == 'pending'
+    assert watcher.stats['matched'] == 1
+
+
+def test_underpayment_keeps_payment_pending():
+    watcher = PaymentWatcher(FakeChainSource())
+    payment = watcher.register(2.0, **BUYER)
+    watcher.source.add_transfer(payment.comment, 1.5)
+
+    asyncio.run(watcher.poll_once())
+
+    assert watcher.check(payment.payment_id).status == 'pending'
+    assert watcher.stats['underpaid'] == 1
+    assert watcher.consume(payment.payment_id) is None
+
+
+def test_expired_payment_ignores_late_transfer():
+    watcher = PaymentWatcher(FakeChainSource(), payment_ttl=60)
+    payment = watcher.register(2.0, **BUYER)
+    payment.created_at = time.time() - 61
+    watcher.source.add_transfer(payment.comment, 2.0)
+
+    asyncio.run(watcher.poll_once())
+
+    assert watcher.check(payment.payment_id).status == 'expired'
+    assert watcher.stats['expired'] == 1
+    assert watcher.stats['matched'] == 0
+
+
+@pytest.mark.parametrize('amount', [0, -1, float('nan'), float('inf')])
+def test_invalid_amount_rejected(amount):
+    watcher = PaymentWatcher(FakeChainSource())
+    with pytest.raises(ValueError):
+        watcher.register(amount, **BUYER)
+
+
+def test_claim_exactly_once_across_workers(db):
+    watcher = PaymentWatcher(FakeChainSource(), store=db)
+    payment = watcher.register(2.0, **BUYER)
+
+    async def scenario():
+        await db.run(db.save_payment, watcher._to_row(payment))
+        watcher.source.add_transfer(payment.comment, 2.0)
+        await watcher.poll_once()
+        # Второй воркер видит тот же платеж только через общую базу
+        other = PaymentWatcher(FakeChainSource(), store=db)
+        return await asyncio.gather(watcher.claim(payment.payment_id), other.claim(payment.payment_id),
+                                    watcher.claim(payment.payment_id))
+
+    claims = asyncio.run(scenario())
+    assert sum(claim is not None for claim in claims) == 1
+    assert db.get_payment(payment.payment_id)[4] == 'consumed'
+
+
+def test_failed_record_releases_payment(db, monkeypatch):
+    watcher = PaymentWatcher(FakeChainSource(), store=db)
+    recorder = PurchaseRecorder(db, max_delay=0)
+    monkeypatch.setattr(webapp_api, 'payment_watcher', watcher)
+    monkeypatch.setattr(webapp_api, 'purchase_recorder', recorder)
+
+    def busy(purchases):
+        raise TimeoutError('SQLite pool: no writer connection available')
+
+    async def scenario():
+        payment = await watcher.create(2.0, **BUYER)
+        watcher.source.add_transfer(payment.comment, 2.0)
+        await watcher.poll_once()
+
+        monkeypatch.setattr(db, 'register_purchases_batch', busy)
+        failed = await webapp_api.purchase_gift_endpoint({'payment_id': payment.payment_id})
+        status_after_failure = db.get_payment(payment.payment_id)[4]
+
+        monkeypatch.undo()
+        monkeypatch.setattr(webapp_api, 'payment_watcher', watcher)
+        monkeypatch.setattr(webapp_api, 'purchase_recorder', recorder)
+        retried = await webapp_api.purchase_gift_endpoint({'payment_id': payment.payment_id})
+        repeated = await webapp_api.purchase_gift_endpoint({'payment_id': payment.payment_id})
+        return failed, status_after_failure, retried, repeated
+
+    failed, status_after_failure, retried, repeated = asyncio.run(scenario())
+    assert failed['success'] is False
+    assert status_after_failure == 'paid'
+    assert retried['success'] is True
+    assert repeated['success'] is False
+    assert db.get_statistics()['giftsSold'] == 1
+    assert watcher.stats['released'] == 1
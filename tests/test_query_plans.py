@@ -0,0 +1,104 @@
+# tests/test_query_plans.py
+import sqlite3
+
+import pytest
+
+from database import QUERY_PLAN_CHECKS, QueryPlanError, StatisticsDB
+
+# Схема до версионных миграций: таблицы без индексов и schema_version
+LEGACY_SCHEMA = '''
+    CREATE TABLE users (
+        user_id TEXT PRIMARY KEY,
+        username TEXT,
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total_spent REAL DEFAULT 0,
+        total_purchases INTEGER DEFAULT 0
+    );
+    CREATE TABLE online_users (
+        user_id TEXT PRIMARY KEY,
+        last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE purchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        gift_name TEXT,
+        gift_id TEXT,
+        amount REAL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );
+    CREATE TABLE popular_gifts (
+        gift_id TEXT PRIMARY KEY,
+        gift_name TEXT,
+        total_sales INTEGER DEFAULT 0,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE daily_stats (
+        date TEXT PRIMARY KEY,
+        total_users INTEGER DEFAULT 0,
+        online_users INTEGER DEFAULT 0,
+        daily_turnover REAL DEFAULT 0,
+        gifts_sold INTEGER DEFAULT 0,
+        total_revenue REAL DEFAULT 0
+    );
+'''
+
+
+def fresh_plans(db_path):
+    """Планы с нового соединения, независимо от пула StatisticsDB"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return {name: ' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params))
+                for name, (query, params, _) in QUERY_PLAN_CHECKS.items()}
+    finally:
+        conn.close()
+
+
+def assert_indexed(db_path):
+    for name, plan in fresh_plans(db_path).items():
+        index = QUERY_PLAN_CHECKS[name][2]
+        assert index in plan, f'{name}: expected {index}, got plan {plan}'
+
+
+def test_new_database_uses_indexes(tmp_path):
+    db_path = str(tmp_path / 'stats.db')
+    db = StatisticsDB(db_path)
+    try:
+        assert_indexed(db_path)
+        db.check_query_plans()
+    finally:
+        db.close()
+
+
+def test_upgraded_legacy_database_uses_indexes(tmp_path):
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+
+    db = StatisticsDB(db_path, initialize=False)
+    # Читатель пула успевает загрузить старую схему, как при обновлении базы в работающем процессе
+    with db.open().reader() as reader:
+        reader.execute('SELECT COUNT(*) FROM users').fetchall()
+    db.init_database()
+    try:
+        assert_indexed(db_path)
+        # Отчет не должен зависеть от читателей пула, открытых до миграций
+        assert all(uses_index for uses_index, _ in db.explain_query_plans().values())
+        db.check_query_plans()
+    finally:
+        db.close()
+
+
+def test_check_query_plans_raises_without_indexes(tmp_path):
+    db_path = str(tmp_path / 'stats.db')
+    db = StatisticsDB(db_path)
+    try:
+        conn = sqlite3.connect(db_path)
+        conn.execute('DROP INDEX idx_users_total_spent')
+        conn.close()
+        with pytest.raises(QueryPlanError, match='top_buyers'):
+            db.check_query_plans()
+    finally:
+        db.close()
@@ -1,30 +1,103 @@
 # webapp_api.py
-import aiohttp
 import asyncio
-import json
-import time
-from datetime import datetime
-import aiofiles
+from datetime import date
 import os
-import base64
-import hashlib
+
+from cache import SWRCache
+from catalog_index import CatalogIndex
+from pricing import PricedCatalog, stable_hash
+from images import image_store
+from leaderboards import PERIODS
+from response_cache import response_cache
+
+# Размер страницы поиска по умолчанию и максимальный
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_MAX = 200
+
+# Цвета заглушек изображений: выбираются по стабильному хэшу имени
+PLACEHOLDER_COLORS = ['#667eea', '#764ba2', '#f093fb', '#f5576c', '#4facfe']
+
+# Имена комиссий в таблице settings и атрибутов WebAppAPI
+COMMISSION_SETTINGS = ('market_commission', 'my_commission')
+
+# Размер рейтингов по умолчанию и максимальный
+LEADERBOARD_LIMIT = 10
+LEADERBOARD_LIMIT_MAX = 100
 
 class WebAppAPI:
     def __init__(self):
-        self.cache = {}
-        self.cache_timeout = 300
+        self.cache_timeout = int(os.environ.get('GIFTS_CACHE_TTL', 300))
+        self.cache = SWRCache(
+            ttl=self.cache_timeout,
+            stale_ttl=int(os.environ.get('GIFTS_CACHE_STALE_TTL', 3600))
+        )
         self.images_cache = {}
-        self.my_commission = 0.08
-        self.market_commission = 0.05
+        self.my_commission = float(os.environ.get('MY_COMMISSION', 0.08))
+        self.market_commission = float(os.environ.get('MARKET_COMMISSION', 0.05))
         
     async def fetch_all_gifts(self):
-        cache_key = "all_gifts"
-        
-        if cache_key in self.cache:
-            cached_data, timestamp = self.cache[cache_key]
-            if time.time() - timestamp < self.cache_timeout:
-                return cached_data
-        
+        """Общий снимок каталога; списки из кэша нельзя изменять на месте"""
+        catalog = await self.get_catalog()
+        return catalog.gifts
+    
+    async def get_catalog(self):
+        """Индекс каталога, перестраивается только при обновлении кэша"""
+        return await self.cache.get("all_gifts", self._load_catalog)
+    
+    async def get_gift(self, gift_id):
+        """Подарок из каталога по id; цена берется отсюда, а не из запроса клиента"""
+        catalog = await self.get_catalog()
+        return catalog.get(gift_id)
+    
+    async def _load_catalog(self):
+        catalog = PricedCatalog.from_listings(
+            await self._load_all_gifts(), self.market_commission, self.my_commission, self._placeholder_url
+        )
+        return CatalogIndex(catalog)
+    
+    def set_commissions(self, market_commission=None, my_commission=None):
+        """Меняет комиссии и пересчитывает цены загруженного каталога без его пересборки"""
+        if market_commission is not None:
+            self.market_commission = float(market_commission)
+        if my_commission is not None:
+            self.my_commission = float(my_commission)
+        catalog = self.cache.peek("all_gifts")
+        if catalog is not None:
+            catalog.reprice(self.market_commission, self.my_commission)
+    
+    def get_commissions(self):
+        return {name: getattr(self, name) for name in COMMISSION_SETTINGS}
+    
+    @staticmethod
+    def check_commission(value):
+        """Комиссия как float в [0, 1); ValueError для nan/inf и значений вне диапазона"""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid commission: {value!r}')
+        if not (0 <= value < 1):
+            raise ValueError(f'Invalid commission: {value!r}')
+        return value
+    
+    async def update_commissions(self, market_commission=None, my_commission=None):
+        """Сохраняет комиссии в базе и применяет их здесь; другие воркеры подхватят их через ChangeWatcher"""
+        values = {name: self.check_commission(value)
+                  for name, value in zip(COMMISSION_SETTINGS, (market_commission, my_commission))
+                  if value is not None}
+        if values:
+            await stats_db.run(stats_db.save_settings, values)
+            self.set_commissions(**values)
+        return self.get_commissions()
+    
+    async def sync_commissions(self):
+        """Применяет сохраненные в базе комиссии, если они отличаются от текущих (значения из env)"""
+        settings = await stats_db.run(stats_db.get_settings)
+        values = {name: settings[name] for name in COMMISSION_SETTINGS
+                  if name in settings and settings[name] != getattr(self, name)}
+        if values:
+            self.set_commissions(**values)
+    
+    async def _load_all_gifts(self):
         try:
             await asyncio.sleep(1)
             return await self._get_realistic_fallback_data()
@@ -33,9 +106,11 @@ class WebAppAPI:
             print(f"API Error: {e}")
             return await self._get_realistic_fallback_data()
     
-    def _generate_placeholder(self, gift_name):
-        colors = ['#667eea', '#764ba2', '#f093fb', '#f5576c', '#4facfe']
-        color = colors[hash(gift_name) % len(colors)]
+    def _placeholder_url(self, name_hash):
+        # Заглушка зависит только от цвета: на весь каталог рисуется не больше пяти картинок
+        color = PLACEHOLDER_COLORS[name_hash % len(PLACEHOLDER_COLORS)]
+        if color in self.images_cache:
+            return self.images_cache[color]
         
         svg = f'''
         <svg width="120" height="120" viewBox="0 0 120 120" fill="none" xmlns="http://www.w3.org/2000/svg">
@@ -45,13 +120,9 @@ class WebAppAPI:
         </svg>
         '''
         
-        return f"data:image/svg+xml;base64,{base64.b64encode(svg.encode()).decode()}"
-    
-    def _determine_rarity(self, price):
-        if price > 100: return 'legendary'
-        elif price > 60: return 'epic'
-        elif price > 35: return 'rare'
-        else: return 'common'
+        url = image_store.put(svg.encode())
+        self.images_cache[color] = url
+        return url
     
     async def _get_realistic_fallback_data(self):
         realistic_gifts = [
@@ -62,28 +133,8 @@ class WebAppAPI:
             "Evil Eye", "Flying Broom", "Fresh Socks", "Gem Signet", "Genie Lamp"
         ]
         
-        gifts = []
-        for name in realistic_gifts:
-            base_price = self._get_realistic_price(name)
-            market_fee = base_price * self.market_commission
-            my_fee = base_price * self.my_commission
-            total_price = base_price + market_fee + my_fee
-            
-            gifts.append({
-                'id': f"real_{hash(name)}",
-                'name': name,
-                'base_price': base_price,
-                'market_fee': round(market_fee, 2),
-                'my_fee': round(my_fee, 2),
-                'total_price': round(total_price, 2),
-                'image_url': self._generate_placeholder(name),
-                'market': 'Portals',
-                'attributes': {'model': name},
-                'is_transferable': True,
-                'rarity': self._determine_rarity(base_price),
-                'sales_count': (hash(name) % 50) + 1
-            })
-        return gifts
+        # Только листинги: комиссии, итог и редкость считает PricedCatalog сразу по всем столбцам
+        return [{'name': name, 'base_price': self._get_realistic_price(name)} for name in realistic_gifts]
     
     def _get_realistic_price(self, gift_name):
         price_ranges = {
@@ -96,33 +147,34 @@ class WebAppAPI:
         if gift_name in price_ranges:
             return price_ranges[gift_name]
         
-        base_price = (hash(gift_name) % 80) + 20
+        base_price = (stable_hash(gift_name) % 80) + 20
         return float(base_price)
     
     async def search_gifts(self, search_term=None, max_price=None, min_price=None, sort_by='price_asc'):
-        all_gifts = await self.fetch_all_gifts()
-        
-        filtered_gifts = all_gifts
-        
-        if search_term:
-            filtered_gifts = [g for g in filtered_gifts if search_term.lower() in g['name'].lower()]
-        
-        if min_price:
-            filtered_gifts = [g for g in filtered_gifts if g['total_price'] >= min_price]
-        if max_price:
-            filtered_gifts = [g for g in filtered_gifts if g['total_price'] <= max_price]
-        
-        if sort_by == 'price_asc':
-            filtered_gifts.sort(key=lambda x: x['total_price'])
-        elif sort_by == 'price_desc':
-            filtered_gifts.sort(key=lambda x: x['total_price'], reverse=True)
-        
-        return filtered_gifts
+        gifts, _, _ = await self.search_gifts_page(search_term, max_price, min_price, sort_by)
+        return gifts
+    
+    async def search_gifts_page(self, search_term=None, max_price=None, min_price=None, sort_by='price_asc',
+                                cursor=None, limit=None):
+        """Страница поиска: (подарки, курсор следующей страницы, всего совпадений)"""
+        catalog = await self.get_catalog()
+        return catalog.search(
+            search_term=search_term,
+            min_price=min_price,
+            max_price=max_price,
+            sort_by=sort_by,
+            cursor=cursor,
+            limit=limit
+        )
 
 webapp_api = WebAppAPI()
 
 # API endpoints
 from database import stats_db
+from activity_buffer import activity_buffer
+from purchase_recorder import purchase_recorder
+from payments import payment_watcher
+from change_watcher import change_watcher
 
 async def register_activity_endpoint(data):
     try:
@@ -130,7 +182,7 @@ async def register_activity_endpoint(data):
         username = data.get('username')
         
         if user_id:
-            stats_db.register_user_activity(user_id, username)
+            activity_buffer.add(user_id, username)
             return {'success': True, 'message': 'Activity registered'}
         else:
             return {'success': False, 'error': 'User ID required'}
@@ -146,47 +198,96 @@ async def register_purchase_endpoint(data):
         amount = data.get('amount')
         
         if all([user_id, gift_id, gift_name, amount]):
-            stats_db.register_purchase(user_id, username, gift_id, gift_name, amount)
+            await purchase_recorder.record(user_id, username, gift_id, gift_name, stats_db.check_amount(amount))
             return {'success': True, 'message': 'Purchase registered'}
         else:
             return {'success': False, 'error': 'Missing required fields'}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+# Версии данных для кэша ответов: меняются при записи в базу, смене дня и обновлении каталога
+async def statistics_version():
+    return (stats_db.data_version, stats_db.presence.count(), date.today().toordinal())
+
+async def leaderboard_version():
+    return (stats_db.data_version, date.today().toordinal())
+
+async def catalog_version():
+    return (await webapp_api.get_catalog()).version
+
 async def get_statistics_endpoint():
     try:
-        stats = stats_db.get_statistics()
+        stats = await stats_db.run(stats_db.get_statistics)
         return {'success': True, 'data': stats}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-async def get_top_buyers_endpoint():
+def _leaderboard_args(data):
+    limit = max(1, min(int(data.get('limit') or LEADERBOARD_LIMIT), LEADERBOARD_LIMIT_MAX))
+    period = data.get('period') or 'all'
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    return limit, period
+
+async def get_top_buyers_endpoint(data):
     try:
-        buyers = stats_db.get_top_buyers()
+        # Рейтинг в памяти отвечает за O(K), без похода в пул потоков
+        limit, period = _leaderboard_args(data)
+        buyers = stats_db.get_top_buyers(limit, period)
         return {'success': True, 'data': buyers}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-async def get_popular_gifts_endpoint():
+async def get_popular_gifts_endpoint(data):
     try:
-        gifts = stats_db.get_popular_gifts()
+        limit, period = _leaderboard_args(data)
+        gifts = stats_db.get_popular_gifts(limit, period)
         return {'success': True, 'data': gifts}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+async def get_db_metrics_endpoint():
+    try:
+        return {'success': True, 'data': {
+            'pool': stats_db.get_pool_metrics(),
+            'activity_buffer': activity_buffer.get_stats(),
+            'purchase_recorder': purchase_recorder.get_stats(),
+            'leaderboards': stats_db.leaderboards.get_stats(),
+            'change_watcher': change_watcher.get_stats()
+        }}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+async def get_cache_stats_endpoint():
+    try:
+        return {'success': True, 'data': webapp_api.cache.get_stats()}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+async def get_response_cache_stats_endpoint():
+    try:
+        return {'success': True, 'data': response_cache.get_stats()}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
 async def search_gifts_endpoint(data):
     try:
         search_term = data.get('search_term')
-        max_price = data.get('max_price')
-        min_price = data.get('min_price')
+        # Пустые и нулевые границы цены игнорируются, как и раньше
+        max_price = float(data['max_price']) if data.get('max_price') else None
+        min_price = float(data['min_price']) if data.get('min_price') else None
+        limit = max(1, min(int(data.get('limit') or SEARCH_PAGE_SIZE), SEARCH_PAGE_MAX))
         
-        gifts = await webapp_api.search_gifts(
+        gifts, next_cursor, total = await webapp_api.search_gifts_page(
             search_term=search_term,
             max_price=max_price,
-            min_price=min_price
+            min_price=min_price,
+            sort_by=data.get('sort_by') or 'price_asc',
+            cursor=data.get('cursor'),
+            limit=limit
         )
         
-        return {'success': True, 'data': gifts}
+        return {'success': True, 'data': gifts, 'next_cursor': next_cursor, 'total': total}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
@@ -199,27 +300,51 @@ async def get_all_gifts_endpoint():
 
 async def check_payment_endpoint(data):
     try:
-        await asyncio.sleep(1)
-        import random
-        payment_found = random.random() < 0.7
+        payment_id = data.get('payment_id')
+        if not payment_id:
+            return {'success': False, 'message': 'Payment ID required'}
+        
+        # Ответ из таблицы состояний: блокчейн опрашивает фоновый PaymentWatcher
+        payment = await payment_watcher.lookup(payment_id)
+        if payment is None:
+            return {'success': False, 'message': 'Платеж не найден'}
         
+        paid = payment.status in ('paid', 'consumed')
         return {
             'success': True,
-            'paid': payment_found,
-            'message': 'Оплата подтверждена' if payment_found else 'Оплата не найдена'
+            'paid': paid,
+            'status': payment.status,
+            'message': 'Оплата подтверждена' if paid else 'Оплата не найдена'
         }
     except Exception as e:
         return {'success': False, 'message': f'Ошибка: {str(e)}'}
 
 async def purchase_gift_endpoint(data):
     try:
-        await asyncio.sleep(1)
-        import random
-        success = random.random() < 0.8
+        payment = await payment_watcher.claim(data.get('payment_id'))
+        if payment is None:
+            return {'success': False, 'message': 'Оплата не найдена'}
+        
+        # Платеж уже помечен использованным: если покупка не записалась, возвращаем его для повтора
+        details = payment.details
+        try:
+            await purchase_recorder.record(
+                details['user_id'], details.get('username'),
+                details['gift_id'], details.get('gift_name'), payment.amount
+            )
+        except Exception:
+            await payment_watcher.release(payment)
+            raise
         
         return {
-            'success': success,
-            'message': 'Подарок успешно приобретен' if success else 'Ошибка при покупке'
+            'success': True,
+            'message': 'Подарок успешно приобретен'
         }
     except Exception as e:
         return {'success': False, 'message': f'Ошибка: {str(e)}'}
+
+async def get_payment_stats_endpoint():
+    try:
+        return {'success': True, 'data': payment_watcher.get_stats()}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}